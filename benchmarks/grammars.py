@@ -0,0 +1,70 @@
+# The grammars of the benchmarks, taken from readme.md and examplescripts/.
+# rules are (pattern, result, condition) and constants are applied to the
+# rules the same way as Exec.define. iterations are the numbers of iterations
+# each grammar is run with.
+
+GRAMMARS = {
+    "fractal_plant": {
+        "axiom": "X",
+        "rules": [("X", "F-[[X]+X]+F[+FX]-X", None),
+                  ("F", "FF", None)],
+        "angle": 25,
+        "iterations": [4, 6, 8],
+    },
+    "bush": {
+        "axiom": "p(skin)A",
+        "rules": [("A", "[&FaL!A]/////[\\FaL!A]///////[&FaL!A]", None),
+                  ("Fa", "S/////Fa", None),
+                  ("S", "FaL", None),
+                  ("L", "[^^:p(surface)-F+F+F-+(180)-F+F+F;]", None)],
+        "angle": 22.5,
+        "iterations": [5, 7, 8],
+    },
+    "sierpinski": {
+        "axiom": "p(curve)Fr",
+        "rules": [("Fa", "Fr+Fa+Fr", None),
+                  ("Fr", "Fa-Fr-Fa", None)],
+        "angle": 60,
+        "iterations": [6, 8, 10],
+    },
+    "capsella": {
+        "axiom": "p(subsurf)I(9)aa(13)",
+        "rules": [("aa(t)", "[&(70)L]/(137.5)I(10)aa(sub(t,1))", "gt(t,0)"),
+                  ("aa(t)", "[&(70)L]/(137.5)I(10)A", "eq(t,0)"),
+                  ("A", "[&(18)uu(4)FFI(10)I(5)X(5)KKKK]/(137.5)I(8)A", None),
+                  ("I(t)", "FI(sub(t,1))", "gt(t,0)"),
+                  ("I(t)", "F", "eq(t,0)"),
+                  ("ii(t)", "fii(sub(t,1))", "gt(t,0)"),
+                  ("ii(t)", "f", "eq(t,0)"),
+                  ("uu(t)", "&(9)uu(sub(t,1))", "gt(t,0)"),
+                  ("uu(t)", "&(9)", "eq(t,0)"),
+                  ("L", "[:p(surface)F(0)-FI(7)+FI(7)+FI(7);][:p(surface)F(0)+FI(7)-FI(7)-FI(7);]", None),
+                  ("K", "[&:p(surface)F(0)+FI(2)--FI(2);][&:p(surface)F(0)-FI(2)++FI(2);]/(90)", None),
+                  ("X(t)", "X(sub(t,1))", "gt(t,0)"),
+                  ("X(t)", "^(50):p(surface)[[-ffff++[fff[++f{F(0)]F(0)]F(0)]F(0)++ffffF(0)--fffF(0)--fF(0)}];%",
+                   "eq(t,0)")],
+        "angle": 25,
+        "iterations": [8, 16, 24],
+    },
+    "rose_leaf": {
+        "axiom": "p(surface)s(0.01)[:A(0,0)F(0);][:A(0,1)F(0);]",
+        "rules": [("A(t,d)", "F(0)f(LA,RA)F(0)[+B(t)f(LC,RC,t)F(0);][+B(t):F(0)]A(add(t,1),d)", "eq(d,0)"),
+                  ("A(t,d)", "F(0)f(LA,RA)F(0)[-B(t)f(LC,RC,t)F(0);][-B(t):F(0)]A(add(t,1),d)", "eq(d,1)"),
+                  ("B(t)", "f(LB,RB)B(sub(t,1))", "gt(t,0)"),
+                  ("f(s,r)", "f(mul(s,r),r)", None),
+                  ("f(s,r,t)", "f(mul(s,r),r,sub(t,1))", "gt(t,1)")],
+        "constants": {"LA": "5", "RA": "1.15", "LB": "1.3", "RB": "1.25", "LC": "3", "RC": "1.19"},
+        "angle": 60,
+        "iterations": [15, 25, 35],
+    },
+    "visual_models_4_2_3": {
+        "axiom": "p(edge)¤(w0)f(0)A(10,w0)",
+        "rules": [("A(s,w)", "¤(w)F(s)[+(a1)/(f1)A(mul(s,r1),mul(w,pow(q0,e0)))]"
+                             "[+(a2)/(f2)A(mul(s,r2),mul(w,pow(sub(1,q0),e0)))]", "gteq(s,min)")],
+        # column 2 of the table in the script
+        "constants": {"r1": "0.50", "r2": "0.85", "a1": "25", "a2": "-15", "f1": "180", "f2": "0",
+                      "w0": "2", "q0": "0.45", "e0": "0.50", "min": "0.5"},
+        "angle": 25,
+        "iterations": [9, 12, 14],
+    },
+}
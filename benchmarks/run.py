@@ -0,0 +1,230 @@
+"""Benchmarks of the grammars in grammars.py
+
+Derivation runs in plain Python and is measured in modules/sec. The derived
+modules are interpreted with the turtle of lsystem.core, one module at a time
+and with numpy, measured in segments/sec. The geometry part interprets them
+with the Blender turtle and pens, it only runs if bpy and mathutils can be
+imported, ie with the bpy module from pip.
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --output new.json --compare results.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+from grammars import GRAMMARS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import lsystem.core
+import lsystem.lsystem
+
+
+def load_geometry():
+    """Return the lsystem.exec module or None if bpy isn't available"""
+    try:
+        import bpy
+        import mathutils
+    except ImportError:
+        return None
+    import lsystem.exec
+    return lsystem.exec
+
+
+def has_numpy():
+    """Return if numpy is installed, batch mode and interpret_arrays need it"""
+    try:
+        lsystem.lsystem.import_numpy("benchmarks")
+    except ImportError:
+        return False
+    return True
+
+
+def make_lsystem(grammar):
+    constants = grammar.get("constants", {})
+    axiom = lsystem.lsystem.ProductionRule("", grammar["axiom"]).copy_replace(constants)
+    rules = [lsystem.lsystem.ProductionRule(pattern, result, condition).copy_replace(constants)
+             for pattern, result, condition in grammar["rules"]]
+    return axiom, rules
+
+
+def best_time(func, repeat):
+    best = None
+    result = None
+    for i in range(0, repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def bench_derive(grammar, iterations, repeat, options):
+    axiom, rules = make_lsystem(grammar)
+
+    def derive():
+        # a new LSystem each time so the memoized expansions start out empty,
+        # the modules are iterated since a memoized derivation is lazy
+        lsys = lsystem.lsystem.LSystem(axiom, rules, None)
+        for key, value in options.items():
+            setattr(lsys, key, value)
+        return list(lsys.derive(0, iterations, random.Random(0)))
+
+    seconds, modules = best_time(derive, repeat)
+    return {"modules": len(modules),
+            # longer names are interpreted one symbol at a time, ie Fa is F and a
+            "segments": sum(module[0].count("F") for module in modules),
+            "seconds": seconds,
+            "modules_per_sec": len(modules) / seconds if seconds > 0 else None}
+
+
+def bench_turtle(grammar, iterations, repeat):
+    """Interpret the modules with the turtle of lsystem.core"""
+    axiom, rules = make_lsystem(grammar)
+    modules = list(lsystem.lsystem.LSystem(axiom, rules, None).derive(0, iterations, random.Random(0)))
+
+    def interpret():
+        turtle = lsystem.core.Turtle(0)
+        turtle.set_angle(math.radians(grammar["angle"]))
+        return turtle.interpret(modules)
+
+    seconds, obj_base_pairs = best_time(interpret, repeat)
+    segments = sum(len(obj.segments) for obj, base in obj_base_pairs)
+    return {"segments": segments,
+            "seconds": seconds,
+            "segments_per_sec": segments / seconds if seconds > 0 else None}
+
+
+def bench_arrays(grammar, iterations, repeat):
+    """Interpret the modules with Turtle.interpret_arrays of lsystem.core"""
+    axiom, rules = make_lsystem(grammar)
+    modules = list(lsystem.lsystem.LSystem(axiom, rules, None).derive(0, iterations, random.Random(0)))
+
+    def interpret():
+        turtle = lsystem.core.Turtle(0)
+        turtle.set_angle(math.radians(grammar["angle"]))
+        return turtle.interpret_arrays(modules)
+
+    seconds, segments = best_time(interpret, repeat)
+    return {"segments": len(segments),
+            "seconds": seconds,
+            "segments_per_sec": len(segments) / seconds if seconds > 0 else None}
+
+
+def bench_geometry(exec_module, grammar, iterations, segments):
+    import bpy
+    axiom, rules = make_lsystem(grammar)
+    report = lsystem.lsystem.Report()
+    objects = exec_module.execute(bpy.context, axiom, rules, None, min_iterations=iterations,
+                                  max_iterations=iterations, angle=math.radians(grammar["angle"]), report=report)
+    for obj in objects:
+        lsystem.util.remove_object(obj)
+    seconds = report.timings["interpret"]
+    return {"segments": segments,
+            "seconds": seconds,
+            "vertices": report.counters["vertices"],
+            "faces": report.counters["faces"],
+            "timings": dict(report.timings),
+            "segments_per_sec": segments / seconds if seconds > 0 else None}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    old = dict(((r["grammar"], r["iterations"], r["mode"]), r) for r in baseline["derive"])
+    print("\nchange against {}".format(baseline.get("commit")))
+    for r in results["derive"]:
+        previous = old.get((r["grammar"], r["iterations"], r["mode"]))
+        if previous is None or not previous["modules_per_sec"] or not r["modules_per_sec"]:
+            continue
+        ratio = r["modules_per_sec"] / previous["modules_per_sec"]
+        print("{:22} {:3} {:10} {:6.2f}x".format(r["grammar"], r["iterations"], r["mode"], ratio))
+    for part in ("turtle", "arrays", "geometry"):
+        old = dict(((r["grammar"], r["iterations"]), r) for r in baseline.get(part, []))
+        for r in results.get(part, []):
+            previous = old.get((r["grammar"], r["iterations"]))
+            if previous is None or not previous["segments_per_sec"] or not r["segments_per_sec"]:
+                continue
+            ratio = r["segments_per_sec"] / previous["segments_per_sec"]
+            print("{:22} {:3} {:10} {:6.2f}x".format(r["grammar"], r["iterations"], part, ratio))
+
+
+MODES = {
+    "default": {},
+    "no_memoize": {"memoize": False},
+    "batch": {"batch": True},
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="write the results to this json file")
+    parser.add_argument("--compare", help="json file from an earlier run to compare with")
+    parser.add_argument("--grammar", action="append", choices=sorted(GRAMMARS), help="only run these grammars")
+    parser.add_argument("--mode", action="append", choices=sorted(MODES), help="derivation modes, default is all")
+    parser.add_argument("--repeat", type=int, default=3, help="use the best of this many runs")
+    parser.add_argument("--quick", action="store_true", help="only the smallest number of iterations")
+    args = parser.parse_args(argv)
+
+    exec_module = load_geometry()
+    modes = args.mode or sorted(MODES)
+    numpy_installed = has_numpy()
+    if not numpy_installed and "batch" in modes:
+        modes.remove("batch")
+
+    results = {"commit": git_commit(), "python": platform.python_version(), "derive": [], "turtle": [],
+               "arrays": [], "geometry": []}
+    for name in args.grammar or sorted(GRAMMARS):
+        grammar = GRAMMARS[name]
+        iterations_list = grammar["iterations"][:1] if args.quick else grammar["iterations"]
+        for iterations in iterations_list:
+            for mode in modes:
+                result = bench_derive(grammar, iterations, args.repeat, MODES[mode])
+                result.update(grammar=name, iterations=iterations, mode=mode)
+                results["derive"].append(result)
+                print("{:22} {:3} {:10} {:10} modules {:9.4f}s {:12.0f} modules/sec".format(
+                    name, iterations, mode, result["modules"], result["seconds"], result["modules_per_sec"]))
+            result = bench_turtle(grammar, iterations, args.repeat)
+            result.update(grammar=name, iterations=iterations)
+            results["turtle"].append(result)
+            print("{:22} {:3} {:10} {:10} segments {:8.4f}s {:12.0f} segments/sec".format(
+                name, iterations, "turtle", result["segments"], result["seconds"], result["segments_per_sec"]))
+            if numpy_installed:
+                result = bench_arrays(grammar, iterations, args.repeat)
+                result.update(grammar=name, iterations=iterations)
+                results["arrays"].append(result)
+                print("{:22} {:3} {:10} {:10} segments {:8.4f}s {:12.0f} segments/sec".format(
+                    name, iterations, "arrays", result["segments"], result["seconds"], result["segments_per_sec"]))
+            if exec_module is not None:
+                result = bench_geometry(exec_module, grammar, iterations, results["derive"][-1]["segments"])
+                result.update(grammar=name, iterations=iterations)
+                results["geometry"].append(result)
+                print("{:22} {:3} {:10} {:10} segments {:8.4f}s {:12.0f} segments/sec".format(
+                    name, iterations, "geometry", result["segments"], result["seconds"], result["segments_per_sec"]))
+    if exec_module is None:
+        print("bpy isn't available, skipped the geometry benchmarks")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
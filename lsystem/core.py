@@ -0,0 +1,1081 @@
+# The turtle without Blender. Turtle interprets the modules of an lsystem the
+# same way as turtle.Turtle but with plain Python math and records the branches
+# as line segments in a Skeleton instead of meshes. turtle.Turtle builds on it
+# with mathutils matrices and pens.
+import array
+import copy
+import logging
+import math
+import random
+from math import radians
+from math import pi
+from math import acos
+
+from . import lsystem
+
+logger = logging.getLogger(__name__)
+
+# 4x4 matrices are tuples of rows like mathutils.Matrix. The orientation of
+# the turtle is a frame of three column vectors, its x, y and z (heading) axes
+
+IDENTITY = ((1.0, 0.0, 0.0, 0.0),
+            (0.0, 1.0, 0.0, 0.0),
+            (0.0, 0.0, 1.0, 0.0),
+            (0.0, 0.0, 0.0, 1.0))
+
+UP = (0.0, 0.0, 1.0)
+
+FRAME = ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0))
+
+# the number of angles whose sine and cosine a turtle keeps
+MAX_ROTATIONS = 1024
+
+
+def matmul(a, b):
+    return tuple(tuple(row[0] * b[0][j] + row[1] * b[1][j] + row[2] * b[2][j] + row[3] * b[3][j] for j in range(0, 4))
+                 for row in a)
+
+
+def transform_point(m, v):
+    x, y, z = v
+    return (m[0][0] * x + m[0][1] * y + m[0][2] * z + m[0][3],
+            m[1][0] * x + m[1][1] * y + m[1][2] * z + m[1][3],
+            m[2][0] * x + m[2][1] * y + m[2][2] * z + m[2][3])
+
+
+def location(m):
+    return m[0][3], m[1][3], m[2][3]
+
+
+def column(m, j):
+    return m[0][j], m[1][j], m[2][j]
+
+
+def dot(a, b):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+
+def cross(a, b):
+    return (a[1] * b[2] - a[2] * b[1],
+            a[2] * b[0] - a[0] * b[2],
+            a[0] * b[1] - a[1] * b[0])
+
+
+def normalized(v):
+    """v with length 1, or v if it has no length like mathutils.Vector.normalized"""
+    length = math.sqrt(dot(v, v))
+    if length == 0.0:
+        return v
+    return v[0] / length, v[1] / length, v[2] / length
+
+
+def rotation(angle, axis):
+    """The same matrix as mathutils.Matrix.Rotation(angle, 4, axis)"""
+    x, y, z = axis
+    length = math.sqrt(x * x + y * y + z * z)
+    if length == 0.0:
+        return IDENTITY
+    x, y, z = x / length, y / length, z / length
+    c = math.cos(angle)
+    s = math.sin(angle)
+    t = 1.0 - c
+    return ((t * x * x + c, t * x * y - s * z, t * x * z + s * y, 0.0),
+            (t * x * y + s * z, t * y * y + c, t * y * z - s * x, 0.0),
+            (t * x * z - s * y, t * y * z + s * x, t * z * z + c, 0.0),
+            (0.0, 0.0, 0.0, 1.0))
+
+
+def rotate_frame(frame, r):
+    """frame @ r where r is a 3x3 matrix of rows"""
+    x, y, z = frame
+    return tuple((x[0] * r[0][j] + y[0] * r[1][j] + z[0] * r[2][j],
+                  x[1] * r[0][j] + y[1] * r[1][j] + z[1] * r[2][j],
+                  x[2] * r[0][j] + y[2] * r[1][j] + z[2] * r[2][j]) for j in range(0, 3))
+
+
+def rotation_between(a, b):
+    """The rotation from the direction of a to the direction of b, like
+    a.rotation_difference(b).to_matrix().to_4x4()"""
+    a = normalized(a)
+    b = normalized(b)
+    axis = cross(a, b)
+    cos_angle = max(-1.0, min(1.0, dot(a, b)))
+    if dot(axis, axis) == 0.0:
+        if cos_angle > 0.0:
+            return IDENTITY
+        # opposite directions, any axis orthogonal to a will do
+        axis = cross(a, (1.0, 0.0, 0.0) if abs(a[0]) < 0.9 else (0.0, 1.0, 0.0))
+    return rotation(acos(cos_angle), axis)
+
+
+class Skeleton:
+    """The branches of an object as (start, end, radius) segments, the
+    counterpart of turtle.BlObject"""
+    def __init__(self, radius, name="lsystem", report=lsystem.NULL_REPORT):
+        self.report = report
+        self.name = name
+        self.stack = []
+        self.radius = radius
+        self.current_radius = radius
+        self.pen = None
+        self.material = None
+        self.position = None
+        self.segments = []
+        self.transforms = []  # the transform at the end of each segment
+        self.object = self
+        self.parent = None
+
+    def set_pen(self, name, transform):
+        self.pen = name
+        self.start_new_mesh_part(transform)
+
+    def set_material(self, name):
+        self.material = name
+
+    def scale_radius(self, scale):
+        self.current_radius *= scale
+
+    def set_radius(self, radius):
+        self.current_radius = radius
+
+    def get_radius(self):
+        return self.current_radius
+
+    def push(self, state):
+        self.stack.append((state, self.position, self.current_radius))
+
+    def pop(self):
+        if not self.stack:
+            return None
+        state, self.position, self.current_radius = self.stack.pop()
+        return state
+
+    def start_new_mesh_part(self, transform):
+        self.current_radius = self.radius
+        self.position = location(transform)
+
+    def finish(self, context):
+        self.report.count("segments", len(self.segments))
+        self.report.count("objects")
+        return self, None
+
+    def move_and_draw(self, transform):
+        position = location(transform)
+        self.segments.append((self.position, position, self.current_radius))
+        self.transforms.append(transform)
+        self.position = position
+
+    def move(self, transform):
+        self.position = location(transform)
+
+
+class Segments:
+    """Segments as numpy arrays, the starts and ends (n, 3), the frames at the
+    ends (n, 3, 3), the radii (n,) and the index of the object of each segment
+    (n,), see Turtle.interpret_arrays"""
+    def __init__(self, starts, ends, frames, radii, objects):
+        self.starts = starts
+        self.ends = ends
+        self.frames = frames
+        self.radii = radii
+        self.objects = objects
+
+    def __len__(self):
+        return len(self.radii)
+
+    def to_list(self):
+        """Return the segments as (start, end, radius) tuples like Skeleton.segments"""
+        return list(zip(map(tuple, self.starts.tolist()), map(tuple, self.ends.tolist()), self.radii.tolist()))
+
+
+class Program:
+    """The modules compiled for Turtle.run, an opcode and an operand for each
+    step, see compile_program. The operand of a CALL is the index of its
+    (function, parameters) in calls."""
+    def __init__(self, ops, args, calls):
+        self.ops = ops
+        self.args = args
+        self.calls = calls
+
+    def __len__(self):
+        return len(self.ops)
+
+
+# A turtle has three attributes: location, orientation, a pen
+class Turtle:
+    def __init__(self, seed):
+        self.radius = 0.1
+        self.angle = radians(25.7)
+        self.length = 1.0
+        self.expansion = 1.1
+        self.shrinkage = 0.9
+        self.fat = 1.2
+        self.slinkage = 0.8
+        self.position = (0.0, 0.0, 0.0)
+        self.frame = FRAME
+        self.rotations = {}
+        self.direction = (0.0, 0.0, 1.0)
+        self.object_stack = []
+        self.seed = seed
+        self.tropism_vector = (0.0, 0.0, 0.0)
+        self.tropism_force = 0
+        self.next_copied_object_warping = (1.0, 1.0, 1.0)
+
+        self.sym_func_map = {}
+        self.set_interpretation('F', move_forward)
+        self.set_interpretation('f', move_forward_without_draw)
+        self.set_interpretation('+', rot_y)
+        self.set_interpretation('-', rot_y_neg)
+        self.set_interpretation('^', rot_x)
+        self.set_interpretation('&', rot_x_neg)
+        self.set_interpretation('\\', rot_z_neg)
+        self.set_interpretation('/', rot_z)
+        # todo: self.set_interpretation('|', turn_around)
+        self.set_interpretation('$', rotate_upright)
+        self.set_interpretation('[', start_branch)
+        self.set_interpretation(']', end_branch)
+        self.set_interpretation('¤', set_current_radius)
+        self.set_interpretation('!', slink)
+        self.set_interpretation(':', start_object)
+        self.set_interpretation(';', end_object)
+        self.set_interpretation('#', fatten)
+        # self.set_interpretation('%', slink)  # handled in lsystem
+        self.set_interpretation('s', scale)
+        self.set_interpretation('w', warp_next_copied_object)
+        self.set_interpretation('p', set_pen)
+        self.set_interpretation('m', set_material)
+        self.set_interpretation('£', random_angle)
+
+    def set_radius(self, radius):
+        self.radius = radius
+
+    def set_angle(self, angle):
+        self.angle = angle
+
+    def set_length(self, length):
+        self.length = length
+
+    def set_expansion(self, expansion):
+        self.expansion = expansion
+
+    def set_shrinkage(self, shrinkage):
+        self.shrinkage = shrinkage
+
+    def set_fat(self, fat):
+        self.fat = fat
+
+    def set_slinkage(self, slinkage):
+        self.slinkage = slinkage
+
+    @property
+    def transform(self):
+        (x0, x1, x2), (y0, y1, y2), (z0, z1, z2) = self.frame
+        p = self.position
+        return ((x0, y0, z0, p[0]),
+                (x1, y1, z1, p[1]),
+                (x2, y2, z2, p[2]),
+                (0.0, 0.0, 0.0, 1.0))
+
+    @transform.setter
+    def transform(self, m):
+        self.position = location(m)
+        self.frame = (column(m, 0), column(m, 1), column(m, 2))
+
+    # what a branch saves and restores
+    @property
+    def state(self):
+        return self.position, self.frame
+
+    @state.setter
+    def state(self, state):
+        self.position, self.frame = state
+
+    def sin_cos(self, angle):
+        # almost all rotations use the default angle, or one of a few angles
+        # given as parameters
+        try:
+            return self.rotations[angle]
+        except KeyError:
+            if len(self.rotations) >= MAX_ROTATIONS:
+                self.rotations.clear()
+            sin_cos = self.rotations[angle] = math.sin(angle), math.cos(angle)
+            return sin_cos
+
+    def set_direction(self, direction):
+        self.direction = direction
+        old_direction = transform_point(self.transform, UP)
+        self.transform = matmul(self.transform, rotation_between(old_direction, direction))
+
+    def rotate(self, angle, vector):
+        self.frame = rotate_frame(self.frame, rotation(angle, vector))
+
+    # rotating around one of the axes of the turtle only changes the two other
+    # axes, ie frame @ Matrix.Rotation(angle, 3, 'Y')
+
+    def rotate_y(self, angle):
+        s, c = self.sin_cos(angle)
+        x, y, z = self.frame
+        self.frame = ((c * x[0] - s * z[0], c * x[1] - s * z[1], c * x[2] - s * z[2]),
+                      y,
+                      (s * x[0] + c * z[0], s * x[1] + c * z[1], s * x[2] + c * z[2]))
+
+    def rotate_x(self, angle):
+        s, c = self.sin_cos(angle)
+        x, y, z = self.frame
+        self.frame = (x,
+                      (c * y[0] + s * z[0], c * y[1] + s * z[1], c * y[2] + s * z[2]),
+                      (c * z[0] - s * y[0], c * z[1] - s * y[1], c * z[2] - s * y[2]))
+
+    def rotate_z(self, angle):
+        s, c = self.sin_cos(angle)
+        x, y, z = self.frame
+        self.frame = ((c * x[0] + s * y[0], c * x[1] + s * y[1], c * x[2] + s * y[2]),
+                      (c * y[0] - s * x[0], c * y[1] - s * x[1], c * y[2] - s * x[2]),
+                      z)
+
+    def rotate_upright(self):
+        # the scale is uniform so the normalized axes are the rotation
+        x, y, direction = (normalized(v) for v in self.frame)
+        old_left = (-x[0], -x[1], -x[2])
+        new_left = normalized(cross(direction, UP))
+
+        scalar = dot(old_left, new_left)
+        logger.debug("direction %s old_left %s new_left %s scalar %s", direction, old_left, new_left, scalar)
+        if scalar >= 1.0:
+            return  # lines are parallel
+
+        angle = acos(scalar)  # angle is between 0 and pi
+        # the y axis after rotating angle around the z axis
+        s = math.sin(angle)
+        c = math.cos(angle)
+        test_up = (c * y[0] - s * x[0], c * y[1] - s * x[1], c * y[2] - s * x[2])
+        new_up = cross(direction, new_left)
+        logger.debug("angle %s", angle)
+
+        if dot(test_up, new_up) > 0:
+            angle = -angle
+        logger.debug("test up %s new_up %s angle %s", test_up, new_up, angle)
+        self.rotate_z(angle)
+
+    def scale_radius(self, scale, bl_obj):
+        bl_obj.set_radius(bl_obj.get_radius()*scale)
+
+    def set_current_radius(self, radius, bl_obj):
+        bl_obj.set_radius(radius)
+
+    def set_tropism(self, tropism_vector, tropism_force):
+        self.tropism_vector = tropism_vector
+        self.tropism_force = tropism_force
+
+    def scale(self, scaling, bl_obj):
+        self.frame = tuple((v[0] * scaling, v[1] * scaling, v[2] * scaling) for v in self.frame)
+        self.scale_radius(scaling, bl_obj)
+
+    def warp_copied_object(self, scaling, bl_obj):
+        if isinstance(scaling, float):
+            self.next_copied_object_warping = (scaling, scaling, scaling)
+        else:
+            self.next_copied_object_warping = tuple(scaling)
+
+    def forward(self, length):
+        z = self.frame[2]
+        p = self.position
+        self.position = (p[0] + z[0] * length, p[1] + z[1] * length, p[2] + z[2] * length)
+        if self.tropism_force > 0.0:
+            # the heading is the z axis of the frame
+            tvec = cross(normalized(z), self.tropism_vector)
+            tforce = math.sqrt(dot(tvec, tvec)) * self.tropism_force
+            self.rotate(tforce, tvec)
+
+    def new_object(self, report):
+        """Return the object that the modules between : and ; are drawn in"""
+        return Skeleton(self.radius, report=report)
+
+    def set_interpretation(self, symbol, function):
+        self.sym_func_map[symbol] = function
+
+    def interpret(self, input, context=None, report=lsystem.NULL_REPORT):
+        """Return a list of (object, base) pairs, the first one is the main
+        object. Here the objects are Skeletons and there are no bases.
+
+        input is an iterable of (name, parameters) modules from the lsystem,
+        which may be derived while they're interpreted, or a string. The
+        modules are compiled and run a block at a time, see compile_blocks, so a
+        generation that is derived while it's interpreted is never in memory."""
+        random.seed(self.seed)
+        obj_base_pairs = []
+        bl_obj = self.new_object(report)
+        bl_obj.start_new_mesh_part(self.transform)
+        self.object_stack.append(bl_obj)
+
+        for program in compile_blocks(self, input):
+            report.count("opcodes", len(program))
+            self.run(program, obj_base_pairs, context)
+
+        obj, base = bl_obj.finish(context)
+        obj_base_pairs.insert(0, (obj, base))
+        return obj_base_pairs
+
+    def run(self, program, obj_base_pairs, context):
+        """Run a Program from compile_program, drawing in the object at the
+        top of the object stack"""
+        forward = self.forward
+        rotate_x = self.rotate_x
+        rotate_y = self.rotate_y
+        rotate_z = self.rotate_z
+        object_stack = self.object_stack
+        calls = program.calls
+        bl_obj = object_stack[-1]
+        for op, arg in zip(program.ops, program.args):
+            if op == OP_DRAW:
+                forward(arg)
+                bl_obj.move_and_draw(self.transform)
+            elif op == OP_ROTATE_Y:
+                rotate_y(arg)
+            elif op == OP_PUSH:
+                bl_obj.push(self.state)
+            elif op == OP_POP:
+                state = bl_obj.pop()
+                if state is not None:
+                    self.state = state
+            elif op == OP_ROTATE_X:
+                rotate_x(arg)
+            elif op == OP_ROTATE_Z:
+                rotate_z(arg)
+            elif op == OP_MOVE:
+                forward(arg)
+                bl_obj.move(self.transform)
+            elif op == OP_SCALE_RADIUS:
+                self.scale_radius(arg, bl_obj)
+            elif op == OP_SET_RADIUS:
+                self.set_current_radius(arg, bl_obj)
+            else:
+                func, parameters = calls[int(arg)]
+                func(self, parameters, bl_obj, obj_base_pairs, context)
+                bl_obj = object_stack[-1]  # changed by : and ;
+
+    def interpret_arrays(self, input):
+        """Return the Segments of the modules computed with numpy
+
+        The modules are turned into steps, see array_program. The positions,
+        and the angles if all rotations are around the same axis, are summed
+        up for all steps at once with branch_sums. Otherwise the frame and
+        radius after every rotation or scaling are composed with the ones
+        before it, doubling the distance to the step it is composed with each
+        round, so a tree of depth d takes log2(d) rounds.
+        If the modules have symbols that depend on the state of the turtle,
+        like $, tropism or custom interpretations, the modules are
+        interpreted one at a time with a copy of the turtle instead. The
+        turtle itself isn't changed."""
+        numpy = lsystem.import_numpy("interpret_arrays")
+        if not isinstance(input, (str, list, tuple)):
+            input = list(input)  # may be needed twice
+        program = None if self.tropism_force > 0.0 else array_program(self, input)
+        if program is None:
+            return self.interpret_arrays_fallback(input)
+        ops, values, frames, objects, branches = program
+        ops = numpy.array(ops, dtype=numpy.int8)
+        values = numpy.array(values, dtype=float)
+        frames = numpy.array(frames, dtype=numpy.int64)
+        branches = numpy.array(branches, dtype=numpy.int64).reshape(-1, 3)
+        size = len(ops)
+        transform = numpy.array([tuple(row) for row in self.transform], dtype=float)
+        moves = numpy.nonzero(ops <= DRAW)[0]
+        drawn = numpy.nonzero(ops[moves] == DRAW)[0]  # the draws among the moves
+        draws = moves[drawn]
+
+        # one row more than there are steps for the index -1, the turtle
+        a = numpy.ones(size + 1)  # the radius is a * radius + b
+        b = numpy.zeros(size + 1)
+        rows = numpy.nonzero(ops == SCALE)[0]
+        a[rows] = values[rows]
+        rows = numpy.nonzero(ops == SCALE_RADIUS)[0]
+        a[rows] = values[rows]
+        rows = numpy.nonzero(ops == SET_RADIUS)[0]
+        a[rows] = 0.0
+        b[rows] = values[rows]
+
+        axes = [op for op in (ROTATE_X, ROTATE_Y, ROTATE_Z) if (ops == op).any()]
+        if len(axes) <= 1 and not (ops == SCALE).any():
+            # the angles around one axis add up
+            angles = branch_sums(numpy.where((ops >= ROTATE_X) & (ops <= ROTATE_Z), values, 0.0), branches)
+            move_frames = rotations(angles[moves], axes[0] if axes else ROTATE_Z)
+        else:
+            rot = numpy.empty((size + 1, 3, 3))
+            rot[:] = numpy.identity(3)
+            for op in axes:
+                rows = numpy.nonzero(ops == op)[0]
+                rot[rows] = rotations(values[rows], op)
+            rows = numpy.nonzero(ops == SCALE)[0]
+            rot[rows] *= values[rows, None, None]
+            ancestors = frames.copy()
+            active = numpy.nonzero((ops >= ROTATE_X) & (ancestors >= 0))[0]
+            while len(active):
+                up = ancestors[active]
+                rot[active] = numpy.matmul(rot[up], rot[active])
+                ancestors[active] = ancestors[up]
+                active = active[ancestors[active] >= 0]
+            move_frames = rot[frames[moves]]
+        if (ops >= SCALE).any():
+            ancestors = frames.copy()
+            active = numpy.nonzero((ops >= ROTATE_X) & (ancestors >= 0))[0]
+            while len(active):
+                up = ancestors[active]
+                b[active] = a[active] * b[up] + b[active]
+                a[active] *= a[up]
+                ancestors[active] = ancestors[up]
+                active = active[ancestors[active] >= 0]
+
+        # a move is along the z axis of the frame it starts with
+        move_frames = numpy.matmul(transform[:3, :3], move_frames)
+        trans = numpy.zeros((size, 3))
+        trans[moves] = move_frames[:, :, 2] * values[moves, None]
+        starts = branch_sums(trans, branches)[draws] + transform[:3, 3]
+        ends = starts + trans[draws]
+
+        objects = numpy.array(objects, dtype=numpy.int64)[draws]
+        radii = a[frames[draws]] * self.radius + b[frames[draws]]
+        frames = move_frames[drawn]
+        if objects.any():
+            # grouped by object like the list returned by interpret, without
+            # the objects that aren't ended
+            order = numpy.argsort(objects, kind="stable")
+            order = order[objects[order] >= 0]
+            return Segments(starts[order], ends[order], frames[order], radii[order], objects[order])
+        return Segments(starts, ends, frames, radii, objects)
+
+    def interpret_arrays_fallback(self, input):
+        numpy = lsystem.import_numpy("interpret_arrays")
+        turtle = copy.deepcopy(self)
+        turtle.object_stack = []
+        # Skeletons record the segments, whatever objects the turtle creates
+        turtle.new_object = lambda report: Skeleton(turtle.radius, report=report)
+        segments = []
+        transforms = []
+        objects = []
+        for i, (obj, base) in enumerate(turtle.interpret(input)):
+            segments.extend(obj.segments)
+            transforms.extend(obj.transforms)
+            objects.extend([i] * len(obj.segments))
+        if not segments:
+            return Segments(numpy.zeros((0, 3)), numpy.zeros((0, 3)), numpy.zeros((0, 3, 3)), numpy.zeros(0),
+                            numpy.zeros(0, dtype=numpy.int64))
+        starts, ends, radii = zip(*segments)
+        transforms = numpy.array([[tuple(row)[:3] for row in tuple(transform)[:3]] for transform in transforms],
+                                 dtype=float)
+        return Segments(numpy.array(starts, dtype=float), numpy.array(ends, dtype=float), transforms,
+                        numpy.array(radii, dtype=float), numpy.array(objects, dtype=numpy.int64))
+
+    @staticmethod
+    def scan_parameters(string, pos):
+        start = pos + 2
+        end = start
+        tot_len = len(string)
+        while end < tot_len:
+            if string[end] == ')':
+                break
+            end += 1
+        val_str = string[start:end]
+        parameters = val_str.split(",")
+        return parameters, end+1
+
+
+def parse_modules(string):
+    """Yield the (symbol, parameters) modules of a string, the parameters are
+    a tuple of the strings between the commas"""
+    pos = 0
+    tot_len = len(string)
+    while pos < tot_len:
+        parameters = ()
+        c = string[pos]
+        if pos+2 < tot_len and string[pos+1] == '(':
+            parameters, pos = Turtle.scan_parameters(string, pos)
+            parameters = tuple(parameters)
+        else:
+            pos += 1
+        yield c, parameters
+
+
+def to_float(value, default):
+    if type(value) is float:
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        # Not a float, fallback to default
+        return default
+
+
+def to_float_array(array, default):
+    if len(array) > 0:
+        return to_float(array[0], default)
+    return default
+
+
+def start_branch(turtle, parameters, bl_obj, obj_base_pairs, context):
+    bl_obj.push(turtle.state)
+
+
+def end_branch(turtle, parameters, bl_obj, obj_base_pairs, context):
+    t = bl_obj.pop()
+    if t is not None:
+        turtle.state = t
+
+
+def start_object(turtle, parameters, bl_obj, obj_base_pairs, context):
+    bl_obj.push(turtle.state)
+    bl_obj = turtle.new_object(bl_obj.report)
+    turtle.object_stack.append(bl_obj)
+    bl_obj.start_new_mesh_part(turtle.transform)
+
+
+def end_object(turtle, parameters, bl_obj, obj_base_pairs, context):
+    if len(turtle.object_stack) <= 1:
+        logger.warning("call to end object on stack with one or less elements")
+        return
+    obj, base = bl_obj.finish(context)
+    obj_base_pairs.append((obj, base))
+    turtle.object_stack.pop()
+    bl_obj = turtle.object_stack[-1]
+    t = bl_obj.pop()
+    if t is not None:
+        turtle.state = t
+    obj.parent = bl_obj.object
+
+
+def move_forward(turtle, parameters, bl_obj, obj_base_pairs, context):
+    val = to_float_array(parameters, turtle.length)
+    turtle.forward(val)
+    bl_obj.move_and_draw(turtle.transform)
+
+
+def move_forward_without_draw(turtle, parameters, bl_obj, obj_base_pairs, context):
+    val = to_float_array(parameters, turtle.length)
+    turtle.forward(val)
+    bl_obj.move(turtle.transform)
+
+
+def rot_y(turtle, parameters, bl_obj, obj_base_pairs, context):
+    val = to_float_array(parameters, None)
+    if val is None:
+        val = turtle.angle
+    else:
+        val = radians(val)
+
+    turtle.rotate_y(val)
+
+
+def rot_y_neg(turtle, parameters, bl_obj, obj_base_pairs, context):
+    val = to_float_array(parameters, None)
+    if val is None:
+        val = -turtle.angle
+    else:
+        val = radians(-val)
+
+    turtle.rotate_y(val)
+
+
+def rot_x(turtle, parameters, bl_obj, obj_base_pairs, context):
+    val = to_float_array(parameters, None)
+    if val is None:
+        val = turtle.angle
+    else:
+        val = radians(val)
+
+    turtle.rotate_x(val)
+
+
+def rot_x_neg(turtle, parameters, bl_obj, obj_base_pairs, context):
+    val = to_float_array(parameters, None)
+    if val is None:
+        val = -turtle.angle
+    else:
+        val = radians(-val)
+
+    turtle.rotate_x(val)
+
+
+def rot_z(turtle, parameters, bl_obj, obj_base_pairs, context):
+    val = to_float_array(parameters, None)
+    if val is None:
+        val = turtle.angle
+    else:
+        val = radians(val)
+
+    turtle.rotate_z(val)
+
+
+def rot_z_neg(turtle, parameters, bl_obj, obj_base_pairs, context):
+    val = to_float_array(parameters, None)
+    if val is None:
+        val = -turtle.angle
+    else:
+        val = radians(-val)
+
+    turtle.rotate_z(val)
+
+
+def rotate_upright(turtle, parameters, bl_obj, obj_base_pairs, context):
+    turtle.rotate_upright()
+
+
+def random_angle(turtle, parameters, bl_obj, obj_base_pairs, context):
+    turtle.angle = random.random() * 2 * pi
+
+
+def fatten(turtle, parameters, bl_obj, obj_base_pairs, context):
+    val = to_float_array(parameters, turtle.fat)
+    turtle.scale_radius(val, bl_obj)
+
+
+def slink(turtle, parameters, bl_obj, obj_base_pairs, context):
+    val = to_float_array(parameters, turtle.slinkage)
+    turtle.scale_radius(val, bl_obj)
+
+
+def set_current_radius(turtle, parameters, bl_obj, obj_base_pairs, context):
+    val = to_float_array(parameters, 1.0)
+    turtle.set_current_radius(val, bl_obj)
+
+
+def scale(turtle, parameters, bl_obj, obj_base_pairs, context):
+    val = to_float_array(parameters, turtle.scale)
+    turtle.scale(val, bl_obj)
+
+
+def warp_next_copied_object(turtle, parameters, bl_obj, obj_base_pairs, context):
+    try:
+        assert type(parameters) in [float, list, tuple]
+        if isinstance(parameters, (list, tuple)):
+            assert len(parameters) == 3
+            parameters = [to_float(p, 1.0) for p in parameters]
+        else:
+            parameters = to_float(parameters, 1.0)
+
+        turtle.warp_copied_object(parameters, bl_obj)
+    except AssertionError:
+        logger.warning("wrong parameters type")
+
+
+def set_pen(turtle, parameters, bl_obj, obj_base_pairs, context):
+    if parameters:
+        bl_obj.set_pen(str(parameters[0]), turtle.transform)
+
+
+def set_material(turtle, parameters, bl_obj, obj_base_pairs, context):
+    if parameters:
+        bl_obj.set_material(str(parameters[0]))
+
+
+# the opcodes of compile_program
+(OP_DRAW, OP_MOVE, OP_ROTATE_X, OP_ROTATE_Y, OP_ROTATE_Z, OP_SCALE_RADIUS, OP_SET_RADIUS, OP_PUSH, OP_POP,
+ OP_CALL) = range(0, 10)
+
+# symbol function -> (opcode, sign or the name of the default in the turtle)
+OPCODES = {
+    move_forward: (OP_DRAW, "length"),
+    move_forward_without_draw: (OP_MOVE, "length"),
+    rot_x: (OP_ROTATE_X, 1.0),
+    rot_x_neg: (OP_ROTATE_X, -1.0),
+    rot_y: (OP_ROTATE_Y, 1.0),
+    rot_y_neg: (OP_ROTATE_Y, -1.0),
+    rot_z: (OP_ROTATE_Z, 1.0),
+    rot_z_neg: (OP_ROTATE_Z, -1.0),
+    fatten: (OP_SCALE_RADIUS, "fat"),
+    slink: (OP_SCALE_RADIUS, "slinkage"),
+    set_current_radius: (OP_SET_RADIUS, 1.0),
+}
+
+# functions besides the ones in ARRAY_STEPS that don't change the defaults
+KEEP_DEFAULTS = {rotate_upright, start_object, end_object}
+
+# the opcodes in a Program of compile_blocks
+BLOCK_SIZE = 1 << 16
+
+
+def compile_program(turtle, input):
+    """Return the modules as a Program for the symbol functions of the turtle
+
+    Symbols without a function are left out. Moves, rotations and changes of
+    the radius get their own opcodes with the length, angle or radius as
+    operand and successive rotations around the same axis are merged into
+    one. The branches are PUSH and POP,
+    everything else is a CALL of the function of the symbol with its
+    parameters. The defaults, like the angle of a + without a parameter, are
+    the ones of the turtle when it's compiled. After a £ or a custom
+    interpretation they may have changed so the symbols without parameters
+    are CALLs from there on.
+    Successive moves aren't merged, every F is a segment and the pens add
+    vertices for every f."""
+    return next(compile_blocks(turtle, input, None))
+
+
+def compile_blocks(turtle, input, size=BLOCK_SIZE):
+    """Yield the modules compiled like compile_program as Programs of about
+    size opcodes, all of them in one Program if size is None. The next block
+    is compiled when the previous one has been used, so only one block of
+    the modules is in memory. A rotation at the end of a block is kept for
+    the next one, where it may be merged with the rotations that follow."""
+    ops = []
+    args = []
+    calls = []
+    known = True  # the defaults of the turtle are known
+    compiled = {}  # module -> its steps, most modules are repeated many times
+    last = -1  # the rotation at the end of ops that can be merged with the next one
+    if isinstance(input, str):
+        input = parse_modules(input)
+    for module in input:
+        steps = compiled.get(module)
+        if steps is None:
+            steps, still_known = compile_module(turtle, module, known, calls)
+            if known and not still_known:
+                known = False
+                compiled = {}
+            else:
+                compiled[module] = steps
+        module_ops, module_args, first, final = steps
+        if not module_ops:
+            continue
+        if first == last >= 0:
+            args[-1] += module_args[0]
+            ops.extend(module_ops[1:])
+            args.extend(module_args[1:])
+        else:
+            ops.extend(module_ops)
+            args.extend(module_args)
+        last = final
+        keep = 1 if last >= 0 else 0
+        if size is not None and len(ops) - keep >= size:
+            yield Program(array.array("B", ops[:len(ops) - keep]), array.array("d", args[:len(args) - keep]), calls)
+            ops = ops[len(ops) - keep:]
+            args = args[len(args) - keep:]
+            calls = []
+            compiled = {}  # the CALLs of the cached steps are indices in the old calls
+    if ops or size is None:
+        yield Program(array.array("B", ops), array.array("d", args), calls)
+
+
+def compile_module(turtle, module, known, calls):
+    """Return the steps of a module for compile_program and whether the
+    defaults of the turtle are known after it. The steps are the opcodes and
+    the operands and the rotations at the start and end, -1 if there are
+    none."""
+    name, parameters = module
+    if len(name) > 1:
+        # a module with a longer name is interpreted one symbol at a time,
+        # the parameters belong to the last one
+        symbols = [(c, ()) for c in name[:-1]]
+        symbols.append((name[-1], parameters))
+    else:
+        symbols = (module,)
+    ops = []
+    args = []
+    for symbol, parameters in symbols:
+        func = turtle.sym_func_map.get(symbol)
+        if func is None:
+            continue
+        if func is start_branch:
+            op, arg = OP_PUSH, 0.0
+        elif func is end_branch:
+            op, arg = OP_POP, 0.0
+        elif func in OPCODES and (parameters or known):
+            op, default = OPCODES[func]
+            if OP_ROTATE_X <= op <= OP_ROTATE_Z:
+                arg = to_float_array(parameters, None)
+                arg = default * turtle.angle if arg is None else radians(default * arg)
+                if ops and ops[-1] == op:
+                    args[-1] += arg
+                    continue
+            else:
+                arg = to_float_array(parameters, getattr(turtle, default) if isinstance(default, str) else default)
+        else:
+            if func is random_angle or not (func in ARRAY_STEPS or func in KEEP_DEFAULTS):
+                known = False
+            op, arg = OP_CALL, float(len(calls))
+            calls.append((func, parameters))
+        ops.append(op)
+        args.append(arg)
+    rotations = (OP_ROTATE_X, OP_ROTATE_Y, OP_ROTATE_Z)
+    first = ops[0] if ops and ops[0] in rotations else -1
+    final = ops[-1] if ops and ops[-1] in rotations else -1
+    return (tuple(ops), tuple(args), first, final), known
+
+
+# the steps of array_program
+MOVE, DRAW, ROTATE_X, ROTATE_Y, ROTATE_Z, SCALE, SCALE_RADIUS, SET_RADIUS = range(0, 8)
+
+# symbol function -> (step, sign or the name of the default in the turtle),
+# None for functions that don't change the geometry
+ARRAY_STEPS = {
+    move_forward: (DRAW, "length"),
+    move_forward_without_draw: (MOVE, "length"),
+    rot_x: (ROTATE_X, 1.0),
+    rot_x_neg: (ROTATE_X, -1.0),
+    rot_y: (ROTATE_Y, 1.0),
+    rot_y_neg: (ROTATE_Y, -1.0),
+    rot_z: (ROTATE_Z, 1.0),
+    rot_z_neg: (ROTATE_Z, -1.0),
+    scale: (SCALE, None),
+    fatten: (SCALE_RADIUS, "fat"),
+    slink: (SCALE_RADIUS, "slinkage"),
+    set_current_radius: (SET_RADIUS, 1.0),
+    set_pen: (SET_RADIUS, None),
+    set_material: None,
+    warp_next_copied_object: None,
+}
+
+
+def array_symbols(input):
+    if isinstance(input, str):
+        input = parse_modules(input)
+    for name, parameters in input:
+        if len(name) > 1:
+            for c in name[:-1]:
+                yield c, ()
+            yield name[-1], parameters
+        else:
+            yield name, parameters
+
+
+def array_program(turtle, input):
+    """Return the steps of the modules as (ops, values, frames, objects,
+    branches) lists for Turtle.interpret_arrays, or None if there's a symbol
+    that can't be interpreted that way
+
+    frames is the last rotation or scaling before each step, -1 is the state
+    of the turtle. objects is the index of the object of each step in the list
+    returned by interpret, -1 if the object isn't ended. branches has the
+    first step, the step after the end, -1 if it doesn't end, and the
+    enclosing branch of each branch and object as a flat list, see
+    branch_sums. Symbols without a step are left out and successive rotations
+    around the same axis or moves without drawing are merged into one step."""
+    sym_func_map = turtle.sym_func_map
+    ops = []
+    values = []
+    frames = []
+    objects = []
+    branches = []
+    stack = []
+    object_stack = []
+    order = {0: 0}  # the main object is the first one, the others in the order they end
+    frame = branch = -1
+    obj = created = 0
+    last = -1  # the step that the next one can be merged with
+    angle = turtle.angle
+    rng = random.Random(turtle.seed)  # the same numbers as random.seed in interpret
+    for symbol, parameters in array_symbols(input):
+        func = sym_func_map.get(symbol)
+        if func is None:
+            continue
+        if func is start_branch:
+            stack.append((frame, branch))
+            branch = len(branches) // 3
+            branches.extend((len(ops), -1, stack[-1][1]))
+            last = -1
+            continue
+        if func is end_branch:
+            if stack:
+                branches[3 * branch + 1] = len(ops)
+                frame, branch = stack.pop()
+            last = -1
+            continue
+        if func is end_object:
+            if object_stack:
+                order[obj] = len(order)
+                # the branches that aren't ended in the object end with it
+                while stack:
+                    branches[3 * branch + 1] = len(ops)
+                    frame, branch = stack.pop()
+                obj, stack = object_stack.pop()
+                branches[3 * branch + 1] = len(ops)
+                frame, branch = stack.pop()
+            last = -1
+            continue
+        if func is random_angle:
+            angle = rng.random() * 2 * pi
+            continue
+        if func is start_object:
+            stack.append((frame, branch))
+            branch = len(branches) // 3
+            branches.extend((len(ops), -1, stack[-1][1]))
+            object_stack.append((obj, stack))
+            created += 1
+            obj = created  # changed to the order of the objects at the end
+            stack = []
+            # a new object starts with the radius of the turtle
+            op, value = SET_RADIUS, turtle.radius
+        else:
+            step = ARRAY_STEPS.get(func, False)
+            if step is False:
+                return None
+            if step is None:
+                continue
+            op, default = step
+            if ROTATE_X <= op <= ROTATE_Z:
+                value = to_float_array(parameters, None)
+                value = default * angle if value is None else radians(default * value)
+                if last >= 0 and ops[last] == op:
+                    values[last] += value
+                    continue
+            elif op == SCALE:
+                value = to_float_array(parameters, None)
+                if value is None:
+                    return None
+            elif func is set_pen:
+                if not parameters:
+                    continue
+                value = turtle.radius  # a new pen starts with the radius of the turtle
+            else:
+                value = to_float_array(parameters, getattr(turtle, default) if isinstance(default, str) else default)
+                if op == MOVE and last >= 0 and ops[last] == MOVE:
+                    values[last] += value
+                    continue
+        last = len(ops)
+        ops.append(op)
+        values.append(value)
+        frames.append(frame)
+        objects.append(obj)
+        if op > DRAW:
+            frame = last
+    if created:
+        objects = [order.get(obj, -1) for obj in objects]
+    return ops, values, frames, objects, branches
+
+
+def branch_sums(values, branches):
+    """Return the sums of the values (n, ...) of the steps before each step,
+    where the sum after a branch is the one before it
+
+    The sums of all steps before are corrected after the end of each branch
+    by the sum of the branch. The branches inside it are already corrected
+    for so only the sum of the steps of the branch outside of them is
+    subtracted there."""
+    numpy = lsystem.import_numpy("interpret_arrays")
+    first, end, parents = branches[:, 0], branches[:, 1], branches[:, 2]
+    sums = numpy.zeros((len(values) + 1,) + values.shape[1:])
+    numpy.cumsum(values, axis=0, out=sums[1:])
+    ended = numpy.nonzero(end >= 0)[0]
+    corrections = numpy.zeros((len(branches),) + values.shape[1:])
+    corrections[ended] = sums[first[ended]] - sums[end[ended]]
+    inner = ended[parents[ended] >= 0]
+    numpy.subtract.at(corrections, parents[inner], corrections[inner])
+    steps = numpy.zeros_like(sums)
+    steps[1:] = values
+    numpy.add.at(steps, end[ended], corrections[ended])
+    return numpy.cumsum(steps, axis=0)[:-1]
+
+
+def rotations(angles, op):
+    """Return the rotation matrices (n, 3, 3) of the angles around the axis of
+    the step, the same as Matrix.Rotation(angle, 3, axis)"""
+    numpy = lsystem.import_numpy("interpret_arrays")
+    i, j = {ROTATE_X: (1, 2), ROTATE_Y: (2, 0), ROTATE_Z: (0, 1)}[op]
+    cos = numpy.cos(angles)
+    sin = numpy.sin(angles)
+    matrices = numpy.zeros((len(angles), 3, 3))
+    matrices[:, 3 - i - j, 3 - i - j] = 1.0
+    matrices[:, i, i] = cos
+    matrices[:, j, j] = cos
+    matrices[:, i, j] = -sin
+    matrices[:, j, i] = sin
+    return matrices
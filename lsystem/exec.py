@@ -4,14 +4,14 @@ import lsystem.turtle
 import lsystem.util
 
 import math
-import time
 import random
 import copy
+import logging
 
 import bpy
-import bpy_extras.mesh_utils
 import mathutils
 
+logger = logging.getLogger(__name__)
 
 class Exec:
     def __init__(self):
@@ -39,6 +39,14 @@ class Exec:
         self.slinkage = 0.8
         self.animate = False
         self.frame_delta = 5
+        self.batch = False
+        self.max_modules = None
+        self.max_bytes = None
+        self.workers = None
+        self.chunk_workers = None
+        # called with (event, data) while executing, see lsystem.lsystem.Report
+        self.callback = None
+        self.report = None
 
     def set_axiom(self, axiom_str):
         self.axiom = lsystem.lsystem.ProductionRule("", axiom_str)
@@ -84,7 +92,15 @@ class Exec:
              fat=None,
              slinkage=None,
              animate=None,
-             frame_delta=None):
+             frame_delta=None,
+             batch=None,
+             max_modules=None,
+             max_bytes=None,
+             workers=None,
+             chunk_workers=None,
+             callback=None):
+        """Create the objects of the l-system, returns a lsystem.lsystem.Report
+        with the timings and counters of the execution"""
         if context is None:
             context = bpy.context
         if instances is not None:
@@ -113,77 +129,114 @@ class Exec:
             self.animate = animate
         if frame_delta is not None:
             self.frame_delta = frame_delta
-
-        self.delete()
-
+        if batch is not None:
+            self.batch = batch
+        if max_modules is not None:
+            self.max_modules = max_modules
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if workers is not None:
+            self.workers = workers
+        if chunk_workers is not None:
+            self.chunk_workers = chunk_workers
+        if callback is not None:
+            self.callback = callback
+        report = lsystem.lsystem.Report(self.callback)
+
+        with report.timer("compile"):
+            lsys = self.make_lsystem()
+
+        # fail before the old objects are deleted
+        iterations = max(self.min_iterations, self.max_iterations)
+        if self.max_modules is not None or self.max_bytes is not None:
+            with report.timer("predict"):
+                lsys.check_budget(iterations)
+
+        with report.timer("delete"):
+            self.delete()
+
+        turtle = make_turtle(seed=self.seed,
+                             angle=self.angle,
+                             length=self.length,
+                             radius=self.radius,
+                             expansion=self.expansion,
+                             shrinkage=self.shrinkage,
+                             fat=self.fat,
+                             slinkage=self.slinkage,
+                             normal=(0.0, 0.0, 1.0),
+                             tropism_vector=self.tropism_vector,
+                             tropism_force=self.tropism_force,
+                             interpretations=self.interpretations)
+        self.objects = exec_turtle(context, lsys, self.instances, self.min_iterations, self.max_iterations,
+                                   self.animate, turtle, self.frame_delta, self.workers, report)
+        self.report = report
+        return report
+
+    def make_lsystem(self):
+        """Return the LSystem of the axiom, rules and replacements with the constants replaced"""
         axiom = self.axiom.copy_replace(self.constants)
-        rules = []
-        for rule in self.rules:
-            rules.append(rule.copy_replace(self.constants))
-
-        self.objects = execute(context,
-                               axiom,
-                               rules,
-                               self.replacements,
-                               instances=self.instances,
-                               seed=self.seed,
-                               min_iterations=self.min_iterations,
-                               max_iterations=self.max_iterations,
-                               angle=self.angle,
-                               length=self.length,
-                               radius=self.radius,
-                               expansion=self.expansion,
-                               shrinkage=self.shrinkage,
-                               fat=self.fat,
-                               slinkage=self.slinkage,
-                               animate=self.animate,
-                               frame_delta=self.frame_delta,
-                               normal=(0.0, 0.0, 1.0),
-                               tropism_vector=self.tropism_vector,
-                               tropism_force=self.tropism_force,
-                               interpretations=self.interpretations)
+        rules = [rule.copy_replace(self.constants) for rule in self.rules]
+        replacements = None
+        if self.replacements is not None:
+            replacements = [rule.copy_replace(self.constants) for rule in self.replacements]
+        lsys = lsystem.lsystem.LSystem(axiom, rules, replacements)
+        lsys.batch = self.batch
+        lsys.max_modules = self.max_modules
+        lsys.max_bytes = self.max_bytes
+        lsys.chunk_workers = self.chunk_workers
+        return lsys
+
+    def predict_growth(self, lsys=None):
+        """Return the predicted size of the last iteration, see LSystem.predict_growth
+
+        Raises GrowthLimitError if it's larger than max_modules or max_bytes."""
+        if lsys is None:
+            lsys = self.make_lsystem()
+        iterations = max(self.min_iterations, self.max_iterations)
+        lsys.check_budget(iterations)
+        return lsys.predict_growth(iterations)
 
     def select(self):
-        if hasattr(bpy.app, "version") and bpy.app.version >= (2, 80):
-            # This doesn't work for objects that aren't visible in the current keyframe
-            for ob in bpy.context.selected_objects:
-                ob.select_set(False)
-            for ob in self.objects:
-                ob.select_set(True)
-        else:
-            # deselect currently selected objects
-            for ob in bpy.context.selected_objects:
-                ob.select = False
+        # This doesn't work for objects that aren't visible in the current keyframe in blender 2.8
+        # deselect currently selected objects
+        for ob in bpy.context.selected_objects:
+            lsystem.util.select(ob, False)
 
-            # select objects belonging to this LSystem
-            for ob in self.objects:
-                ob.select = True
+        # select objects belonging to this LSystem
+        for ob in self.objects:
+            lsystem.util.select(ob, True)
 
     def delete(self):
         old_selected = self.get_selection()
 
-        if hasattr(bpy.app, "version") and bpy.app.version >= (2, 80):
+        if lsystem.util.BLENDER_2_80:
             for obj in self.objects:
                 try:
-                    bpy.data.objects.remove(obj, do_unlink=True)
+                    lsystem.util.remove_object(obj)
                 except ReferenceError:
                     # object already deleted, ignore
                     pass
         else:
+            meshes = []
+            for obj in self.objects:
+                try:
+                    meshes.append(obj.data)
+                except ReferenceError:
+                    pass
             self.select()
             try:
                 bpy.ops.object.delete()
             except ReferenceError:
                 # lsystem objects already deleted, ignore
                 pass
+            # the meshes of deleted objects stay in bpy.data until the file is reloaded
+            for mesh in meshes:
+                if isinstance(mesh, bpy.types.Mesh) and mesh.users == 0:
+                    bpy.data.meshes.remove(mesh)
 
-        if hasattr(bpy.app, "version") and bpy.app.version >= (2, 80):
-            for ob in old_selected:
-                if ob not in self.objects:
-                    ob.select_set(True)
-        else:
-            for ob in old_selected:
-                ob.select = True
+        for ob in old_selected:
+            if ob not in self.objects:
+                lsystem.util.select(ob, True)
 
     def get_selection(self):
         selected = []
@@ -227,7 +280,41 @@ def execute(context,
             normal=(0.0, 0.0, 1.0),
             tropism_vector=(0.0, 0.0, -1.0),
             tropism_force=0.0,
-            interpretations=None):
+            interpretations=None,
+            batch=False,
+            max_modules=None,
+            max_bytes=None,
+            workers=None,
+            chunk_workers=None,
+            report=None):
+    if report is None:
+        report = lsystem.lsystem.NULL_REPORT
+    turtle = make_turtle(seed, angle, length, radius, expansion, shrinkage, fat, slinkage, normal, tropism_vector,
+                         tropism_force, interpretations)
+
+    with report.timer("compile"):
+        lsys = lsystem.lsystem.LSystem(axiom, rules, replacements)
+    lsys.batch = batch
+    lsys.max_modules = max_modules
+    lsys.max_bytes = max_bytes
+    lsys.chunk_workers = chunk_workers
+    lsys.check_budget(max(min_iterations, max_iterations))
+    return exec_turtle(context, lsys, instances, min_iterations, max_iterations, animate, turtle, frame_delta, workers,
+                       report)
+
+
+def make_turtle(seed=0,
+                angle=math.radians(25),
+                length=1.0,
+                radius=0.1,
+                expansion=1.1,
+                shrinkage=0.9,
+                fat=1.2,
+                slinkage=0.8,
+                normal=(0.0, 0.0, 1.0),
+                tropism_vector=(0.0, 0.0, -1.0),
+                tropism_force=0.0,
+                interpretations=None):
     turtle = lsystem.turtle.Turtle(seed)
     turtle.set_angle(angle)
     turtle.set_length(length)
@@ -241,15 +328,16 @@ def execute(context,
     if interpretations is not None:
         for key in interpretations:
             turtle.set_interpretation(key, interpretations[key])
+    return turtle
 
-    lsys = lsystem.lsystem.LSystem(axiom, rules, replacements)
-    return exec_turtle(context, lsys, instances, min_iterations, max_iterations, animate, turtle, frame_delta)
 
-
-def exec_turtle(context, lsys, instances, min_iterations, max_iterations, animate, turtle, frame_delta=5):
+def exec_turtle(context, lsys, instances, min_iterations, max_iterations, animate, turtle, frame_delta=5, workers=None,
+                report=None):
+    if report is None:
+        report = lsystem.lsystem.NULL_REPORT
     # Need to call scene.update for ray_cast method.
     # See http://blender.stackexchange.com/questions/40429/error-object-has-no-mesh-data-to-be-used-for-ray-casting
-    if hasattr(bpy.app, "version") and bpy.app.version < (2, 80):
+    if not lsystem.util.BLENDER_2_80:
         bpy.context.scene.update()
 
     rmax_iter = max_iterations+1
@@ -258,46 +346,59 @@ def exec_turtle(context, lsys, instances, min_iterations, max_iterations, animat
 
     pos_info_list = get_pos_info(instances, min_iterations, rmax_iter, turtle.seed, animate)
 
+    # every iteration of an instance comes from the same derivation
+    seeds = []
+    for instance in range(0, instances):
+        if pos_info_list:
+            seeds.append(pos_info_list[instance * (rmax_iter-min_iterations)].seed)
+        else:
+            seeds.append(turtle.seed + instance)
+    # with workers the derivations run in other processes, the turtle always
+    # runs here since it needs bpy
+    derivations = lsystem.lsystem.derive_instances(lsys, seeds, min_iterations, rmax_iter-1, workers, report)
+
     inst_list = []
     seed = turtle.seed
 
-    pos_info_index = 0
-    for instance in range(0, instances):
-        iter_list = []
-        for iterations in range(min_iterations, rmax_iter):
-            new_turtle = copy.deepcopy(turtle)
-            new_turtle.seed = seed
-            pos_info = None
-            if pos_info_list:
-                pos_info = pos_info_list[pos_info_index]
-            if pos_info:
-                new_turtle.set_direction(pos_info.normal)
-                new_turtle.seed = pos_info.seed
-            object_base_pairs = run_once(context, new_turtle, instance, lsys, iterations)
-            if pos_info:
-                obj = object_base_pairs[0][0]
-                obj.location = pos_info.position
-                obj.parent = pos_info.obj
-            iter_list.append(object_base_pairs)
-            pos_info_index += 1
-        seed += 1
-        inst_list.append(iter_list)
+    # the processes of chunk_workers are started for the first generation and
+    # kept for the generations of all the instances
+    try:
+        pos_info_index = 0
+        for derivation in derivations:
+            iter_list = []
+            for iterations, modules in derivation:
+                new_turtle = copy.deepcopy(turtle)
+                new_turtle.seed = seed
+                pos_info = None
+                if pos_info_list:
+                    pos_info = pos_info_list[pos_info_index]
+                if pos_info:
+                    new_turtle.set_direction(pos_info.normal)
+                    new_turtle.seed = pos_info.seed
+                object_base_pairs = run_once(context, new_turtle, iterations, modules, report)
+                if pos_info:
+                    obj = object_base_pairs[0][0]
+                    obj.location = pos_info.position
+                    obj.parent = pos_info.obj
+                iter_list.append(object_base_pairs)
+                pos_info_index += 1
+            seed += 1
+            inst_list.append(iter_list)
+    finally:
+        lsys.close()
 
     if not pos_info_list:
-        grid(inst_list, not animate)
+        with report.timer("layout"):
+            grid(inst_list, not animate)
 
-    if hasattr(bpy.app, "version") and bpy.app.version >= (2, 80):
-        for ob in context.scene.objects:
-            ob.select_set(False)
-    else:
-        for ob in context.scene.objects:
-            ob.select = False
+    for ob in context.scene.objects:
+        lsystem.util.select(ob, False)
 
     if animate:
         animate_inst_list(inst_list, frame_delta)
 
     objects = []
-    if hasattr(bpy.app, "version") and bpy.app.version >= (2, 80):
+    if lsystem.util.BLENDER_2_80:
         for iter_list in inst_list:
             for object_base_pairs in iter_list:
                 for obj_base_pair in object_base_pairs:
@@ -318,7 +419,7 @@ def exec_turtle(context, lsys, instances, min_iterations, max_iterations, animat
 
 def get_pos_info(instances, min_iterations, max_iterations, seed, animate):
     selected = bpy.context.selected_objects
-    print("selected: " + str(selected))
+    logger.debug("selected: %s", selected)
     if not selected:
         return None
 
@@ -329,7 +430,7 @@ def get_pos_info(instances, min_iterations, max_iterations, seed, animate):
     if animate:
         for instances in range(0, instances):
             face, ob = random.choice(faces)
-            new_positions = bpy_extras.mesh_utils.triangle_random_points(1, [face])
+            new_positions = lsystem.util.random_face_points(1, [face])
             pos = new_positions[0]
             for iter in range(min_iterations, max_iterations):
                 pos_info = PosInfo(pos, face.normal, ob, current_seed, iter)
@@ -339,10 +440,7 @@ def get_pos_info(instances, min_iterations, max_iterations, seed, animate):
         for instances in range(0, instances):
             for iter in range(min_iterations, max_iterations):
                 face, ob = random.choice(faces)
-                if hasattr(bpy.app, "version") and bpy.app.version >= (2, 80):
-                    new_positions = bpy_extras.mesh_utils.triangle_random_points(1, [face])
-                else:
-                    new_positions = bpy_extras.mesh_utils.face_random_points(1, [face])
+                new_positions = lsystem.util.random_face_points(1, [face])
                 pos_info = PosInfo(new_positions[0], face.normal, ob, current_seed, iter)
                 pos_info_list.append(pos_info)
             current_seed += 1
@@ -364,12 +462,12 @@ def animate_iter_list(iter_list, frame_delta=5):
             lsystem.util.hide_render(obj, True, frame+frame_delta)
         frame += frame_delta
 
-    if hasattr(bpy.app, "version") and bpy.app.version >= (2, 80):
+    if lsystem.util.BLENDER_2_80:
         bpy.data.scenes["Scene"].frame_end = frame
 
 
 def get_selected_faces(objects):
-    if hasattr(bpy.app, "version") and bpy.app.version >= (2, 80):
+    if lsystem.util.BLENDER_2_80:
         polygons = []
         for ob in objects:
             me = ob.data
@@ -394,17 +492,14 @@ def add_to_selected_faces(inst_list, objects):
     for iter_list in inst_list:
         for obj_base_pairs in iter_list:
             face, ob = random.choice(faces)
-            new_positions = bpy_extras.mesh_utils.face_random_points(1, [face])
+            new_positions = lsystem.util.random_face_points(1, [face])
             obj = obj_base_pairs[0][0]
             obj.location = new_positions[0]
             obj.parent = ob
 
 
 def grid(inst_list, move_x=True):
-    if hasattr(bpy.app, "version") and bpy.app.version >= (2, 80):
-        cursor_loc = bpy.context.scene.cursor.location
-    else:
-        cursor_loc = bpy.context.scene.cursor_location
+    cursor_loc = lsystem.util.cursor_location(bpy.context)
     y = 0
     for iter_list in inst_list:
         x = 0
@@ -439,19 +534,11 @@ def get_max_y(obj_base_pairs):
     return y
 
 
-def run_once(context, turtle, instance, lsys, iterations):
-    start_time = time.time()
-    print_time(start_time, "lsystem: execute" +
-               "\n  seed = " + str(turtle.seed) +
-               "\n  iterations = " + str(iterations))
-    result = lsys.iterate(instance, iterations)
-    print_time(start_time, "turtle interpreting")
-    object_base_pairs = turtle.interpret(result, context)
-    print_time(start_time, "turtle finished")
-
+def run_once(context, turtle, iterations, modules, report=None):
+    # the last generation is derived while the turtle interprets it, its time
+    # is in report.generations and not in the interpret time
+    if report is None:
+        report = lsystem.lsystem.NULL_REPORT
+    with report.timer("interpret"):
+        object_base_pairs = turtle.interpret(modules, context, report)
     return object_base_pairs
-
-
-def print_time(start_time, message):
-    elapsed = time.time() - start_time
-    print("%.5fs: %s" % (elapsed, message))
@@ -1,24 +1,273 @@
+# numpy, concurrent.futures, threading and json are imported by the parts that
+# use them, so importing the engine stays fast when they aren't needed
 import random
 import math
-import unittest
+import operator
+import collections
+import array
+import itertools
+import logging
+import os
+import time
 
 
+def import_numpy(user):
+    """Return numpy, raise ImportError if it isn't installed
+
+    Only batch mode, MappedGeneration and core.Turtle.interpret_arrays, the
+    user, need numpy."""
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("{} requires numpy".format(user)) from None
+    return numpy
+
+
+logger = logging.getLogger(__name__)
+
+
+def _eq(a, b):
+    return 1 if a == b else 0
+
+
+def _lt(a, b):
+    return 1 if a < b else 0
+
+
+def _gt(a, b):
+    return 1 if a > b else 0
+
+
+def _gteq(a, b):
+    return 1 if a >= b else 0
+
+
+# name -> (function, number of arguments), see the functions table in readme.md
+FUNCTIONS = {
+    "add": (operator.add, 2),
+    "sub": (operator.sub, 2),
+    "mul": (operator.mul, 2),
+    "div": (operator.truediv, 2),
+    "pow": (pow, 2),
+    "log": (math.log, None),
+    "sqrt": (math.sqrt, 1),
+    "sin": (math.sin, 1),
+    "cos": (math.cos, 1),
+    "tan": (math.tan, 1),
+    "eq": (_eq, 2),
+    "lt": (_lt, 2),
+    "gt": (_gt, 2),
+    "gteq": (_gteq, 2),
+}
+
+
+# Element-wise versions of FUNCTIONS used by batch mode. Comparisons return 1/0
+# integers like their scalar versions.
+def _vector_log(a, b=None):
+    numpy = import_numpy("batch mode")
+    if b is None:
+        return numpy.log(a)
+    return numpy.log(a) / numpy.log(b)
+
+
+def _vector_compare(compare):
+    def func(a, b):
+        return import_numpy("batch mode").where(compare(a, b), 1, 0)
+    return func
+
+
+def _vector_numpy(name):
+    def func(*args):
+        return getattr(import_numpy("batch mode"), name)(*args)
+    return func
+
+
+VECTOR_FUNCTIONS = {
+    "add": operator.add,
+    "sub": operator.sub,
+    "mul": operator.mul,
+    "div": operator.truediv,
+    "pow": _vector_numpy("power"),
+    "log": _vector_log,
+    "sqrt": _vector_numpy("sqrt"),
+    "sin": _vector_numpy("sin"),
+    "cos": _vector_numpy("cos"),
+    "tan": _vector_numpy("tan"),
+    "eq": _vector_compare(operator.eq),
+    "lt": _vector_compare(operator.lt),
+    "gt": _vector_compare(operator.gt),
+    "gteq": _vector_compare(operator.ge),
+}
+
+
+def to_value(val):
+    """Convert a literal or a parameter value the same way as the string based derivation did"""
+    try:
+        return float(val)
+    except ValueError:
+        return val
+
+
+# Every compiled function f(values, env) also has a f.vector(columns, env)
+# version used by batch mode. columns is a list of numpy arrays, one for each
+# parameter, and the result is an array with one value per matched module or a
+# single value if it's the same for all of them.
+
+def compile_constant(value):
+    def constant(values, env):
+        return value
+    constant.value = value
+    constant.vector = constant
+    return constant
+
+
+def compile_parameter(slot):
+    def parameter(values, env):
+        val = values[slot]
+        if type(val) is float:
+            return val
+        return to_value(val)
+
+    def vector(columns, env):
+        return columns[slot]
+    parameter.vector = vector
+    return parameter
+
+
+def compile_property(name):
+    if name == "i":
+        def get(values, env):
+            return env.instance
+    elif name == "iter":
+        def get(values, env):
+            return env.iteration
+    else:
+        raise ValueError("Unknown property '{}'".format(name))
+    get.vector = get
+    return get
+
+
+def compile_rand(low, high):
+    def rand(values, env):
+        return env.random.uniform(low(values, env), high(values, env))
+
+    def vector(columns, env):
+        return env.random.uniform(low.vector(columns, env), high.vector(columns, env), env.size)
+    rand.vector = vector
+    return rand
+
+
+def compile_call(name, args):
+    if name not in FUNCTIONS:
+        raise ValueError("Unknown function '{}'".format(name))
+    func, num_args = FUNCTIONS[name]
+    if num_args is not None and len(args) != num_args:
+        raise ValueError("{}() takes {} arguments, got {}".format(name, num_args, len(args)))
+
+    if all(hasattr(arg, "value") for arg in args):
+        try:
+            return compile_constant(func(*[arg.value for arg in args]))
+        except (ArithmeticError, ValueError, TypeError):
+            pass  # fail when the rule is applied, not when it's created
+
+    if len(args) == 1:
+        a = args[0]
+
+        def call(values, env):
+            return func(a(values, env))
+    elif len(args) == 2:
+        a, b = args
+
+        def call(values, env):
+            return func(a(values, env), b(values, env))
+    else:
+        def call(values, env):
+            return func(*[arg(values, env) for arg in args])
+
+    def vector(columns, env):
+        return VECTOR_FUNCTIONS[name](*[arg.vector(columns, env) for arg in args])
+    call.vector = vector
+    return call
+
+
+def compile_expression(string, start, parameters):
+    """Compile the expression at string[start:] into a function f(values, env)
+
+    values are the parameter values of the matched module, in the order of
+    parameters, and env is the Environment of the derivation.
+    Returns the function and the index of the first character after the
+    expression."""
+    end = start
+    tot_len = len(string)
+    while end < tot_len and string[end] not in "(),":
+        end += 1
+    token = string[start:end]
+
+    if end < tot_len and string[end] == "(":
+        name = token.strip()
+        args, end = compile_arguments(string, end+1, parameters)
+        if name == "get":
+            if len(args) != 1 or not hasattr(args[0], "value"):
+                raise ValueError("get() takes a property name")
+            return compile_property(args[0].value), end
+        if name == "rand":
+            if len(args) != 2:
+                raise ValueError("rand() takes 2 arguments, got {}".format(len(args)))
+            return compile_rand(args[0], args[1]), end
+        return compile_call(name, args), end
+
+    name = token.strip()
+    if parameters is not None and name in parameters:
+        return compile_parameter(parameters.index(name)), end
+    return compile_constant(to_value(token)), end
+
+
+def compile_arguments(string, start, parameters):
+    """Compile a comma separated list of expressions ending with ')'
+
+    Returns the list of functions and the index after the closing parenthesis."""
+    args = []
+    i = start
+    tot_len = len(string)
+    while i < tot_len:
+        arg, i = compile_expression(string, i, parameters)
+        args.append(arg)
+        if i >= tot_len or string[i] == ")":
+            i += 1
+            break
+        i += 1  # skip ','
+    return args, i
+
+
+# Rules are compiled once and never change after that, matches and get_result
+# only use their arguments. So one set of rules can be used by any number of
+# derivations at the same time.
 class ProductionRule:
+    __slots__ = ("pattern", "parameters", "module", "condition", "result", "cut", "condition_func", "segments")
+
     def __init__(self, pattern, result, condition=None):
-        self.instance = 0
-        self.iteration = 0
         self.pattern = pattern
         self.parameters = self.get_parameters(pattern)
         if len(self.parameters) == 0:
             self.module = pattern
             self.parameters = None
-            self.consumed = len(self.module)
         else:
             pind = pattern.find("(")
             self.module = pattern[:pind]
-        self.param_subs = None
         self.condition = condition
         self.result = result
+        self.cut = "%" in result
+        try:
+            self.condition_func = None
+            if condition is not None and len(condition) > 0:
+                self.condition_func, end = compile_expression(condition, 0, self.parameters)
+            self.segments = []
+            for symbols, param_text in self.split_result(result):
+                if param_text is not None:
+                    param_text, end = compile_arguments(param_text, 0, self.parameters)
+                self.segments.append((symbols, param_text))
+        except ValueError as e:
+            raise ValueError("Invalid rule {}: {}".format(self, e))
 
     def copy_replace(self, constants):
         new_pattern = self.replace(self.pattern, constants)
@@ -37,8 +286,37 @@ class ProductionRule:
     def get_pattern(self):
         return self.pattern
 
-    def get_consumed(self):
-        return self.consumed
+    @staticmethod
+    def split_result(result):
+        # Split the result into (symbols, parameter text) pairs where the
+        # parameter text belongs to the last symbol and includes the closing
+        # parenthesis, ie "F+A(x,y)B" -> [("F+A", "x,y)"), ("B", None)].
+        # The parameter text is compiled into expressions by __init__.
+        segments = []
+        symbols = ""
+        i = 0
+        tot_len = len(result)
+        while i < tot_len:
+            c = result[i]
+            if c == "(":
+                depth = 1
+                end = i + 1
+                while end < tot_len and depth > 0:
+                    if result[end] == "(":
+                        depth += 1
+                    elif result[end] == ")":
+                        depth -= 1
+                    end += 1
+                segments.append((symbols, result[i+1:end]))
+                symbols = ""
+                i = end
+            else:
+                if c != "%":
+                    symbols += c
+                i += 1
+        if symbols:
+            segments.append((symbols, None))
+        return segments
 
     def get_parameters(self, str):
         if "(" in str:
@@ -53,201 +331,42 @@ class ProductionRule:
             return parameters
         return []
 
-    def eval_condition(self, string):
-        # print("eval_condition("+string+")")
-        i, val = self.parse_expression(string)
-        # print("val = "+str(val))
-        return val != 0
-
-    def matches(self, input):
-        # print("self.module: "+self.module)
-
-        if not input.startswith(self.module):
-            # print("input doesn't start with module")
-            return False
+    def matches(self, module, env):
+        """Return the parameter values of module if the rule matches it, otherwise None
 
-        if self.parameters is None:
-            # print("no parameters")
-            return True
+        A rule without parameters matches the module with any parameters, ie
+        A rewrites A(1) as well, and the parameters are dropped."""
+        name, values = module
+        if name != self.module:
+            return None
 
-        parameters = self.get_parameters(input)
-        if len(parameters) != len(self.parameters):
-            # print(str(len(parameters)) + " != " + str(len(self.parameters)))
-            return False
+        if self.parameters is not None and len(values) != len(self.parameters):
+            # print(str(len(values)) + " != " + str(len(self.parameters)))
+            return None
 
-        self.param_subs = dict()
-        for i in range(0, len(self.parameters)):
-            self.param_subs[self.parameters[i]] = parameters[i]
+        if self.condition_func is not None:
+            if self.condition_func(values, env) == 0:
+                return None
 
-        if self.condition is not None and len(self.condition) > 0:
-            if self.eval_condition(self.condition) == 0:
-                return False
-
-        self.consumed = input.find(")")+1
-        return True
-
-    def parse_parameters(self, string):
-        # print("parse_parameters: "+string)
-        parameters = list()
-        end_ind = 0
-        while end_ind < len(string):
-            c, val = self.parse_expression(string[end_ind:])
-            parameters.append(val)
-            end_ind += c
-            if string[end_ind] == ')':
-                end_ind += 1
-                break
-            end_ind += 1
-        # print("return "+str(end_ind)+", "+str(parameters))
-        return end_ind, parameters
+        return values
 
-    def parse_expression(self, string):
-        # print("parse_expression('"+string+"')")
-        try:
-            if string.startswith("rand("):
-                op_len = len("rand(")
-                count, values = self.parse_parameters(string[op_len:])
-                return count+op_len, random.uniform(values[0], values[1])
-            elif string.startswith("add("):
-                op_len = len("add(")
-                count, values = self.parse_parameters(string[op_len:])
-                return count+op_len, values[0]+values[1]
-            elif string.startswith("sub("):
-                op_len = len("sub(")
-                count, values = self.parse_parameters(string[op_len:])
-                return count+op_len, values[0] - values[1]
-            elif string.startswith("mul("):
-                op_len = len("mul(")
-                count, values = self.parse_parameters(string[op_len:])
-                return count+op_len, values[0] * values[1]
-            elif string.startswith("div("):
-                op_len = len("div(")
-                count, values = self.parse_parameters(string[op_len:])
-                return count+op_len, values[0] / values[1]
-            elif string.startswith("pow("):
-                op_len = len("pow(")
-                count, values = self.parse_parameters(string[op_len:])
-                return count+op_len, pow(values[0], values[1])
-            elif string.startswith("log("):
-                op_len = len("log(")
-                count, values = self.parse_parameters(string[op_len:])
-                if len(values) == 1:
-                    return count+op_len, math.log(values[0])
-                else:
-                    return count+op_len, math.log(values[0], values[1])
-            elif string.startswith("sqrt("):
-                op_len = len("sqrt(")
-                count, values = self.parse_parameters(string[op_len:])
-                return count+op_len, math.sqrt(values[0])
-            elif string.startswith("sin("):
-                op_len = len("sin(")
-                count, values = self.parse_parameters(string[op_len:])
-                return count+op_len, math.sin(values[0])
-            elif string.startswith("cos("):
-                op_len = len("cos(")
-                count, values = self.parse_parameters(string[op_len:])
-                return count+op_len, math.cos(values[0])
-            elif string.startswith("tan("):
-                op_len = len("tan(")
-                count, values = self.parse_parameters(string[op_len:])
-                return count+op_len, math.tan(values[0])
-            elif string.startswith("eq("):
-                op_len = len("eq(")
-                count, values = self.parse_parameters(string[op_len:])
-                c = count + op_len
-                if values[0] == values[1]:
-                    return c, 1
-                else:
-                    return c, 0
-            elif string.startswith("lt("):
-                op_len = len("lt(")
-                count, values = self.parse_parameters(string[op_len:])
-                c = count + op_len
-                if values[0] < values[1]:
-                    return c, 1
-                else:
-                    return c, 0
-            elif string.startswith("gt("):
-                op_len = len("gt(")
-                count, values = self.parse_parameters(string[op_len:])
-                c = count + op_len
-                if values[0] > values[1]:
-                    return c, 1
-                else:
-                    return c, 0
-            elif string.startswith("gteq("):
-                op_len = len("gteq(")
-                count, values = self.parse_parameters(string[op_len:])
-                c = count + op_len
-                if values[0] >= values[1]:
-                    return c, 1
-                else:
-                    return c, 0
-            elif string.startswith("get("):
-                op_len = len("get(")
-                count,values = self.parse_parameters(string[op_len:])
-                c = count + op_len
-                if values[0] == "i":
-                    return c, self.instance
-                if values[0] == "iter":
-                    return c, self.iteration
-            else:
-                c = 0
-                while c <= len(string) and string[c] != ',' and string[c] != ')':
-                    c += 1
-                val_str = string[:c]
-                if self.param_subs is not None and val_str in self.param_subs:
-                    val_str = self.param_subs[val_str]
-                try:
-                    val = float(val_str)
-                    return c,val
-                except ValueError:
-                    pass
-                return c, val_str
-
-        except Exception as e:
-            print("string: {}".format(string))
-            print(self.param_subs)
-            raise e
-
-    def get_result(self, instance, iteration, current_input):
-        # print(self.result)
-        # print(self.param_subs)
-        self.instance = instance
-        self.iteration = iteration
+    def get_result(self, successor, values, env):
+        """Return the list of modules produced by this rule
 
-        i = 0
-        tot_len = len(self.result)
-        res = ""
-        # assume result of a rule is "module(expression)module(expression)"
-        # where (expression) is optional
-        while i < tot_len:
-            c = self.result[i]
-            if c == "(" or c == ",":
-                i += 1
-                consumed, value = self.parse_expression(self.result[i:])
-                i += consumed
-                res += c+str(value)
-            elif c == "%":
-                # find end of branch/object
-                consumed = self.scan_end_branch(i+1, current_input)
-                self.consumed += consumed
-                i += consumed
+        successor is the result of the rule split into module names by
+        LSystem.split_successor and values are the parameter values returned
+        by matches."""
+        modules = []
+        for name, args in successor:
+            if args is None:
+                modules.append((name, ()))
             else:
-                res += c
-                i += 1
-
-        return res
-
-    def scan_end_branch(self, start_index, current_input):
-        i = start_index
-        while i < len(current_input):
-            c = current_input[i]
-            i += 1
-            if c == ']':
-                return i
+                modules.append((name, tuple([arg(values, env) for arg in args])))
+        return modules
 
-        return i-start_index
+    def __reduce__(self):
+        # the compiled expressions can't be pickled, compile them again instead
+        return ProductionRule, (self.pattern, self.result, self.condition)
 
     def __str__(self):
         if self.condition is not None and len(self.condition) > 0:
@@ -256,46 +375,1078 @@ class ProductionRule:
             return "'{}' -> '{}'".format(self.pattern, self.result)
 
 
+def module_to_string(module):
+    name, values = module
+    if values:
+        return name + "(" + ",".join([str(v) for v in values]) + ")"
+    return name
+
+
+def modules_to_string(modules):
+    """Convert a list of (name, parameters) modules to the string form"""
+    parts = []
+    for name, values in modules:
+        if values:
+            parts.append(name + "(" + ",".join([str(v) for v in values]) + ")")
+        else:
+            parts.append(name)
+    return "".join(parts)
+
+
+class Preview:
+    """The start of the string form of a list of modules for log messages,
+    only made if the message is logged"""
+    __slots__ = ("modules", "limit")
+
+    def __init__(self, modules, limit=200):
+        self.modules = modules
+        self.limit = limit
+
+    def __str__(self):
+        parts = []
+        length = 0
+        for module in self.modules:
+            if length >= self.limit:
+                return "".join(parts)[:self.limit] + "... ({} modules)".format(len(self.modules))
+            part = module_to_string(module)
+            parts.append(part)
+            length += len(part)
+        return "".join(parts)
+
+
+def build_trie(names):
+    """Build a prefix tree of module names, a name ends where the node has a None key"""
+    trie = {}
+    for name in names:
+        node = trie
+        for c in name:
+            node = node.setdefault(c, {})
+        node[None] = name
+    return trie
+
+
+def longest_name(trie, symbols, start):
+    """Return the longest module name in trie that symbols has at start, or
+    the single character at start if there is none"""
+    name = symbols[start]
+    node = trie
+    tot_len = len(symbols)
+    i = start
+    while i < tot_len:
+        node = node.get(symbols[i])
+        if node is None:
+            break
+        i += 1
+        if None in node:
+            name = node[None]
+    return name
+
+
+def build_index(entries):
+    """Map module name -> [(rule, successor)] keeping the order of the rules"""
+    index = {}
+    for entry in entries:
+        index.setdefault(entry[0].module, []).append(entry)
+    return index
+
+
+# A derivation is kept as a list of modules. A module is a tuple of the module
+# name and a tuple of parameter values, ie "F(1.0)A" is [("F", (1.0,)), ("A", ())].
+# Module names are single characters unless a production rule uses a longer
+# name, such as "Fa" or "aa(t)". The longest name wins so with rules for both
+# "F" and "Fa" the string "FaF" is split into "Fa" and "F".
 class LSystem:
     def __init__(self, axiom, rules, replacements):
         self.axiom = axiom
         self.rules = rules
         self.replacements = replacements
+        # Evaluate parametric rules for all modules of a generation at once
+        # with numpy, see exec_rules_batch
+        self.batch = False
+        # Reuse expansions of modules for deterministic, non-parametric rules,
+        # see ExpansionCache
+        self.memoize = True
+        # Refuse to derive if the predicted size of a generation is larger
+        # than this, see check_budget
+        self.max_modules = None
+        self.max_bytes = None
+        # (iterations, max_modules, max_bytes) of the last check_budget that passed
+        self.checked_budget = None
+        # Rewrite generations in chunks of chunk_size modules using this many
+        # processes, see exec_rules_chunked
+        self.chunk_workers = None
+        self.chunk_size = 100000
+        # (number of processes, ProcessPoolExecutor) for the chunks, started
+        # when it's first needed and kept until close
+        self.chunk_pool = None
 
-    def exec_rules(self, instance, iteration, input, rules):
-        result = ""
+        all_rules = list(rules)
+        if replacements is not None:
+            all_rules.extend(replacements)
+        self.trie = build_trie(set(rule.module for rule in all_rules if len(rule.module) > 1))
+
+        self.axiom_successor = self.split_successor(axiom)
+        self.rule_index = build_index([(rule, self.split_successor(rule)) for rule in rules])
+        self.replacement_index = None
+        if replacements:
+            self.replacement_index = build_index([(rule, self.split_successor(rule)) for rule in replacements])
+
+        self.expansions = None
+        successors = constant_successors(self.rule_index)
+        if successors is not None:
+            self.expansions = ExpansionCache(successors)
+        self.replacement_successors = None
+        if self.replacement_index is not None:
+            self.replacement_successors = constant_successors(self.replacement_index)
+
+    def __reduce__(self):
+        state = {"batch": self.batch, "memoize": self.memoize,
+                 "max_modules": self.max_modules, "max_bytes": self.max_bytes,
+                 "chunk_workers": self.chunk_workers, "chunk_size": self.chunk_size}
+        return LSystem, (self.axiom, self.rules, self.replacements), state
+
+    def split_symbols(self, symbols):
+        names = []
         i = 0
-        while i < len(input):
-            current_input = input[i:]
-            matching_rules = self.get_matching_rules(current_input)
-            if len(matching_rules) > 0:
-                chosen_rule = random.choice(matching_rules)
-                result += chosen_rule.get_result(instance, iteration, current_input)
-                i += chosen_rule.get_consumed()
+        tot_len = len(symbols)
+        while i < tot_len:
+            name = longest_name(self.trie, symbols, i)
+            names.append(name)
+            i += len(name)
+        return names
+
+    def split_successor(self, rule):
+        # [(module name, compiled parameter expressions or None)]
+        successor = []
+        for symbols, param_text in rule.segments:
+            names = self.split_symbols(symbols)
+            for name in names[:-1]:
+                successor.append((name, None))
+            if names:
+                successor.append((names[-1], param_text))
             else:
-                result += input[i]
-                i += 1
+                successor.append(("", param_text))
+        return successor
+
+    def exec_rules(self, modules, index, env):
+        result = []
+        self.rewrite_into(result, modules, index, env)
         return result
 
-    def get_matching_rules(self, string):
+    def rewrite_into(self, result, modules, index, env, skip=0):
+        """Append the successors of modules to result
+
+        skip is the depth of a cut that started before modules and the
+        depth at the end of modules is returned."""
+        hits = env.hits
+        for module in modules:
+            if skip:
+                name = module[0]
+                if name == "[":
+                    skip += 1
+                    continue
+                if name != "]":
+                    continue
+                skip -= 1
+                if skip:
+                    continue
+                # the end of the cut branch is kept
+
+            candidates = index.get(module[0])
+            if candidates is None:
+                result.append(module)
+                continue
+            matching = self.get_matching_rules(module, candidates, env)
+            if len(matching) > 0:
+                chosen_rule, successor, values = env.random.choice(matching)
+                if hits is not None:
+                    hits[chosen_rule] += 1
+                result.extend(chosen_rule.get_result(successor, values, env))
+                if chosen_rule.cut:
+                    skip = 1
+            else:
+                result.append(module)
+        return skip
+
+    def rewrite(self, modules, index, env):
+        """Same as exec_rules but a generator that rewrites each module when
+        the next module of the result is needed, so the result isn't stored"""
+        hits = env.hits
+        skip = 0
+        for module in modules:
+            if skip:
+                name = module[0]
+                if name == "[":
+                    skip += 1
+                    continue
+                if name != "]":
+                    continue
+                skip -= 1
+                if skip:
+                    continue
+
+            candidates = index.get(module[0])
+            if candidates is None:
+                yield module
+                continue
+            matching = self.get_matching_rules(module, candidates, env)
+            if len(matching) > 0:
+                chosen_rule, successor, values = env.random.choice(matching)
+                if hits is not None:
+                    hits[chosen_rule] += 1
+                for produced in chosen_rule.get_result(successor, values, env):
+                    yield produced
+                if chosen_rule.cut:
+                    skip = 1
+            else:
+                yield module
+
+    def exec_rules_blocks(self, modules, index, env, block_size=65536):
+        """Same as exec_rules but yields the result in blocks, each with the
+        successors of block_size modules, so the whole result is never in memory"""
+        modules = iter(modules)
+        skip = 0
+        while True:
+            block = list(itertools.islice(modules, block_size))
+            if not block:
+                return
+            result = []
+            skip = self.rewrite_into(result, block, index, env, skip)
+            yield result
+
+    def exec_rules_batch(self, modules, index, env, rng):
+        """Same as exec_rules but evaluates the conditions and results of a rule
+        for all the modules it matches in one go.
+
+        Random numbers, both from rand() and for picking between several matching
+        rules, come from the numpy generator rng so stochastic systems don't give
+        the same result as exec_rules. Deterministic rules do, except that errors
+        such as division by zero give inf or nan instead of an exception."""
+        numpy = import_numpy("batch mode")
+        groups = {}
+        for position, module in enumerate(modules):
+            if module[0] in index:
+                key = (module[0], len(module[1]))
+                if key in groups:
+                    groups[key].append(position)
+                else:
+                    groups[key] = [position]
+
+        batch_env = BatchEnvironment(env.instance, env.iteration, rng)
+        successors = [None] * len(modules)  # (rule, modules) for rewritten modules
+        for (name, arity), positions in groups.items():
+            candidates = [entry for entry in index[name]
+                          if entry[0].parameters is None or arity == len(entry[0].parameters)]
+            if not candidates:
+                continue
+            try:
+                matrix = numpy.array([modules[p][1] for p in positions], dtype=float)
+            except (ValueError, TypeError):
+                matrix = None  # not numbers, ie p(line)
+            if matrix is None:
+                for p in positions:
+                    matching = self.get_matching_rules(modules[p], candidates, env)
+                    if matching:
+                        rule, successor, values = env.random.choice(matching)
+                        successors[p] = (rule, rule.get_result(successor, values, env))
+                continue
+            self.apply_batch(positions, matrix.reshape(len(positions), arity), candidates, batch_env, successors)
+
+        if env.hits is not None:
+            for successor in successors:
+                if successor is not None:
+                    env.hits[successor[0]] += 1
+
+        result = []
+        if not any(entry[0].cut for entries in index.values() for entry in entries):
+            for module, successor in zip(modules, successors):
+                if successor is None:
+                    result.append(module)
+                else:
+                    result.extend(successor[1])
+            return result
+
+        skip = 0
+        for position, module in enumerate(modules):
+            if skip:
+                name = module[0]
+                if name == "[":
+                    skip += 1
+                    continue
+                if name != "]":
+                    continue
+                skip -= 1
+                if skip:
+                    continue
+
+            successor = successors[position]
+            if successor is None:
+                result.append(module)
+            else:
+                result.extend(successor[1])
+                if successor[0].cut:
+                    skip = 1
+        return result
+
+    def exec_chunk(self, modules, start, stop, env, offset=0):
+        """Rewrite the modules from start up to stop of a generation, offset is
+        the position of modules[0] in the generation
+
+        env.random is a CounterRandom that is moved to the position of each
+        module. Returns the result, the position in the result of each ] that
+        ends a branch that began before the chunk (where a cut that began
+        before it can end), the depth at the end relative to the start and
+        the depth of the cut at the end."""
+        index = self.rule_index
+        rng = env.random
+        hits = env.hits
+        result = []
+        ends = []
+        depth = 0
+        lowest = 0
+        skip = 0
+        for position in range(start, stop):
+            module = modules[position]
+            name = module[0]
+            if name == "[":
+                depth += 1
+            elif name == "]":
+                depth -= 1
+                if depth < lowest:
+                    lowest = depth
+                    ends.append(len(result))
+            if skip:
+                if name == "[":
+                    skip += 1
+                    continue
+                if name != "]":
+                    continue
+                skip -= 1
+                if skip:
+                    continue
+
+            candidates = index.get(name)
+            if candidates is None:
+                result.append(module)
+                continue
+            rng.seek(offset + position)
+            matching = self.get_matching_rules(module, candidates, env)
+            if len(matching) > 0:
+                chosen_rule, successor, values = rng.choice(matching)
+                if hits is not None:
+                    hits[chosen_rule] += 1
+                result.extend(chosen_rule.get_result(successor, values, env))
+                if chosen_rule.cut:
+                    skip = 1
+            else:
+                result.append(module)
+        return result, ends, depth, skip
+
+    def exec_rules_chunked(self, modules, env, seed, pool=None):
+        """Same as exec_rules with the rules of the l-system but the modules
+        are rewritten in chunks of chunk_size, by the processes of pool if it
+        isn't None.
+
+        Random numbers come from a CounterRandom so they only depend on seed, the
+        instance, the iteration and the position of the module and not on the
+        chunks or where they're rewritten. So stochastic systems don't give the
+        same result as exec_rules."""
+        chunk_size = max(1, self.chunk_size)
+        length = len(modules)
+        starts = range(0, length, chunk_size)
+        if pool is not None and len(starts) > 1:
+            rewritten = self.map_chunks(pool, modules, starts, env, seed)
+        else:
+            chunk_env = Environment(env.instance, env.iteration, CounterRandom(seed, env.instance, env.iteration),
+                                    env.hits)
+            rewritten = (self.exec_chunk(modules, start, min(start + chunk_size, length), chunk_env)
+                         for start in starts)
+
+        result = []
+        skip = 0
+        for produced, ends, depth, chunk_skip in rewritten:
+            if skip:
+                # a cut from an earlier chunk, drop the successors up to the
+                # end of the cut branch
+                if skip > len(ends):
+                    skip += depth  # the whole chunk is cut
+                    continue
+                result.extend(produced[ends[skip-1]:])
+            else:
+                result.extend(produced)
+            skip = chunk_skip
+        return result
+
+    def map_chunks(self, pool, modules, starts, env, seed):
+        """Yield the results of exec_chunk for the chunks at starts, rewritten
+        by the processes of pool
+
+        Only a few more chunks than there are processes are sliced and on
+        their way at a time."""
+        chunk_size = starts.step
+        pending = collections.deque()
+        for start in starts:
+            chunk = modules[start:start+chunk_size]
+            pending.append(pool.submit(_rewrite_chunk, chunk, start, env.instance, env.iteration, seed))
+            if len(pending) > 2 * self.chunk_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def get_chunk_pool(self):
+        """Return the ProcessPoolExecutor of chunk_workers processes, it's
+        started the first time and kept for the next generations until close"""
+        import concurrent.futures
+        if self.chunk_pool is not None and self.chunk_pool[0] != self.chunk_workers:
+            self.close()
+        if self.chunk_pool is None:
+            pool = concurrent.futures.ProcessPoolExecutor(self.chunk_workers, initializer=_init_worker,
+                                                          initargs=(self,))
+            self.chunk_pool = (self.chunk_workers, pool)
+        return self.chunk_pool[1]
+
+    def close(self):
+        """Stop the processes that rewrite the chunks, see chunk_workers"""
+        if self.chunk_pool is not None:
+            self.chunk_pool[1].shutdown()
+            self.chunk_pool = None
+
+    @staticmethod
+    def apply_batch(positions, matrix, candidates, env, successors):
+        numpy = import_numpy("batch mode")
+        size = len(positions)
+        env.size = size
+        columns = [matrix[:, i] for i in range(matrix.shape[1])]
+
+        masks = []
+        for rule, successor in candidates:
+            if rule.condition_func is None:
+                masks.append(numpy.ones(size, dtype=bool))
+            else:
+                mask = numpy.asarray(rule.condition_func.vector(columns, env)) != 0
+                masks.append(numpy.broadcast_to(mask, (size,)))
+
+        count = numpy.sum(masks, axis=0)
+        pick = numpy.zeros(size, dtype=int)
+        if count.max() > 1:
+            pick = (env.random.random(size) * count).astype(int)
+
+        chosen = numpy.full(size, -1)
+        seen = numpy.zeros(size, dtype=int)
+        for i, mask in enumerate(masks):
+            chosen[mask & (seen == pick) & (chosen == -1)] = i
+            seen += mask
+
+        for i, (rule, successor) in enumerate(candidates):
+            rows = numpy.nonzero(chosen == i)[0]
+            num_rows = len(rows)
+            if num_rows == 0:
+                continue
+            env.size = num_rows
+            rule_columns = [column[rows] for column in columns]
+            items = []  # for each module of the successor, the module for each row
+            for name, args in successor:
+                if args is None:
+                    items.append([(name, ())] * num_rows)
+                    continue
+                values = []
+                for arg in args:
+                    value = arg.vector(rule_columns, env)
+                    if isinstance(value, numpy.ndarray) and value.ndim > 0:
+                        values.append(numpy.broadcast_to(value, (num_rows,)).tolist())
+                    else:
+                        if isinstance(value, numpy.generic):
+                            value = value.item()
+                        values.append([value] * num_rows)
+                items.append(list(zip([name] * num_rows, zip(*values))))
+            for position, produced in zip(numpy.asarray(positions)[rows].tolist(), zip(*items)):
+                successors[position] = (rule, produced)
+
+    def get_matching_rules(self, module, candidates, env):
+        """Return (rule, successor, values) for the candidates that match module"""
         matching_rules = []
-        for rule in self.rules:
-            if rule.matches(string):
-                matching_rules.append(rule)
+        for rule, successor in candidates:
+            values = rule.matches(module, env)
+            if values is not None:
+                matching_rules.append((rule, successor, values))
         return matching_rules
 
-    def iterate(self, instance, iterations):
-        result = self.axiom.get_result(instance, 0, "")
-        print(result)
+    def generations(self, instance, iterations, rng=None, lazy=False, start=0, report=None):
+        """Yield the modules of iteration start up to and including iterations
+
+        Each generation is derived once from the one before it. The replacements
+        aren't applied, see replace. rng is a random.Random or a
+        numpy.random.Generator that is used for all random numbers, by default
+        the random module is used. Give each derivation its own rng to run
+        several of them at the same time.
+
+        With chunk_workers the generations are rewritten by exec_rules_chunked,
+        unless they're memoized. If lazy is True the last generation is an
+        iterable that derives the modules as they're used, see rewrite, or an
+        Expansion if it's memoized, except in batch mode or with chunk_workers.
+        Memoized generations before start aren't derived at all.
+
+        The time and size of each generation and the rules that are applied
+        are added to report, a Report. The time of a lazy generation is the
+        time spent deriving its modules while they're used."""
+        if report is None:
+            report = NULL_REPORT
+        self.check_budget(iterations)
+        batch_rng = None
+        if self.batch:
+            numpy = import_numpy("batch mode")
+            if is_numpy_generator(rng):
+                batch_rng = rng
+            else:
+                batch_rng = numpy.random.default_rng(random_seed(rng))
+        rng = as_random(rng)
+        chunk_seed = None
+        pool = None
+        if self.chunk_workers is not None and batch_rng is None:
+            chunk_seed = rng.getrandbits(64)
+            if self.chunk_workers > 1:
+                pool = self.get_chunk_pool()
+
+        axiom = self.axiom.get_result(self.axiom_successor, (), Environment(instance, 0, rng))
+        if start == 0:
+            logger.debug("axiom: %s", Preview(axiom))
+            yield axiom
+
+        memoized = batch_rng is None and self.memoize and self.expansions is not None
+        result = axiom
+        for i in range(0, iterations):
+            if memoized and i+1 < start:
+                continue
+            env = Environment(instance, i, rng, report.rule_hits)
+            if lazy and i == iterations-1 and batch_rng is None and chunk_seed is None:
+                if memoized:
+                    start_time = time.perf_counter()
+                    expansion = self.expansions.expansion(axiom, i+1)
+                    report.add_generation(instance, i+1, expansion.length, time.perf_counter() - start_time)
+                    yield expansion
+                elif report is not NULL_REPORT:
+                    yield counted(self.rewrite(result, self.rule_index, env), report, instance, i+1)
+                else:
+                    yield self.rewrite(result, self.rule_index, env)
+                return
+            start_time = time.perf_counter()
+            if batch_rng is not None:
+                result = self.exec_rules_batch(result, self.rule_index, env, batch_rng)
+            elif memoized:
+                result = self.expansions.expand(axiom, i+1)
+            elif chunk_seed is not None:
+                result = self.exec_rules_chunked(result, env, chunk_seed, pool)
+            else:
+                result = self.exec_rules(result, self.rule_index, env)
+            report.add_generation(instance, i+1, len(result), time.perf_counter() - start_time)
+            if i+1 >= start:
+                logger.debug("iteration %d: %s", i+1, Preview(result))
+                yield result
+
+    def save_generations(self, path, instance, iterations, rng=None, float_type="d"):
+        """Derive the generations the same way as generations but write each one
+        to the directory path/<iteration> and return them as MappedGenerations
+
+        Only one block of a generation is in memory at a time, so the
+        generations may be larger than the memory. The replacements aren't
+        applied and batch, memoize and chunk_workers aren't used. float_type
+        is the type of the parameters in the files, see GenerationWriter."""
+        rng = as_random(rng)
+        axiom = self.axiom.get_result(self.axiom_successor, (), Environment(instance, 0, rng))
+        with GenerationWriter(os.path.join(path, "0"), float_type) as writer:
+            writer.write(axiom)
+        generations = [MappedGeneration(os.path.join(path, "0"))]
+        for i in range(0, iterations):
+            env = Environment(instance, i, rng)
+            generation_path = os.path.join(path, str(i+1))
+            with GenerationWriter(generation_path, float_type) as writer:
+                for block in self.exec_rules_blocks(generations[-1], self.rule_index, env):
+                    writer.write(block)
+            generations.append(MappedGeneration(generation_path))
+        return generations
+
+    def replace(self, instance, modules, rng=None):
+        """Apply the replacements to the modules of a generation"""
+        if self.replacement_index is None:
+            return modules
+        rng = as_random(rng)
+        result = self.exec_rules(modules, self.replacement_index, Environment(instance, 0, rng))
+        logger.debug("replaced: %s", Preview(result))
+        return result
+
+    def derive_range(self, instance, min_iterations, max_iterations, rng=None, lazy=False, report=None):
+        """Yield (iterations, modules) for min_iterations up to and including
+        max_iterations, with the replacements applied
+
+        All the iterations come from one derivation, see generations. The
+        replacements of each iteration get their random numbers from a
+        random.Random of their own, so an iteration doesn't depend on
+        min_iterations. If lazy is True the modules are iterators and the
+        last generation and the replacements are derived as they're used.
+
+        The replacements are applied while the last generation is derived, so
+        only the replaced modules are stored. If the generation is memoized
+        and the replacements are constant they're applied to the Expansion.
+        See generations for report."""
+        replacement_seed = None
+        if self.replacement_index is not None:
+            replacement_seed = random_seed(rng)
+        generations = self.generations(instance, max_iterations, rng, lazy or replacement_seed is not None,
+                                       min_iterations, report)
+        for iterations, modules in zip(range(min_iterations, max_iterations+1), generations):
+            if replacement_seed is not None:
+                if type(modules) is Expansion and self.replacement_successors is not None:
+                    modules = modules.replace(self.replacement_successors)
+                else:
+                    env = Environment(instance, 0, random.Random(replacement_seed + iterations),
+                                      report.rule_hits if report is not None else None)
+                    if lazy:
+                        modules = self.rewrite(modules, self.replacement_index, env)
+                    else:
+                        modules = self.exec_rules(modules, self.replacement_index, env)
+            if type(modules) is Expansion:
+                modules = iter(modules) if lazy else modules.flatten()
+            yield iterations, modules
+
+    def stream(self, instance, iterations, rng):
+        """Return an iterator over the modules of the given iteration that
+        derives the last generation as it's used, see derive_range
+
+        rng is required, ie random.Random(seed). The modules are derived while
+        they're used, so the global random state could be changed in between,
+        ie by Turtle.interpret which seeds it."""
+        for i, modules in self.derive_range(instance, iterations, iterations, rng, lazy=True):
+            return modules
+
+    def derive(self, instance, iterations, rng=None):
+        """Return the modules of the given iteration"""
+        for i, modules in self.derive_range(instance, iterations, iterations, rng):
+            return modules
+
+    def iterate(self, instance, iterations, rng=None):
+        return modules_to_string(self.derive(instance, iterations, rng))
+
+    def predict_growth(self, iterations):
+        """Predict the number of modules of iterations 0 to iterations, see Growth
+
+        The modules are counted per name and number of parameters (a Parikh
+        vector) and multiplied with the counts of the rule results for each
+        iteration. Stochastic and conditional rules give a lower and an upper bound."""
+        rows, exact, cut = growth_rows(self.rule_index)
+        counts = successor_counts(self.axiom_successor)
+        low = [counts]
+        high = [counts]
         for i in range(0, iterations):
-            result = self.exec_rules(instance, i, result, self.rules)
-            print(result)
-        if self.replacements is not None:
-            result = self.exec_rules(instance, 0, result, self.replacements)
-            print(result)
+            high.append(apply_growth(high[-1], rows, 1))
+            low.append({} if cut else apply_growth(low[-1], rows, 0))
+        if self.replacement_index is not None:
+            replacement_rows, replacement_exact, replacement_cut = growth_rows(self.replacement_index)
+            exact = exact and replacement_exact
+            high.append(apply_growth(high[-1], replacement_rows, 1))
+            low.append({} if cut or replacement_cut else apply_growth(low[-1], replacement_rows, 0))
+        return Growth(low, high, exact and not cut)
+
+    def check_budget(self, iterations):
+        """Raise GrowthLimitError if the prediction for iterations is over max_modules or max_bytes
+
+        Only an exact prediction is enforced. With conditional or stochastic
+        rules the upper bound can be far larger than what is really derived,
+        ie when the conditions end the growth, so it's only logged as a
+        warning. The prediction isn't repeated for each instance once it has
+        passed."""
+        if self.max_modules is None and self.max_bytes is None:
+            return
+        budget = (iterations, self.max_modules, self.max_bytes)
+        if budget == self.checked_budget:
+            return
+        growth = self.predict_growth(iterations)
+        if not growth.exact:
+            if ((self.max_modules is not None and growth.max_modules() > self.max_modules)
+                    or (self.max_bytes is not None and growth.max_bytes() > self.max_bytes)):
+                logger.warning("%d iterations are predicted to produce %s, over the limit but the prediction "
+                               "is only an upper bound", iterations, growth)
+            self.checked_budget = budget
+            return
+        if self.max_modules is not None and growth.max_modules() > self.max_modules:
+            raise GrowthLimitError("{} iterations are predicted to produce up to {} modules, the limit is {}".format(
+                iterations, growth.max_modules(), self.max_modules), growth)
+        if self.max_bytes is not None and growth.max_bytes() > self.max_bytes:
+            raise GrowthLimitError("{} iterations are predicted to use up to {} bytes, the limit is {}".format(
+                iterations, growth.max_bytes(), self.max_bytes), growth)
+        self.checked_budget = budget
+
+
+def successor_counts(successor):
+    """Return (module name, number of parameters) -> number of modules"""
+    counts = {}
+    for name, args in successor:
+        key = (name, 0 if args is None else len(args))
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def growth_rows(index):
+    """Return the rows of the growth matrix for the rules in index
+
+    The rows are (name, number of parameters) -> (smallest counts, largest counts)
+    of what a module turns into, and there is no row for modules that are never
+    rewritten. The rules without parameters match any number of parameters,
+    they're under (name, None) as (counts, conditional) for growth_row. Also
+    returns if every row is exact and if any rule cuts branches."""
+    options = {}
+    conditional = set()
+    cut = False
+    for name, entries in index.items():
+        for rule, successor in entries:
+            key = (name, 0 if rule.parameters is None else len(rule.parameters))
+            options.setdefault(key, []).append(successor_counts(successor))
+            if rule.condition_func is not None:
+                conditional.add(key)
+            cut = cut or rule.cut
+
+    rows = {}
+    exact = True
+    for key, counts in options.items():
+        is_conditional = key in conditional
+        any_parameters = (key[0], 0)
+        if key[1] > 0 and any_parameters in options:
+            counts = counts + options[any_parameters]
+            is_conditional = is_conditional or any_parameters in conditional
+        rows[key] = growth_row(key, counts, is_conditional)
+        if len(counts) > 1 or is_conditional:
+            exact = False
+    for key, counts in options.items():
+        if key[1] == 0:
+            rows[(key[0], None)] = (counts, key in conditional)
+    return rows, exact, cut
+
+
+def growth_row(key, counts, conditional):
+    """Return (smallest counts, largest counts) of the options counts for the module key"""
+    if conditional:
+        counts = counts + [{key: 1}]  # the conditions of all rules could be false
+    keys = set()
+    for c in counts:
+        keys.update(c)
+    low = dict((k, min([c.get(k, 0) for c in counts])) for k in keys)
+    high = dict((k, max([c.get(k, 0) for c in counts])) for k in keys)
+    return low, high
+
+
+def apply_growth(counts, rows, bound):
+    """Multiply the counts with the growth matrix, bound is 0 for the lower bound
+    and 1 for the upper bound"""
+    result = {}
+    for key, count in counts.items():
+        row = rows.get(key)
+        if row is None and key[1] > 0 and (key[0], None) in rows:
+            row = growth_row(key, *rows[(key[0], None)])
+        if row is None:
+            result[key] = result.get(key, 0) + count
+            continue
+        for k, c in row[bound].items():
+            if c:
+                result[k] = result.get(k, 0) + count * c
+    return result
+
+
+def module_bytes(num_parameters):
+    """Rough memory use of a module in a derivation, the list item and the
+    (name, parameters) tuple plus the parameter tuple with float values"""
+    if num_parameters == 0:
+        return 64
+    return 64 + 40 + 32 * num_parameters
+
+
+class Growth:
+    """Predicted sizes of the generations of an LSystem
+
+    low[i] and high[i] are the smallest and largest possible number of modules
+    after i iterations, they are the same if exact is True. If the l-system has
+    replacements the last item is the result of the replacements. Cuts (%) make
+    the lower bound 0."""
+    def __init__(self, low_counts, high_counts, exact):
+        self.low = [sum(counts.values()) for counts in low_counts]
+        self.high = [sum(counts.values()) for counts in high_counts]
+        self.high_bytes = [sum([module_bytes(key[1]) * c for key, c in counts.items()]) for counts in high_counts]
+        self.exact = exact
+
+    def max_modules(self):
+        return max(self.high)
+
+    def max_bytes(self):
+        return max(self.high_bytes)
+
+    def __str__(self):
+        if self.exact:
+            return "{} modules (~{} bytes)".format(self.high[-1], self.high_bytes[-1])
+        return "{} to {} modules (~{} bytes)".format(self.low[-1], self.high[-1], self.high_bytes[-1])
+
+
+class GrowthLimitError(Exception):
+    def __init__(self, message, growth):
+        Exception.__init__(self, message)
+        self.growth = growth
+
+
+def is_numpy_generator(rng):
+    # the module of the type is checked first so a random.Random doesn't load numpy
+    if not type(rng).__module__.startswith("numpy"):
+        return False
+    return isinstance(rng, import_numpy("a numpy generator").random.Generator)
+
+
+def random_seed(rng):
+    """Return a 64 bit seed from rng, see as_random"""
+    if is_numpy_generator(rng):
+        return int(rng.integers(0, 2**63))
+    return as_random(rng).getrandbits(64)
+
+
+def as_random(rng):
+    """Return something with the interface of random.Random for rng
+
+    A numpy.random.Generator seeds a new random.Random so the rules that aren't
+    evaluated in batch mode still get their random numbers from it."""
+    if rng is None:
+        return random
+    if is_numpy_generator(rng):
+        return random.Random(int(rng.integers(0, 2**63)))
+    return rng
+
+
+def splitmix64(x):
+    x = (x + 0x9e3779b97f4a7c15) & 0xffffffffffffffff
+    x = ((x ^ (x >> 30)) * 0xbf58476d1ce4e5b9) & 0xffffffffffffffff
+    x = ((x ^ (x >> 27)) * 0x94d049bb133111eb) & 0xffffffffffffffff
+    return x ^ (x >> 31)
+
+
+class CounterRandom:
+    """Counter based random numbers for exec_rules_chunked
+
+    The numbers for a module are a hash of the seed, instance, iteration,
+    the position of the module (see seek) and how many numbers it has used."""
+    __slots__ = ("key", "state", "counter")
+
+    def __init__(self, seed, instance, iteration):
+        self.key = splitmix64(splitmix64(splitmix64(seed) ^ instance) ^ iteration)
+        self.state = self.key
+        self.counter = 0
+
+    def seek(self, position):
+        self.state = splitmix64(self.key ^ position)
+        self.counter = 0
+
+    def random(self):
+        self.counter += 1
+        return (splitmix64(self.state ^ (self.counter << 48)) >> 11) * (1.0 / 9007199254740992.0)
+
+    def uniform(self, a, b):
+        return a + (b - a) * self.random()
+
+    def choice(self, seq):
+        return seq[int(self.random() * len(seq))]
+
+
+class Environment:
+    """The state of a derivation that expressions can use"""
+    __slots__ = ("instance", "iteration", "random", "hits")
+
+    def __init__(self, instance, iteration, rng, hits=None):
+        self.instance = instance
+        self.iteration = iteration
+        self.random = rng  # random.Random or the random module
+        self.hits = hits  # rule -> number of times it's been applied or None
+
+
+class BatchEnvironment:
+    def __init__(self, instance, iteration, rng):
+        self.instance = instance
+        self.iteration = iteration
+        self.random = rng  # numpy.random.Generator
+        self.size = 0  # number of modules being evaluated
+
+
+def constant_successors(index):
+    """Return module name -> successor modules if all the rules in index are
+    deterministic and without parameters, conditions or cuts, otherwise None"""
+    successors = {}
+    for name, entries in index.items():
+        if len(entries) != 1:
+            return None
+        rule, successor = entries[0]
+        if rule.parameters is not None or rule.condition_func is not None or rule.cut:
+            return None
+        modules = []
+        for module_name, args in successor:
+            if args is None:
+                modules.append((module_name, ()))
+            elif all(hasattr(arg, "value") for arg in args):
+                modules.append((module_name, tuple([arg.value for arg in args])))
+            else:
+                return None  # rand() or get()
+        successors[name] = modules
+    return successors
+
+
+class Expansion:
+    """What a module turns into after a number of iterations
+
+    parts are modules and other Expansions, so expansions that occur several
+    times are only stored once. Small expansions also keep their modules as a
+    list to make flatten fast."""
+    __slots__ = ("parts", "length", "modules")
+
+    FLAT_SIZE = 1024
+
+    def __init__(self, parts):
+        self.parts = parts
+        length = 0
+        for part in parts:
+            length += part.length if type(part) is Expansion else 1
+        self.length = length
+        self.modules = None
+        if length <= Expansion.FLAT_SIZE:
+            modules = []
+            for part in parts:
+                if type(part) is Expansion:
+                    modules.extend(part.modules)
+                else:
+                    modules.append(part)
+            self.modules = modules
+
+    def __iter__(self):
+        if self.modules is not None:
+            return iter(self.modules)
+        return self.iterate_parts()
+
+    def iterate_parts(self):
+        stack = [iter(self.parts)]
+        while stack:
+            for part in stack[-1]:
+                if type(part) is Expansion:
+                    if part.modules is not None:
+                        for module in part.modules:
+                            yield module
+                    else:
+                        stack.append(iter(part.parts))
+                        break
+                else:
+                    yield part
+            else:
+                stack.pop()
+
+    def replace(self, successors, replaced=None):
+        """Return a copy where the modules that are in successors, module
+        name -> modules, are replaced
+
+        Each Expansion is only replaced once, replaced is id -> the copy."""
+        if replaced is None:
+            replaced = {}
+        result = replaced.get(id(self))
+        if result is None:
+            parts = []
+            for part in self.parts:
+                if type(part) is Expansion:
+                    parts.append(part.replace(successors, replaced))
+                elif part[0] in successors:
+                    parts.extend(successors[part[0]])
+                else:
+                    parts.append(part)
+            result = replaced[id(self)] = Expansion(parts)
+        return result
+
+    def flatten(self):
+        if self.modules is not None:
+            return list(self.modules)
+        result = []
+        stack = [iter(self.parts)]
+        while stack:
+            for part in stack[-1]:
+                if type(part) is Expansion:
+                    if part.modules is not None:
+                        result.extend(part.modules)
+                    else:
+                        stack.append(iter(part.parts))
+                        break
+                else:
+                    result.append(part)
+            else:
+                stack.pop()
         return result
 
 
+class ExpansionCache:
+    """Least recently used cache of (module name, iterations) -> Expansion for
+    l-systems where constant_successors isn't None. Deriving n iterations then
+    costs about n times the number of rules instead of the length of the result."""
+
+    def __init__(self, successors, max_size=4096):
+        self.successors = successors
+        self.max_size = max_size
+        self.expansions = collections.OrderedDict()
+        # Expansions never change once created but the cache itself is
+        # shared by all derivations of the l-system
+        import threading
+        self.lock = threading.Lock()
+
+    def cached_level(self, depth):
+        level = {}
+        for name in self.successors:
+            key = (name, depth)
+            expansion = self.expansions.get(key)
+            if expansion is None:
+                return None
+            self.expansions.move_to_end(key)
+            level[name] = expansion
+        return level
+
+    def get_level(self, depth):
+        """Return module name -> Expansion after depth iterations"""
+        start = depth
+        level = None
+        while start > 0:
+            level = self.cached_level(start)
+            if level is not None:
+                break
+            start -= 1
+        for d in range(start+1, depth+1):
+            next_level = {}
+            for name, successor in self.successors.items():
+                parts = []
+                for module in successor:
+                    # after 0 iterations a module is itself, with its parameters
+                    if level is not None and module[0] in level:
+                        parts.append(level[module[0]])
+                    else:
+                        parts.append(module)
+                next_level[name] = Expansion(parts)
+                self.expansions[(name, d)] = next_level[name]
+            level = next_level
+        while len(self.expansions) > self.max_size:
+            self.expansions.popitem(last=False)
+        return level
+
+    def expand(self, modules, depth):
+        """Return the modules after depth iterations"""
+        if depth == 0:
+            return modules
+        return self.expansion(modules, depth).flatten()
+
+    def expansion(self, modules, depth):
+        """Return an Expansion of the modules after depth iterations"""
+        with self.lock:
+            level = self.get_level(depth)
+        parts = []
+        for module in modules:
+            if module[0] in level:
+                parts.append(level[module[0]])
+            else:
+                parts.append(module)
+        return Expansion(parts)
+
+
 # def exec_rules(instance, iteration, input, rules):
 #     result = ""
 #     i = 0
@@ -328,140 +1479,412 @@ class LSystem:
 #         result = exec_rules(instance, i, result, rules)
 #     return result
 
-def run_test(axiom, rules, iterations):
-    axiomRule = ProductionRule("", axiom)
-    lsystem = LSystem(axiomRule, rules, None)
-    return lsystem.iterate(0, iterations)
-
-# Can't use unittests in separate module because of mathutils dependency in __init__.py
-class TestLSystem(unittest.TestCase):
-
-    def test_algae(self):
-        rule1 = ProductionRule("A", "AB")
-        rule2 = ProductionRule("B", "A")
-        result = run_test("A", [rule1, rule2], 5)
-        expected = "ABAABABAABAAB"
-        self.assertEqual(expected, result)
-
-    def test_para(self):
-        axiom = "X"
-        rule1 = ProductionRule("X", "F+(45)X")
-        rule2 = ProductionRule("+(45)", "-(30)")
-        result = run_test(axiom, [rule1, rule2], 1)
-        expected = "F+(45.0)X"
-        self.assertEqual(expected, result)
-        result = run_test(axiom, [rule1, rule2], 2)
-        expected = "F-(30.0)F+(45.0)X"
-        self.assertEqual(expected, result)
-        result = run_test(axiom, [rule1, rule2], 3)
-        expected = "F-(30.0)F-(30.0)F+(45.0)X"
-        self.assertEqual(expected, result)
-
-    def test_rand(self):
-        random.seed(0)
-        axiom = "X"
-        rule = ProductionRule("X", "F+(rand(22,44))X")
-        result = run_test(axiom, [rule], 1)
-        expected = "F+(38.674996864686655)X"
-        self.assertEqual(expected, result)
-
-    def test_stochastic(self):
-        axiom = "X"
-        rule1 = ProductionRule("X", "FX")
-        rule2 = ProductionRule("X", "+X")
-
-        random.seed(0)
-        result = run_test(axiom, [rule1, rule2], 1)
-        expected = "+X"
-        self.assertEqual(expected, result)
-
-        random.seed(0)
-        result = run_test(axiom, [rule1, rule2], 3)
-        expected = "++FX"
-        self.assertEqual(expected, result)
-
-    def test_parametric_simple(self):
-        axiom = "A(1.0,2.0)B(3.0)"
-        rule1 = ProductionRule("A(x,y)", "A(y,x)")
-        result = run_test(axiom, [rule1], 1)
-        expected = "A(2.0,1.0)B(3.0)"
-        self.assertEqual(expected, result)
-
-    def test_parametric(self):
-        axiom = "A(2.0, 3.0)B(1.0)"
-        rule1 = ProductionRule("A(x,y)", "A(div(x,2),add(x,y))B(x)")
-
-        result = run_test(axiom, [rule1], 1)
-        expected = "A(1.0,5.0)B(2.0)B(1.0)"
-        self.assertEqual(expected, result)
-
-    def test_parametric_2(self):
-        axiom = "A(1,10)"
-        rule1 = ProductionRule("A(l,w)", "¤(w)F(l)[\(45)B(mul(l,0.6),mul(w,0.707))]>(137.5)A(mul(l,0.9),mul(w,0.707))")
-
-        result = run_test(axiom, [rule1], 1)
-        expected = "¤(10.0)F(1.0)[\(45.0)B(0.6,7.069999999999999)]>(137.5)A(0.9,7.069999999999999)"
-        self.assertEqual(expected, result)
-
-    def test_parametric_with_condition(self):
-        axiom = "A(3.0)"
-        rule1 = ProductionRule("A(x)", "B(2.0)", "lt(x,2.0)")
-        rule2 = ProductionRule("A(x)", "C(4.0)", "gt(x,2.0)")
-
-        result = run_test(axiom, [rule1, rule2], 1)
-        expected = "C(4.0)"
-        self.assertEqual(expected, result)
-
-    def test_set_pen(self):
-        axiom = "X"
-        rule1 = ProductionRule("X", "p(line)")
-        result = run_test(axiom, [rule1], 1)
-        expected = "p(line)"
-        self.assertEqual(expected, result)
-
-    def test_math(self):
-        axiom = "X(1,0.1)"
-        rule1 = ProductionRule("X(x,l)", "¤(sub(1,div(pow(x,2),16)))F(l)X(add(x,l),l)")
-        result = run_test(axiom, [rule1], 1)
-        expected = "¤(0.9375)F(0.1)X(1.1,0.1)"
-        self.assertEqual(expected, result)
-
-    def test_row_of_trees(self):
-        axiom = "A(1)"
-        rule = ProductionRule("A(s)", "F(s)[+A(div(s,1.456))][-A(div(s,1.456))]")
-        result = run_test(axiom, [rule], 2)
-        expected = "F(1.0)[+F(0.6868131868131868)[+A(0.47171235358048547)][-A(0.47171235358048547)]][-F(0.6868131868131868)[+A(0.47171235358048547)][-A(0.47171235358048547)]]"
-        self.assertEqual(expected, result)
-
-    def test_abscission(self):
-        axiom = "AXA"
-        rule = ProductionRule("X", "%")
-        result = run_test(axiom, [rule], 1)
-        expected = "A"
-        self.assertEqual(expected, result)
-
-    def test_get_instance(self):
-        axiom = "X"
-        rule = ProductionRule("X", "F(get(i))")
-        result = run_test(axiom, [rule], 1)
-        expected = "F(0)"
-        self.assertEqual(expected, result)
-
-    def test_get_iterations(self):
-        axiom = "X"
-        rule = ProductionRule("X", "-(get(iter))F")
-        result = run_test(axiom, [rule], 4)
-        expected = "-(0)F"
-        self.assertEqual(expected, result)
-
-    def test_get_iterations2(self):
-        axiom = "X"
-        rule = ProductionRule("X", "AX")
-        rule2 = ProductionRule("A", "F[-(get(iter))F]")
-        result = run_test(axiom, [rule, rule2], 4)
-        expected = "F[-(1)F]F[-(2)F]F[-(3)F]AX"
-        self.assertEqual(expected, result)
-
-
-if __name__ == "__main__":
-    unittest.main()
+# A generation on disk is a directory with these files, see GenerationWriter
+#   names.json  the module names, the strings used as parameter values and sizes
+#   ids         uint16 index into the names for each module
+#   offsets     uint64, the parameters of module i are params[offsets[i]:offsets[i+1]]
+#   params      float64 (or float32) parameter values
+#   kinds       uint8 for each parameter, 0 for a float, 1 for an int and 2 if
+#               the value in params is an index into the strings
+# The arrays are in native byte order.
+GENERATION_FILES = ("ids", "offsets", "params", "kinds")
+FLOAT_KIND = 0
+INT_KIND = 1
+STRING_KIND = 2
+
+
+class GenerationWriter:
+    """Write a generation to the directory path one block of modules at a time
+
+    float_type is "d" for float64 or "f" for float32 parameters, the latter
+    takes half the space but loses precision. names.json is written last by
+    close, so a generation that failed to be written can't be opened by
+    MappedGeneration."""
+
+    BLOCK_SIZE = 65536
+
+    def __init__(self, path, float_type="d"):
+        os.makedirs(path, exist_ok=True)
+        try:
+            os.remove(os.path.join(path, "names.json"))  # of a generation written before
+        except FileNotFoundError:
+            pass
+        self.path = path
+        self.float_type = float_type
+        self.names = {}
+        self.strings = {}
+        self.length = 0
+        self.num_parameters = 0
+        self.files = dict((name, open(os.path.join(path, name), "wb")) for name in GENERATION_FILES)
+        array.array("Q", [0]).tofile(self.files["offsets"])
+
+    def write(self, modules):
+        names = self.names
+        strings = self.strings
+        ids = array.array("H")
+        offsets = array.array("Q")
+        params = array.array(self.float_type)
+        kinds = array.array("B")
+        num_parameters = self.num_parameters
+        for name, parameters in modules:
+            name_id = names.get(name)
+            if name_id is None:
+                if len(names) > 0xffff:
+                    raise ValueError("Too many module names")
+                name_id = names[name] = len(names)
+            ids.append(name_id)
+            for value in parameters:
+                value_type = type(value)
+                if value_type is float:
+                    kinds.append(FLOAT_KIND)
+                elif value_type is int:
+                    kinds.append(INT_KIND)
+                elif value_type is str:
+                    kinds.append(STRING_KIND)
+                    string_id = strings.get(value)
+                    if string_id is None:
+                        string_id = strings[value] = len(strings)
+                    value = string_id
+                else:
+                    raise ValueError("Can't store parameter value {!r}".format(value))
+                params.append(value)
+            num_parameters += len(parameters)
+            offsets.append(num_parameters)
+            if len(ids) == GenerationWriter.BLOCK_SIZE:
+                self.flush(ids, offsets, params, kinds)
+                ids, offsets, params, kinds = array.array("H"), array.array("Q"), array.array(self.float_type), array.array("B")
+        self.flush(ids, offsets, params, kinds)
+        self.num_parameters = num_parameters
+
+    def flush(self, ids, offsets, params, kinds):
+        ids.tofile(self.files["ids"])
+        offsets.tofile(self.files["offsets"])
+        params.tofile(self.files["params"])
+        kinds.tofile(self.files["kinds"])
+        self.length += len(ids)
+
+    def close(self, complete=True):
+        """Close the files and write names.json unless complete is False"""
+        for f in self.files.values():
+            f.close()
+        if not complete:
+            return
+        import json
+        with open(os.path.join(self.path, "names.json"), "w") as f:
+            json.dump({"names": list(self.names), "strings": list(self.strings), "length": self.length,
+                       "num_parameters": self.num_parameters, "float_type": self.float_type}, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(exc_type is None)
+
+
+class MappedGeneration:
+    """A generation written by GenerationWriter
+
+    The arrays are mapped with numpy.memmap, so only the parts that are used
+    are read into memory. Indexing and iterating give modules."""
+
+    def __init__(self, path):
+        import json
+        numpy = import_numpy("MappedGeneration")
+        with open(os.path.join(path, "names.json")) as f:
+            info = json.load(f)
+        self.names = info["names"]
+        self.strings = info["strings"]
+        self.length = info["length"]
+        float_dtype = numpy.float32 if info["float_type"] == "f" else numpy.float64
+        self.ids = self.map(path, "ids", numpy.uint16, self.length)
+        self.offsets = self.map(path, "offsets", numpy.uint64, self.length + 1)
+        self.params = self.map(path, "params", float_dtype, info["num_parameters"])
+        self.kinds = self.map(path, "kinds", numpy.uint8, info["num_parameters"])
+
+    @staticmethod
+    def map(path, name, dtype, size):
+        numpy = import_numpy("MappedGeneration")
+        if size == 0:
+            return numpy.zeros(0, dtype=dtype)  # can't map an empty file
+        return numpy.memmap(os.path.join(path, name), dtype=dtype, mode="r", shape=(size,))
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError("module index out of range")
+        return self.modules(i, i+1)[0]
+
+    def __iter__(self):
+        for start in range(0, self.length, GenerationWriter.BLOCK_SIZE):
+            for module in self.modules(start, min(start + GenerationWriter.BLOCK_SIZE, self.length)):
+                yield module
+
+    def modules(self, start, end):
+        """Return the list of modules from start to end"""
+        names = self.names
+        ids = self.ids[start:end].tolist()
+        offsets = self.offsets[start:end+1].tolist()
+        first = offsets[0]
+        params = self.params[first:offsets[-1]].tolist()
+        kinds = self.kinds[first:offsets[-1]].tolist()
+        if any(kinds):
+            strings = self.strings
+            for i, kind in enumerate(kinds):
+                if kind == INT_KIND:
+                    params[i] = int(params[i])
+                elif kind == STRING_KIND:
+                    params[i] = strings[int(params[i])]
+        result = []
+        for i, name_id in enumerate(ids):
+            begin = offsets[i] - first
+            end = offsets[i+1] - first
+            if begin == end:
+                result.append((names[name_id], ()))
+            else:
+                result.append((names[name_id], tuple(params[begin:end])))
+        return result
+
+
+def counted(modules, report, instance, iteration):
+    """Yield the modules and add their number and the time it took to derive
+    them to report at the end"""
+    n = 0
+    seconds = 0.0
+    modules = iter(modules)
+    while True:
+        start = time.perf_counter()
+        try:
+            module = next(modules)
+        except StopIteration:
+            break
+        finally:
+            seconds += time.perf_counter() - start
+        n += 1
+        yield module
+    report.add_generation(instance, iteration, n, seconds)
+
+
+class Report:
+    """Timings and counters of an execution, see Exec.exec
+
+    timings is phase -> seconds and calls is phase -> the number of times it
+    was timed, see timer. The time of a phase or a generation that is added
+    while a timer runs isn't part of the phase of the timer, so the timings
+    add up to the total time instead of counting nested phases twice, ie a
+    lazy generation isn't part of the interpret phase that uses it.
+    generations has the size and time of each derived generation and
+    rule_hits the number of times each rule was applied.
+    counters has other numbers, ie the vertices and faces of the meshes.
+
+    If callback isn't None it's called with (event, data) when a time
+    ("time") or a generation ("generation") is added, data is a dict."""
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.timings = collections.defaultdict(float)
+        self.calls = collections.defaultdict(int)
+        self.generations = []
+        self.rule_hits = collections.Counter()
+        self.counters = collections.Counter()
+        self.running = []  # the time of the phases nested in each running timer
+
+    def timer(self, phase):
+        """Return a context manager that adds the time it's used to phase"""
+        return ReportTimer(self, phase)
+
+    def add_time(self, phase, seconds):
+        self.timings[phase] += seconds
+        self.calls[phase] += 1
+        if self.running:
+            self.running[-1] += seconds
+        if self.callback is not None:
+            self.callback("time", {"phase": phase, "seconds": seconds})
+
+    def add_generation(self, instance, iteration, modules, seconds):
+        generation = {"instance": instance, "iteration": iteration, "modules": modules, "seconds": seconds}
+        self.generations.append(generation)
+        if self.running:
+            self.running[-1] += seconds
+        if self.callback is not None:
+            self.callback("generation", generation)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def as_dict(self):
+        return {"timings": dict(self.timings),
+                "calls": dict(self.calls),
+                "generations": list(self.generations),
+                "rule_hits": dict((str(rule), hits) for rule, hits in self.rule_hits.items()),
+                "counters": dict(self.counters)}
+
+    def __str__(self):
+        lines = []
+        for phase, seconds in sorted(self.timings.items(), key=lambda item: -item[1]):
+            lines.append("{}: {:.5f}s ({} calls)".format(phase, seconds, self.calls[phase]))
+        for generation in self.generations:
+            lines.append("instance {instance} iteration {iteration}: {modules} modules in {seconds:.5f}s".format(
+                **generation))
+        for rule, hits in self.rule_hits.most_common():
+            lines.append("{}: {} hits".format(rule, hits))
+        for name, n in sorted(self.counters.items()):
+            lines.append("{}: {}".format(name, n))
+        return "\n".join(lines)
+
+
+class ReportTimer:
+    __slots__ = ("report", "phase", "start")
+
+    def __init__(self, report, phase):
+        self.report = report
+        self.phase = phase
+
+    def __enter__(self):
+        self.report.running.append(0.0)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        report = self.report
+        nested = report.running.pop()
+        report.add_time(self.phase, seconds - nested)
+        if report.running:
+            report.running[-1] += nested  # add_time added the rest
+
+
+class NullReport:
+    """A Report that doesn't record anything, so code can always report"""
+    callback = None
+    rule_hits = None
+
+    def timer(self, phase):
+        return NULL_TIMER
+
+    def add_time(self, phase, seconds):
+        pass
+
+    def add_generation(self, instance, iteration, modules, seconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NULL_REPORT = NullReport()
+NULL_TIMER = NullTimer()
+
+
+class PackedModules:
+    """A compact form of a list of modules for sending between processes
+
+    Each name is stored once and referred to by its index. Parameter values
+    that are floats are stored in an array, other values such as ints and
+    strings are kept as they are so unpack gives back exactly the same modules."""
+
+    def __init__(self, modules):
+        names = {}
+        ids = []
+        arities = []
+        values = array.array("d")
+        others = []
+        for name, parameters in modules:
+            name_id = names.get(name)
+            if name_id is None:
+                name_id = names[name] = len(names)
+            ids.append(name_id)
+            arities.append(len(parameters))
+            for value in parameters:
+                if type(value) is not float:
+                    others.append((len(values), value))
+                    value = 0.0
+                values.append(value)
+        self.names = list(names)
+        self.ids = array.array("H" if len(names) <= 0xffff else "L", ids)
+        self.arities = array.array("H", arities)
+        self.values = values
+        self.others = others
+
+    def __len__(self):
+        return len(self.ids)
+
+    def unpack(self):
+        names = self.names
+        values = self.values.tolist()
+        for index, value in self.others:
+            values[index] = value
+        modules = []
+        start = 0
+        for name_id, arity in zip(self.ids, self.arities):
+            if arity == 0:
+                modules.append((names[name_id], ()))
+            else:
+                end = start + arity
+                modules.append((names[name_id], tuple(values[start:end])))
+                start = end
+        return modules
+
+
+def derive_instance(lsys, instance, seed, min_iterations, max_iterations, report=None):
+    """Yield (iterations, modules) for min_iterations to max_iterations of an
+    instance with random.Random(seed), see LSystem.derive_range
+
+    The modules are iterators, the last generation is derived as it's used."""
+    return lsys.derive_range(instance, min_iterations, max_iterations, random.Random(seed), True, report)
+
+
+_worker_lsystem = None
+
+
+def _init_worker(lsys):
+    global _worker_lsystem
+    # a worker can't start processes of its own, one process for the chunks
+    # gives the same result
+    if lsys.chunk_workers is not None:
+        lsys.chunk_workers = 1
+    _worker_lsystem = lsys
+
+
+def _rewrite_chunk(modules, start, instance, iteration, seed):
+    env = Environment(instance, iteration, CounterRandom(seed, instance, iteration))
+    return _worker_lsystem.exec_chunk(modules, 0, len(modules), env, start)
+
+
+def _derive_packed(instance, seed, min_iterations, max_iterations):
+    return [(iterations, PackedModules(modules)) for iterations, modules
+            in derive_instance(_worker_lsystem, instance, seed, min_iterations, max_iterations)]
+
+
+def derive_instances(lsys, seeds, min_iterations, max_iterations, workers=None, report=None):
+    """Yield the result of derive_instance for each instance, seeds has the seed
+    of each instance
+
+    With more than one worker the instances are derived by a pool of that many
+    processes and the results are the same as when they're derived one by one.
+    report only gets the generations that are derived in this process."""
+    if workers is None or workers <= 1 or len(seeds) <= 1:
+        for instance, seed in enumerate(seeds):
+            yield derive_instance(lsys, instance, seed, min_iterations, max_iterations, report)
+        return
+
+    num_instances = len(seeds)
+    chunksize = max(1, num_instances // (workers * 4))
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(lsys,)) as pool:
+        results = pool.map(_derive_packed, range(0, num_instances), seeds,
+                           [min_iterations] * num_instances, [max_iterations] * num_instances,
+                           chunksize=chunksize)
+        for packed in results:
+            yield [(iterations, modules.unpack()) for iterations, modules in packed]
@@ -2,25 +2,99 @@ import bpy
 import bmesh
 import mathutils
 import math
+import logging
+import itertools
+import numpy
 from . import util
+from .util import matmul
 
+logger = logging.getLogger(__name__)
 
-def create_mesh(vertices, edges, faces):
-    try:
-        mesh = bpy.data.meshes.new('lsystem-tmp')
-        # print("create_mesh\n  vertices {}\n  edges {}\n  faces {}".format(vertices, edges, faces))
-        mesh.from_pydata(vertices, edges, faces)
-        mesh.validate()
-        mesh.update()
-        return mesh
-    except Exception as ex:
-        print("vertices")
-        print(vertices)
-        print("edges")
-        print(edges)
-        print("faces")
-        print(faces)
-        raise ex
+
+def flatten(sequences, dtype):
+    return numpy.fromiter(itertools.chain.from_iterable(sequences), dtype=dtype)
+
+
+class Geometry:
+    """Vertices, edges and faces as numpy arrays. The pens return their parts
+    as a Geometry and the object writes all the parts into its mesh at once.
+
+    datablocks is the number of temporary meshes, curves and objects the pens
+    needed to make the parts, they are removed as soon as they are read"""
+    def __init__(self):
+        self.parts = []
+        self.datablocks = 0
+
+    def add(self, vertices, loops=(), face_sizes=(), edges=(), materials=0, smooth=False, radii=0.0):
+        """Add vertices with the faces and edges between them, the indices
+        start at 0 for the first of the vertices. The loops are either one
+        sequence per face or flat with the size of each face in face_sizes"""
+        if not isinstance(vertices, numpy.ndarray):
+            vertices = flatten(vertices, numpy.float32)  # much faster than numpy.array for Vectors
+        if not isinstance(edges, numpy.ndarray):
+            edges = flatten(edges, numpy.int32)
+        if not isinstance(loops, numpy.ndarray) and len(loops) and hasattr(loops[0], "__len__"):
+            face_sizes = [len(face) for face in loops]
+            loops = flatten(loops, numpy.int32)
+        vertices = numpy.asarray(vertices, dtype=numpy.float32).reshape(-1, 3)
+        loops = numpy.asarray(loops, dtype=numpy.int32)
+        if loops.ndim == 2:
+            face_sizes = numpy.full(len(loops), loops.shape[1], dtype=numpy.int32)
+        face_sizes = numpy.asarray(face_sizes, dtype=numpy.int32)
+        self.parts.append((vertices,
+                           loops.ravel(),
+                           face_sizes,
+                           numpy.asarray(edges, dtype=numpy.int32).reshape(-1, 2),
+                           numpy.broadcast_to(numpy.int32(materials), face_sizes.shape),
+                           numpy.broadcast_to(numpy.bool_(smooth), face_sizes.shape),
+                           numpy.broadcast_to(numpy.float32(radii), vertices.shape[:1])))
+
+    def add_mesh(self, mesh):
+        """Add the vertices, edges and faces of a mesh"""
+        vertices, edges, loops, loop_starts, materials, smooth = util.get_mesh_arrays(mesh)
+        face_sizes = numpy.diff(numpy.append(loop_starts, len(loops)))
+        self.add(vertices, loops, face_sizes, edges, materials, smooth)
+
+    def extend(self, geometry):
+        self.parts.extend(geometry.parts)
+        self.datablocks += geometry.datablocks
+
+    def add_bmesh(self, bm):
+        mesh = bpy.data.meshes.new("lsystem.bmesh")
+        bm.to_mesh(mesh)
+        self.add_mesh(mesh)
+        bpy.data.meshes.remove(mesh)
+        self.datablocks += 1
+
+    def nbytes(self):
+        return sum(array.nbytes for part in self.parts for array in part)
+
+    def arrays(self):
+        """Return the vertices, loops, face sizes, edges, materials, smooth
+        flags and radii of all the parts, the indices are offset by the
+        vertices of the parts before"""
+        if not self.parts:
+            self.add(())
+        counts = [len(part[0]) for part in self.parts]
+        offsets = numpy.cumsum(counts) - counts
+        parts = list(zip(*self.parts))
+        parts[1] = [loops + offset for loops, offset in zip(parts[1], offsets)]
+        parts[3] = [edges + offset for edges, offset in zip(parts[3], offsets)]
+        self.parts = [tuple(numpy.concatenate(arrays) for arrays in parts)]
+        return self.parts[0]
+
+    def write(self, mesh, validate=False):
+        """Write the geometry into an empty mesh"""
+        vertices, loops, face_sizes, edges, materials, smooth, radii = self.arrays()
+        mesh.vertices.add(len(vertices))
+        mesh.edges.add(len(edges))
+        mesh.loops.add(len(loops))
+        mesh.polygons.add(len(face_sizes))
+        loop_starts = numpy.cumsum(face_sizes, dtype=numpy.int32) - face_sizes
+        util.set_mesh_arrays(mesh, vertices.ravel(), edges.ravel(), loops, loop_starts, materials, smooth)
+        mesh.update(calc_edges=True)
+        if validate:
+            mesh.validate()
 
 
 class Pen():
@@ -50,7 +124,7 @@ class Pen():
         pass
 
     def end(self):
-        """Return a mesh"""
+        """Return a Geometry"""
         return None
 
     def start_branch(self):
@@ -83,7 +157,7 @@ class SurfacePen(Pen):
         if not self.faces:
             self.start_face()
 
-        v = util.matmul(trans_mat, mathutils.Vector((0, 0, 0)))
+        v = matmul(trans_mat, mathutils.Vector((0, 0, 0)))
         # print("vertex {}".format(v))
         self.vertices.append(v)
         face = self.faces[self.stack[-1]]
@@ -91,10 +165,13 @@ class SurfacePen(Pen):
 
     def end(self):
         self.end_face()
-        if not self.faces:
+        faces = [face for face in self.faces if len(face) >= 3]
+        if not faces:
             # print("Invalid surface, no faces")
             return None
-        return create_mesh(self.vertices, [], self.faces)
+        geometry = Geometry()
+        geometry.add(self.vertices, faces)
+        return geometry
 
     def start_face(self):
         self.faces.append([])
@@ -112,23 +189,25 @@ class PolPen(Pen):
         self.vertices = []
 
     def start(self, trans_mat):
-        v = util.matmul(trans_mat, mathutils.Vector((0, 0, 0)))
+        v = matmul(trans_mat, mathutils.Vector((0, 0, 0)))
         self.vertices.append(v)
 
     def move_and_draw(self, trans_mat):
-        v = util.matmul(trans_mat, mathutils.Vector((0, 0, 0)))
+        v = matmul(trans_mat, mathutils.Vector((0, 0, 0)))
         self.vertices.append(v)
 
     def end(self):
         # todo: end needs to check if it ends the whole thing or just a branch
         if len(self.vertices) < 3:
-            print("Invalid polygon, number of vertices = "+str(len(self.vertices)))
+            logger.warning("Invalid polygon, number of vertices = %d", len(self.vertices))
             return None
 
-        return create_mesh(self.vertices, [], [range(0, len(self.vertices))])
+        geometry = Geometry()
+        geometry.add(self.vertices, [range(0, len(self.vertices))])
+        return geometry
 
     def start_branch(self):
-        print("Branches not supported for PolPen")
+        logger.warning("Branches not supported for PolPen")
 
     def end_branch(self):
         return self.end()
@@ -169,7 +248,8 @@ class EdgePen(Pen):
             self.last_index, self.radius = self.stack.pop()
             return None
 
-        if len(self.vertices) > len(self.edges)+1:
+        # drop the last vertex if it was only moved to, no edge ends there
+        if self.vertices and not (self.edges and self.edges[-1][1] == len(self.vertices)-1):
             del self.vertices[-1]
             del self.radii[-1]
 
@@ -182,10 +262,13 @@ class EdgePen(Pen):
         # print(self.radii)
         # print("edges")
         # print(self.edges)
-        mesh = create_mesh(self.vertices, self.edges, [])
+        geometry = Geometry()
+        geometry.add(self.vertices, edges=self.edges, radii=self.radii)
         if not self.skin and self.subdiv <= 0:
-            return mesh
+            return geometry
 
+        mesh = bpy.data.meshes.new('lsystem-tmp')
+        geometry.write(mesh)
         obj_new = bpy.data.objects.new(mesh.name, mesh)
 
         if self.skin:
@@ -194,9 +277,8 @@ class EdgePen(Pen):
             # print(obj_new.data.skin_vertices[0].data)
             # for i,v in enumerate(obj_new.data.skin_vertices[0].data):
             #     print(str(i)+" "+str(v.radius[0])+", "+str(v.radius[1]))
-            for i, r in enumerate(self.radii):
-                v = obj_new.data.skin_vertices[0].data[i]
-                v.radius = r,r
+            radii = geometry.arrays()[6]
+            obj_new.data.skin_vertices[0].data.foreach_set("radius", numpy.repeat(radii, 2))
             # for i,v in enumerate(obj_new.data.skin_vertices[0].data):
             #     print(str(i)+" "+str(v.radius[0])+", "+str(v.radius[1]))
 
@@ -209,8 +291,12 @@ class EdgePen(Pen):
             subdiv_mod.levels = self.subdiv
             subdiv_mod.render_levels = self.subdiv
 
-        new_mesh = util.to_mesh(obj_new)
-        return new_mesh
+        skinned = Geometry()
+        with util.evaluated_mesh(obj_new) as new_mesh:
+            skinned.add_mesh(new_mesh)
+        util.remove_object(obj_new)
+        skinned.datablocks += 2
+        return skinned
 
     def start_branch(self):
         self.stack.append((self.last_index, self.radius))
@@ -219,7 +305,7 @@ class EdgePen(Pen):
         return self.end()
 
     def create_vertices(self, trans_mat):
-        return util.matmul(trans_mat, mathutils.Vector((0, 0, 0)))
+        return matmul(trans_mat, mathutils.Vector((0, 0, 0)))
 
 
 class VertexPen(Pen):
@@ -259,9 +345,7 @@ class VertexPen(Pen):
 
     def end(self):
         if not self.stack:
-            if not self.faces:
-                return create_mesh([], [],[])
-            return create_mesh(self.vertices, [], self.faces)
+            return self.geometry()
 
         self.last_indices, self.radius = self.stack.pop()
         return None
@@ -270,18 +354,20 @@ class VertexPen(Pen):
         self.stack.append((self.last_indices, self.radius))
 
     def end_branch(self):
-        if not self.stack:
-            if not self.faces:
-                return create_mesh([], [],[])
-            return create_mesh(self.vertices, [], self.faces)
-        self.last_indices, self.radius = self.stack.pop()
-        return None
+        return self.end()
+
+    def geometry(self):
+        if not self.faces:
+            return None
+        geometry = Geometry()
+        geometry.add(self.vertices, self.faces)
+        return geometry
 
     def create_vertices(self, trans_mat):
-        return util.matmul(trans_mat, mathutils.Vector((0, 0, 0)))
+        return matmul(trans_mat, mathutils.Vector((0, 0, 0)))
 
     def connect(self, quads, last_indices, new_indices):
-        print("'connect' not implemented")
+        logger.warning("'connect' not implemented")
 
 
 class LinePen(VertexPen):
@@ -289,32 +375,107 @@ class LinePen(VertexPen):
         VertexPen.__init__(self)
 
     def create_vertices(self, trans_matrix):
-        return [util.matmul(trans_matrix, mathutils.Vector((self.radius, 0, 0))),
-                util.matmul(trans_matrix * mathutils.Vector((-self.radius, 0, 0)))]
+        return [matmul(trans_matrix, mathutils.Vector((self.radius, 0, 0))),
+                matmul(trans_matrix, mathutils.Vector((-self.radius, 0, 0)))]
 
     def connect(self, quads, last_indices, new_indices):
         quads.append([last_indices[0], last_indices[1], new_indices[1], new_indices[0]])
 
 
-class CylPen(VertexPen):
+# the unit circles and quad corners of the ring pens by number of vertices
+RINGS = {}
+
+
+def unit_ring(num_vertices):
+    """Return the x and y of num_vertices points on the unit circle and the
+    (num_vertices, 4) corners of the quads between two rings, vertices i and
+    i - 1 of the last ring (0 and 1) and of the new ring (2 and 3)"""
+    try:
+        return RINGS[num_vertices]
+    except KeyError:
+        angles = numpy.arange(num_vertices) * (2*math.pi/num_vertices)
+        xy = numpy.stack([numpy.cos(angles), numpy.sin(angles)], axis=1).astype(numpy.float32)
+        i = numpy.arange(num_vertices)
+        corners = numpy.stack([i, i - 1, i - 1, i], axis=1) % num_vertices
+        ring = RINGS[num_vertices] = (xy, corners.astype(numpy.int32))
+        return ring
+
+
+class RingPen(Pen):
+    """Draws a ring of num_vertices around the turtle and connects it to the
+    last ring with quads. Only the transforms and radii of the rings are kept
+    while drawing, geometry() computes all the vertices at once"""
     def __init__(self, num_vertices):
-        VertexPen.__init__(self)
+        Pen.__init__(self)
         self.num_vertices = num_vertices
+        self.reset()
 
-    def create_vertices(self, trans_mat):
-        v = []
-        angle = 0.0
-        inc = 2*math.pi/self.num_vertices
-        for i in range(0, self.num_vertices):
-            vertex = mathutils.Vector((self.radius * math.cos(angle), self.radius * math.sin(angle), 0))
-            vertex = util.matmul(trans_mat, vertex)
-            v.append(vertex)
-            angle += inc
-        return v
+    def reset(self):
+        self.transforms = []
+        self.radii = []
+        self.connections = []  # (last ring, new ring) for each quad strip
+        self.materials = []
+        self.last_ring = None
+        self.stack = []
 
-    def connect(self, quads, last_indices, new_indices):
-        for i in range(0, self.num_vertices):
-            quads.append([last_indices[i], last_indices[i - 1], new_indices[i - 1], new_indices[i]])
+    def start(self, trans_mat):
+        self.reset()
+        self.last_ring = self.add_ring(trans_mat)
+
+    def move_and_draw(self, trans_mat):
+        new_ring = self.add_ring(trans_mat)
+        self.connections.append((self.last_ring, new_ring))
+        self.materials.append(self.material)
+        self.last_ring = new_ring
+
+    def move(self, trans_mat):
+        self.last_ring = self.add_ring(trans_mat)
+
+    def add_ring(self, trans_mat):
+        self.transforms.append(trans_mat.copy())
+        self.radii.append(self.radius)
+        return len(self.radii) - 1
+
+    def end(self):
+        if not self.stack:
+            return self.geometry()
+
+        self.last_ring, self.radius, self.material = self.stack.pop()
+        return None
+
+    def start_branch(self):
+        self.stack.append((self.last_ring, self.radius, self.material))
+
+    def end_branch(self):
+        return self.end()
+
+    def geometry(self, materials=0):
+        if not self.radii:
+            return None
+        xy, corners = unit_ring(self.num_vertices)
+        transforms = util.matrices_array(self.transforms)
+        # the rings lie in the xy planes of the transforms, one batched multiply
+        # puts the unit circle in all of them
+        vertices = numpy.matmul(xy, transforms[:, :3, :2].transpose(0, 2, 1))
+        vertices *= numpy.array(self.radii, dtype=numpy.float32)[:, None, None]
+        vertices += transforms[:, None, :3, 3]
+
+        rings = numpy.array(self.connections, dtype=numpy.int32).reshape(-1, 2)
+        starts = rings[:, [0, 0, 1, 1]] * self.num_vertices
+        loops = starts[:, None, :] + corners
+        geometry = Geometry()
+        geometry.add(vertices, loops.reshape(-1, 4), materials=materials)
+        return geometry
+
+
+class CylPen(RingPen):
+    def __init__(self, num_vertices):
+        RingPen.__init__(self, num_vertices)
+
+    def geometry(self, materials=0):
+        if not self.connections:
+            return None
+        return RingPen.geometry(self)
 
 
 class BMeshPen(Pen):
@@ -349,13 +510,13 @@ class BMeshPen(Pen):
         self.last_vertices = self.create_vertices(trans_mat)
 
     def end(self):
-        """Return a mesh"""
+        """Return a Geometry"""
         if not self.stack:
             if self.bmesh is None:  # end() can be called before start()
                 return None
-            mesh = bpy.data.meshes.new("lsystem.bmesh")
-            self.bmesh.to_mesh(mesh)
-            return mesh
+            geometry = Geometry()
+            geometry.add_bmesh(self.bmesh)
+            return geometry
 
         self.last_vertices, self.radius, self.material = self.stack.pop()
         return None
@@ -378,36 +539,21 @@ class BLinePen(BMeshPen):
         BMeshPen.__init__(self)
 
     def create_vertices(self, trans_mat):
-        v1 = self.bmesh.verts.new(util.matmul(trans_mat, mathutils.Vector((self.radius, 0, 0))))
-        v2 = self.bmesh.verts.new(util.matmul(trans_mat, mathutils.Vector((-self.radius, 0, 0))))
+        v1 = self.bmesh.verts.new(matmul(trans_mat, mathutils.Vector((self.radius, 0, 0))))
+        v2 = self.bmesh.verts.new(matmul(trans_mat, mathutils.Vector((-self.radius, 0, 0))))
         return [v1, v2]
 
     def connect(self, last_vertices, new_vertices):
         return [self.bmesh.faces.new((last_vertices[0], last_vertices[1], new_vertices[1], new_vertices[0]))]
 
 
-class BCylPen(BMeshPen):
+class BCylPen(RingPen):
     def __init__(self, num_vertices):
-        BMeshPen.__init__(self)
-        self.num_vertices = num_vertices
+        RingPen.__init__(self, num_vertices)
 
-    def create_vertices(self, trans_mat):
-        v = []
-        angle = 0.0
-        inc = 2*math.pi/self.num_vertices
-        for i in range(0, self.num_vertices):
-            vertex = mathutils.Vector((self.radius * math.cos(angle), self.radius * math.sin(angle), 0))
-            vertex = util.matmul(trans_mat, vertex)
-            v.append(self.bmesh.verts.new(vertex))
-            angle += inc
-        return v
-
-    def connect(self, last_vertices, new_vertices):
-        faces = []
-        for i in range(0, self.num_vertices):
-            face = self.bmesh.faces.new((last_vertices[i], last_vertices[i - 1], new_vertices[i - 1], new_vertices[i]))
-            faces.append(face)
-        return faces
+    def geometry(self, materials=0):
+        materials = [0 if material is None else material for material in self.materials]
+        return RingPen.geometry(self, numpy.repeat(materials, self.num_vertices))
 
 
 class CurvePen(Pen):
@@ -418,11 +564,11 @@ class CurvePen(Pen):
         self.stack = []
 
     def start(self, trans_mat):
-        self.vertices.append(util.matmul(trans_mat, mathutils.Vector((0, 0, 0))))
+        self.vertices.append(matmul(trans_mat, mathutils.Vector((0, 0, 0))))
         self.radii.append(self.radius)
 
     def move_and_draw(self, trans_mat):
-        self.vertices.append(util.matmul(trans_mat, mathutils.Vector((0, 0, 0))))
+        self.vertices.append(matmul(trans_mat, mathutils.Vector((0, 0, 0))))
         self.radii.append(self.radius)
 
     def move(self, trans_mat):
@@ -430,13 +576,13 @@ class CurvePen(Pen):
         pass
 
     def end(self):
-        # create curve object, convert to mesh, return mesh
-        mesh = None
+        # create curve object, convert to mesh, return its geometry
+        geometry = None
         if len(self.vertices) > 1:
-            mesh = self.new_curve()
+            geometry = self.new_curve()
         if self.stack:
             self.vertices, self.radii, self.radius = self.stack.pop()
-        return mesh
+        return geometry
 
     def start_branch(self):
         last_vertex = self.vertices[-1]
@@ -566,12 +712,13 @@ class CurvePen(Pen):
 
         # create Object
         curve_ob = bpy.data.objects.new('lsystem-tmp', curveData)
-        mesh = util.to_mesh(curve_ob)
-        # bevel_object.user_clear()
-        # bpy.data.objects.remove(bevel_object, do_unlink=True)
-        # taper_object.user_clear()
-        bpy.data.objects.remove(taper_object, do_unlink=True)
-        return mesh
+        geometry = Geometry()
+        with util.evaluated_mesh(curve_ob) as mesh:
+            geometry.add_mesh(mesh)
+        util.remove_object(curve_ob)
+        util.remove_object(taper_object)
+        geometry.datablocks += 4
+        return geometry
 
 
 class BmeshSpinPen(Pen):
@@ -622,13 +769,10 @@ class BmeshSpinPen(Pen):
         pass
 
     def end(self):
-        """Return a mesh"""
-        mesh = bpy.data.meshes.new("lsystem.bmesh")
-        for material in self.materials:
-            mat = bpy.data.materials.get(self.material)
-            mesh.materials.append(mat)
-        self.bm.to_mesh(mesh)
-        return mesh
+        """Return a Geometry"""
+        geometry = Geometry()
+        geometry.add_bmesh(self.bm)
+        return geometry
 
     def start_branch(self):
         pass
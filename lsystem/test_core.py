@@ -0,0 +1,198 @@
+# The tests of core.py, they run without Blender, see test_lsystem.py
+import copy
+import unittest
+from math import radians
+from math import pi
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import lsystem
+from .core import (Turtle, column, compile_blocks, compile_program, dot,
+                   matmul, rotation, scale, OP_CALL, OP_DRAW,
+                   OP_POP, OP_PUSH, OP_ROTATE_Y, OP_SCALE_RADIUS)
+
+
+def run_turtle(modules, angle=90.0):
+    turtle = Turtle(0)
+    turtle.set_angle(radians(angle))
+    return turtle.interpret(modules)
+
+
+def round_segments(segments):
+    return [(tuple(round(x, 6) + 0.0 for x in start), tuple(round(x, 6) + 0.0 for x in end), round(radius, 6))
+            for start, end, radius in segments]
+
+
+class TestTurtle(unittest.TestCase):
+
+    def test_forward(self):
+        skeleton = run_turtle("FfF(2)")[0][0]
+        self.assertEqual([((0.0, 0.0, 0.0), (0.0, 0.0, 1.0), 0.1), ((0.0, 0.0, 2.0), (0.0, 0.0, 4.0), 0.1)],
+                         round_segments(skeleton.segments))
+
+    def test_rotate(self):
+        segments = run_turtle("F+F-^F")[0][0].segments
+        self.assertEqual([((0.0, 0.0, 0.0), (0.0, 0.0, 1.0), 0.1),
+                          ((0.0, 0.0, 1.0), (1.0, 0.0, 1.0), 0.1),
+                          ((1.0, 0.0, 1.0), (1.0, -1.0, 1.0), 0.1)],
+                         round_segments(segments))
+
+    def test_branch(self):
+        segments = run_turtle("F[+F!F]F")[0][0].segments
+        self.assertEqual([((0.0, 0.0, 0.0), (0.0, 0.0, 1.0), 0.1),
+                          ((0.0, 0.0, 1.0), (1.0, 0.0, 1.0), 0.1),
+                          ((1.0, 0.0, 1.0), (2.0, 0.0, 1.0), 0.08),
+                          ((0.0, 0.0, 1.0), (0.0, 0.0, 2.0), 0.1)],
+                         round_segments(segments))
+
+    def test_objects(self):
+        obj_base_pairs = run_turtle("F[:+F;]F")
+        self.assertEqual(2, len(obj_base_pairs))
+        main, child = obj_base_pairs[0][0], obj_base_pairs[1][0]
+        self.assertIs(main, child.parent)
+        self.assertEqual([((0.0, 0.0, 1.0), (1.0, 0.0, 1.0), 0.1)], round_segments(child.segments))
+        self.assertEqual(2, len(main.segments))
+        self.assertEqual((0.0, 0.0, 2.0), round_segments(main.segments)[1][1])
+
+    def test_rotate_upright(self):
+        turtle = Turtle(0)
+        turtle.interpret("&(30)/(40)$")
+        left = column(turtle.transform, 0)
+        self.assertAlmostEqual(0.0, left[2])
+        self.assertAlmostEqual(1.0, dot(left, left))
+
+    def test_transform(self):
+        turtle = Turtle(0)
+        turtle.interpret("+(30)F(2)s(0.5)&(45)/F")
+        transform = turtle.transform
+        self.assertEqual((0.0, 0.0, 0.0, 1.0), transform[3])
+        x, y, z = turtle.frame
+        self.assertAlmostEqual(0.25, dot(z, z))
+        self.assertAlmostEqual(0.0, dot(x, z))
+        expected = matmul(matmul(matmul(matmul(matmul(rotation(radians(30), (0.0, 1.0, 0.0)),
+                                                      ((1.0, 0.0, 0.0, 0.0), (0.0, 1.0, 0.0, 0.0),
+                                                       (0.0, 0.0, 1.0, 2.0), (0.0, 0.0, 0.0, 1.0))),
+                                               ((0.5, 0.0, 0.0, 0.0), (0.0, 0.5, 0.0, 0.0),
+                                                (0.0, 0.0, 0.5, 0.0), (0.0, 0.0, 0.0, 1.0))),
+                                        rotation(radians(-45), (1.0, 0.0, 0.0))),
+                                 rotation(turtle.angle, (0.0, 0.0, 1.0))),
+                          ((1.0, 0.0, 0.0, 0.0), (0.0, 1.0, 0.0, 0.0), (0.0, 0.0, 1.0, 1.0), (0.0, 0.0, 0.0, 1.0)))
+        for row, expected_row in zip(transform, expected):
+            for a, b in zip(row, expected_row):
+                self.assertAlmostEqual(b, a)
+
+        turtle.transform = expected
+        self.assertEqual(expected, turtle.transform)
+
+    def test_set_direction(self):
+        turtle = Turtle(0)
+        turtle.set_direction((1.0, 0.0, 0.0))
+        segments = round_segments(turtle.interpret("F")[0][0].segments)
+        self.assertEqual([((0.0, 0.0, 0.0), (1.0, 0.0, 0.0), 0.1)], segments)
+
+    def test_tropism(self):
+        turtle = Turtle(0)
+        turtle.set_angle(radians(90))
+        turtle.set_tropism((0.0, 0.0, -1.0), 0.5)
+        segments = turtle.interpret("+FFFF")[0][0].segments
+        # the branch bends down a bit more for each segment
+        heights = [end[2] - start[2] for start, end, radius in segments]
+        self.assertAlmostEqual(0.0, heights[0])
+        for a, b in zip(heights, heights[1:]):
+            self.assertLess(b, a)
+
+    def test_derived_modules(self):
+        axiom = lsystem.ProductionRule("", "X")
+        rules = [lsystem.ProductionRule("X", "F[+X]F[-X]+X"), lsystem.ProductionRule("F", "FF")]
+        lsys = lsystem.LSystem(axiom, rules, None)
+        modules = lsys.derive(0, 4)
+        expected = run_turtle(lsystem.modules_to_string(modules), 25.0)[0][0].segments
+        self.assertEqual(sum(1 for name, parameters in modules if name == "F"), len(expected))
+        self.assertEqual(round_segments(expected), round_segments(run_turtle(modules, 25.0)[0][0].segments))
+
+    def test_compile_program(self):
+        turtle = Turtle(0)
+        turtle.set_angle(radians(90))
+        program = compile_program(turtle, "F+X+F[-A]+(30)Ab-(10)!Fs(2)")
+        self.assertEqual([OP_DRAW, OP_ROTATE_Y, OP_DRAW, OP_PUSH, OP_ROTATE_Y, OP_POP, OP_ROTATE_Y, OP_SCALE_RADIUS,
+                          OP_DRAW, OP_CALL], list(program.ops))
+        self.assertAlmostEqual(pi, program.args[1])
+        self.assertAlmostEqual(radians(20), program.args[6])
+        self.assertAlmostEqual(turtle.slinkage, program.args[7])
+        self.assertEqual([(scale, ("2",))], program.calls)
+
+    def test_compile_blocks(self):
+        turtle = Turtle(0)
+        modules = "F+X+F[-A]+(30)Ab-(10)!Fs(2)F£F+F+F$Fs(3)F+"
+        program = compile_program(turtle, modules)
+        for size in (1, 2, 3, 5):
+            blocks = list(compile_blocks(turtle, modules, size))
+            # a block may also have the rotation kept from the block before
+            self.assertTrue(all(0 < len(block) <= size + 1 for block in blocks))
+            self.assertLess(1, len(blocks))
+            self.assertEqual(list(program.ops), [op for block in blocks for op in block.ops])
+            self.assertEqual([arg for op, arg in zip(program.ops, program.args) if op != OP_CALL],
+                             [arg for block in blocks for op, arg in zip(block.ops, block.args) if op != OP_CALL])
+            self.assertEqual([call for op, arg in zip(program.ops, program.args) if op == OP_CALL
+                              for call in [program.calls[int(arg)]]],
+                             [block.calls[int(arg)] for block in blocks
+                              for op, arg in zip(block.ops, block.args) if op == OP_CALL])
+
+    def test_custom_interpretation(self):
+        def longer(turtle, parameters, bl_obj, obj_base_pairs, context):
+            transforms.append(turtle.transform)
+            turtle.set_length(2.0)
+
+        transforms = []
+        turtle = Turtle(0)
+        turtle.set_angle(radians(90))
+        turtle.set_interpretation("X", longer)
+        segments = round_segments(turtle.interpret("F+XF(1)F")[0][0].segments)
+        self.assertEqual([((0.0, 0.0, 0.0), (0.0, 0.0, 1.0), 0.1), ((0.0, 0.0, 1.0), (1.0, 0.0, 1.0), 0.1),
+                          ((1.0, 0.0, 1.0), (3.0, 0.0, 1.0), 0.1)], segments)
+        self.assertEqual(1, len(transforms))
+        self.assertAlmostEqual(1.0, transforms[0][2][3])
+
+    def assert_same_segments(self, turtle, modules):
+        arrays = copy.deepcopy(turtle).interpret_arrays(modules)
+        objects = turtle.interpret(modules)
+        segments = [segment for obj, base in objects for segment in obj.segments]
+        transforms = [transform for obj, base in objects for transform in obj.transforms]
+        self.assertEqual(round_segments(segments), round_segments(arrays.to_list()))
+        self.assertEqual([i for i, (obj, base) in enumerate(objects) for segment in obj.segments],
+                         arrays.objects.tolist())
+        for frame, transform in zip(arrays.frames.tolist(), transforms):
+            for row, expected_row in zip(frame, transform):
+                for a, b in zip(row, expected_row):
+                    self.assertAlmostEqual(b, a)
+
+    @unittest.skipIf(numpy is None, "requires numpy")
+    def test_interpret_arrays(self):
+        turtle = Turtle(3)
+        turtle.set_angle(radians(25))
+        self.assert_same_segments(turtle, "F+F-F[&F!F]/(30)F#(2)F[s(0.5)F+(10)+(20)F]ff(2)F£F+F¤(0.3)F[p(cyl5)F]F")
+        # merged rotations next to branches
+        self.assert_same_segments(Turtle(0), "F+[+F]F+[-F]++F")
+        turtle = Turtle(0)
+        turtle.set_direction((1.0, 1.0, 0.3))
+        self.assert_same_segments(turtle, "F+F&F")
+        # objects, one that isn't ended and ends without a start
+        self.assert_same_segments(Turtle(0), "F:F[+F:#F;F]F;F[:+F]F;F]F;F:F")
+        # interpreted one module at a time
+        self.assert_same_segments(Turtle(0), "F$F[:+F;]F")
+        turtle = Turtle(0)
+        turtle.set_tropism((0.0, 0.0, -1.0), 0.5)
+        self.assert_same_segments(turtle, "+FF[-F]F")
+
+        axiom = lsystem.ProductionRule("", "X")
+        rules = [lsystem.ProductionRule("X", "F[+X]F[-X]+X"), lsystem.ProductionRule("F", "FF")]
+        modules = list(lsystem.LSystem(axiom, rules, None).derive(0, 4))
+        self.assert_same_segments(Turtle(0), modules)
+        self.assertEqual(0, len(Turtle(0).interpret_arrays("+f")))
+
+
+if __name__ == "__main__":
+    unittest.main()
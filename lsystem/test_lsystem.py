@@ -0,0 +1,531 @@
+# The tests of lsystem.py, they run without Blender:
+# python -m unittest lsystem.test_lsystem lsystem.test_core
+import os
+import random
+import threading
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .lsystem import (GenerationWriter, GrowthLimitError, LSystem, MappedGeneration, PackedModules,
+                      Preview, ProductionRule, Report, counted, derive_instances,
+                      logger, modules_to_string)
+
+
+def run_test(axiom, rules, iterations, batch=False, memoize=True):
+    axiomRule = ProductionRule("", axiom)
+    lsystem = LSystem(axiomRule, rules, None)
+    lsystem.batch = batch
+    lsystem.memoize = memoize
+    return lsystem.iterate(0, iterations)
+
+class TestLSystem(unittest.TestCase):
+
+    def test_algae(self):
+        rule1 = ProductionRule("A", "AB")
+        rule2 = ProductionRule("B", "A")
+        result = run_test("A", [rule1, rule2], 5)
+        expected = "ABAABABAABAAB"
+        self.assertEqual(expected, result)
+
+    def test_para(self):
+        axiom = "X"
+        rule1 = ProductionRule("X", "F+(45)X")
+        rule2 = ProductionRule("+(45)", "-(30)")
+        result = run_test(axiom, [rule1, rule2], 1)
+        expected = "F+(45.0)X"
+        self.assertEqual(expected, result)
+        result = run_test(axiom, [rule1, rule2], 2)
+        expected = "F-(30.0)F+(45.0)X"
+        self.assertEqual(expected, result)
+        result = run_test(axiom, [rule1, rule2], 3)
+        expected = "F-(30.0)F-(30.0)F+(45.0)X"
+        self.assertEqual(expected, result)
+
+    def test_rand(self):
+        random.seed(0)
+        axiom = "X"
+        rule = ProductionRule("X", "F+(rand(22,44))X")
+        result = run_test(axiom, [rule], 1)
+        expected = "F+(38.674996864686655)X"
+        self.assertEqual(expected, result)
+
+    def test_stochastic(self):
+        axiom = "X"
+        rule1 = ProductionRule("X", "FX")
+        rule2 = ProductionRule("X", "+X")
+
+        random.seed(0)
+        result = run_test(axiom, [rule1, rule2], 1)
+        expected = "+X"
+        self.assertEqual(expected, result)
+
+        random.seed(0)
+        result = run_test(axiom, [rule1, rule2], 3)
+        expected = "++FX"
+        self.assertEqual(expected, result)
+
+    def test_parametric_simple(self):
+        axiom = "A(1.0,2.0)B(3.0)"
+        rule1 = ProductionRule("A(x,y)", "A(y,x)")
+        result = run_test(axiom, [rule1], 1)
+        expected = "A(2.0,1.0)B(3.0)"
+        self.assertEqual(expected, result)
+
+    def test_parametric(self):
+        axiom = "A(2.0, 3.0)B(1.0)"
+        rule1 = ProductionRule("A(x,y)", "A(div(x,2),add(x,y))B(x)")
+
+        result = run_test(axiom, [rule1], 1)
+        expected = "A(1.0,5.0)B(2.0)B(1.0)"
+        self.assertEqual(expected, result)
+
+    def test_parametric_2(self):
+        axiom = "A(1,10)"
+        rule1 = ProductionRule("A(l,w)", "¤(w)F(l)[\(45)B(mul(l,0.6),mul(w,0.707))]>(137.5)A(mul(l,0.9),mul(w,0.707))")
+
+        result = run_test(axiom, [rule1], 1)
+        expected = "¤(10.0)F(1.0)[\(45.0)B(0.6,7.069999999999999)]>(137.5)A(0.9,7.069999999999999)"
+        self.assertEqual(expected, result)
+
+    def test_parametric_with_condition(self):
+        axiom = "A(3.0)"
+        rule1 = ProductionRule("A(x)", "B(2.0)", "lt(x,2.0)")
+        rule2 = ProductionRule("A(x)", "C(4.0)", "gt(x,2.0)")
+
+        result = run_test(axiom, [rule1, rule2], 1)
+        expected = "C(4.0)"
+        self.assertEqual(expected, result)
+
+    def test_set_pen(self):
+        axiom = "X"
+        rule1 = ProductionRule("X", "p(line)")
+        result = run_test(axiom, [rule1], 1)
+        expected = "p(line)"
+        self.assertEqual(expected, result)
+
+    def test_math(self):
+        axiom = "X(1,0.1)"
+        rule1 = ProductionRule("X(x,l)", "¤(sub(1,div(pow(x,2),16)))F(l)X(add(x,l),l)")
+        result = run_test(axiom, [rule1], 1)
+        expected = "¤(0.9375)F(0.1)X(1.1,0.1)"
+        self.assertEqual(expected, result)
+
+    def test_row_of_trees(self):
+        axiom = "A(1)"
+        rule = ProductionRule("A(s)", "F(s)[+A(div(s,1.456))][-A(div(s,1.456))]")
+        result = run_test(axiom, [rule], 2)
+        expected = "F(1.0)[+F(0.6868131868131868)[+A(0.47171235358048547)][-A(0.47171235358048547)]][-F(0.6868131868131868)[+A(0.47171235358048547)][-A(0.47171235358048547)]]"
+        self.assertEqual(expected, result)
+
+    def test_abscission(self):
+        axiom = "AXA"
+        rule = ProductionRule("X", "%")
+        result = run_test(axiom, [rule], 1)
+        expected = "A"
+        self.assertEqual(expected, result)
+
+    def test_get_instance(self):
+        axiom = "X"
+        rule = ProductionRule("X", "F(get(i))")
+        result = run_test(axiom, [rule], 1)
+        expected = "F(0)"
+        self.assertEqual(expected, result)
+
+    def test_get_iterations(self):
+        axiom = "X"
+        rule = ProductionRule("X", "-(get(iter))F")
+        result = run_test(axiom, [rule], 4)
+        expected = "-(0)F"
+        self.assertEqual(expected, result)
+
+    def test_get_iterations2(self):
+        axiom = "X"
+        rule = ProductionRule("X", "AX")
+        rule2 = ProductionRule("A", "F[-(get(iter))F]")
+        result = run_test(axiom, [rule, rule2], 4)
+        expected = "F[-(1)F]F[-(2)F]F[-(3)F]AX"
+        self.assertEqual(expected, result)
+
+    def test_log_and_constants(self):
+        axiom = "X(8)"
+        rule = ProductionRule("X(x)", "Y(log(x,2),log(mul(2,4),2),sqrt(x))")
+        result = run_test(axiom, [rule], 1)
+        expected = "Y(3.0,3.0,2.8284271247461903)"
+        self.assertEqual(expected, result)
+
+    def test_unknown_function(self):
+        with self.assertRaises(ValueError):
+            ProductionRule("X(x)", "F(foo(x))")
+
+    @unittest.skipIf(numpy is None, "requires numpy")
+    def test_batch(self):
+        systems = [
+            ("A(2.0, 3.0)B(1.0)", [ProductionRule("A(x,y)", "A(div(x,2),add(x,y))B(x)")], 3),
+            ("X(1,0.1)", [ProductionRule("X(x,l)", "¤(sub(1,div(pow(x,2),16)))F(l)X(add(x,l),l)")], 5),
+            ("A(1)", [ProductionRule("A(s)", "F(s)[+A(div(s,1.456))][-A(div(s,1.456))]")], 6),
+            ("A(3.0)", [ProductionRule("A(x)", "B(2.0)A(sub(x,1))", "lt(x,2.0)"),
+                        ProductionRule("A(x)", "C(eq(x,3))A(sub(x,1))", "gteq(x,2.0)")], 5),
+            ("X", [ProductionRule("X", "AX"), ProductionRule("A", "F[-(get(iter))F]")], 4),
+            ("A[BXC[D]E]F", [ProductionRule("X", "G%"), ProductionRule("F", "p(line)F")], 2),
+        ]
+        for axiom, rules, iterations in systems:
+            expected = run_test(axiom, rules, iterations)
+            result = run_test(axiom, rules, iterations, batch=True)
+            self.assertEqual(expected, result)
+
+    def test_match_without_parameters(self):
+        # a rule without parameters rewrites the module with any parameters
+        rules = [ProductionRule("A", "AB(1)"), ProductionRule("B", "C")]
+        for batch, memoize in [(False, False), (True, False), (False, True)]:
+            self.assertEqual("AB(1.0)C", run_test("A(2)", rules, 2, batch, memoize))
+        lsystem = LSystem(ProductionRule("", "A(1)"), [ProductionRule("A(x)", "C(x)"), ProductionRule("A", "D")], None)
+        results = set(str(Preview(lsystem.derive(0, 1, random.Random(seed)))) for seed in range(0, 20))
+        self.assertEqual({"C(1.0)", "D"}, results)
+        self.assertEqual("C(1.0)", run_test("A(1)", [ProductionRule("A(x)", "C(x)"), ProductionRule("A", "D", "lt(1,0)")], 1))
+
+        lsystem = LSystem(ProductionRule("", "A(2)A"), rules, None)
+        growth = lsystem.predict_growth(5)
+        self.assertTrue(growth.exact)
+        for i in range(0, 6):
+            self.assertEqual(len(lsystem.derive(0, i)), growth.high[i])
+        rules = [ProductionRule("A(x)", "AA"), ProductionRule("A", "B")]
+        lsystem = LSystem(ProductionRule("", "A(2)"), rules, None)
+        growth = lsystem.predict_growth(1)
+        self.assertFalse(growth.exact)
+        self.assertEqual({1, 2}, set(len(lsystem.derive(0, 1, random.Random(seed))) for seed in range(0, 20)))
+        self.assertTrue(growth.low[-1] <= 1 and 2 <= growth.high[-1])
+
+    def test_memoize(self):
+        systems = [
+            ("A", [ProductionRule("A", "AB"), ProductionRule("B", "A")], 12),
+            ("Fr", [ProductionRule("Fa", "Fr+Fa+Fr"), ProductionRule("Fr", "Fa-Fr-Fa")], 7),
+            ("X", [ProductionRule("X", "F-[[X]+X]+F[+FX]-X"), ProductionRule("F", "FF")], 6),
+            ("X(1)", [ProductionRule("X", "F(2)[X]"), ProductionRule("F", "F")], 1),
+        ]
+        for axiom, rules, iterations in systems:
+            lsystem = LSystem(ProductionRule("", axiom), rules, None)
+            self.assertIsNotNone(lsystem.expansions)
+            for i in range(iterations, -1, -1):
+                expected = run_test(axiom, rules, i, memoize=False)
+                self.assertEqual(expected, lsystem.iterate(0, i))
+
+        lsystem = LSystem(ProductionRule("", "X"), [ProductionRule("X", "FX"), ProductionRule("X", "+X")], None)
+        self.assertIsNone(lsystem.expansions)
+
+    def test_generations(self):
+        axiom = ProductionRule("", "X(1)")
+        rules = [ProductionRule("X(x)", "F(x)[+X(mul(x,0.5))]X(rand(0,x))"), ProductionRule("X(x)", "F(x)X(x)")]
+        lsystem = LSystem(axiom, rules, None)
+        generations = list(lsystem.generations(0, 5, random.Random(3)))
+        self.assertEqual(6, len(generations))
+        for i, modules in enumerate(generations):
+            self.assertEqual(lsystem.derive(0, i, random.Random(3)), modules)
+
+    def test_predict_growth(self):
+        lsystem = LSystem(ProductionRule("", "A"), [ProductionRule("A", "AB"), ProductionRule("B", "A")], None)
+        growth = lsystem.predict_growth(8)
+        self.assertTrue(growth.exact)
+        for i in range(0, 9):
+            self.assertEqual(len(lsystem.derive(0, i)), growth.high[i])
+
+        rules = [ProductionRule("X(x)", "F(x)[+X(x)]X(x)", "lt(x,3)"), ProductionRule("X(x)", "X(add(x,1))F")]
+        lsystem = LSystem(ProductionRule("", "X(0)"), rules, [ProductionRule("F", "FF")])
+        growth = lsystem.predict_growth(6)
+        self.assertFalse(growth.exact)
+        random.seed(1)
+        size = len(lsystem.derive(0, 6))
+        self.assertTrue(growth.low[-1] <= size <= growth.high[-1])
+
+        lsystem = LSystem(ProductionRule("", "A"), [ProductionRule("A", "AB"), ProductionRule("B", "A")], None)
+        growth = lsystem.predict_growth(8)
+        lsystem.max_modules = growth.high[-1] - 1
+        with self.assertRaises(GrowthLimitError):
+            lsystem.derive(0, 8)
+        lsystem.max_modules = growth.max_modules()
+        lsystem.check_budget(8)
+        self.assertEqual((8, growth.max_modules(), None), lsystem.checked_budget)
+        # a passed check doesn't hide a smaller limit
+        lsystem.max_modules -= 1
+        with self.assertRaises(GrowthLimitError):
+            lsystem.check_budget(8)
+
+    def test_inexact_budget(self):
+        # the condition ends the growth long before the upper bound of the prediction
+        rules = [ProductionRule("A(s)", "F(s)[+A(mul(s,0.5))][-A(mul(s,0.85))]", "gteq(s,0.5)")]
+        lsystem = LSystem(ProductionRule("", "A(10)"), rules, None)
+        growth = lsystem.predict_growth(25)
+        self.assertFalse(growth.exact)
+        lsystem.max_modules = 100000
+        self.assertGreater(growth.max_modules(), lsystem.max_modules)
+        with self.assertLogs(logger, "WARNING"):
+            size = len(lsystem.derive(0, 25))
+        self.assertLess(size, lsystem.max_modules)
+
+    def test_modules(self):
+        axiom = ProductionRule("", "A(1)B")
+        rule = ProductionRule("A(x)", "A(add(x,1))[p(line)]")
+        lsystem = LSystem(axiom, [rule], None)
+        result = lsystem.derive(0, 1)
+        expected = [("A", (2.0,)), ("[", ()), ("p", ("line",)), ("]", ()), ("B", ())]
+        self.assertEqual(expected, result)
+
+    def test_multi_character_modules(self):
+        axiom = "Fr"
+        rule1 = ProductionRule("Fa", "Fr+Fa+Fr")
+        rule2 = ProductionRule("Fr", "Fa-Fr-Fa")
+        result = run_test(axiom, [rule1, rule2], 2)
+        expected = "Fr+Fa+Fr-Fa-Fr-Fa-Fr+Fa+Fr"
+        self.assertEqual(expected, result)
+
+    def test_longest_match(self):
+        axiom = "FaF"
+        rule1 = ProductionRule("F", "G")
+        rule2 = ProductionRule("Fa", "H")
+        result = run_test(axiom, [rule1, rule2], 1)
+        expected = "HG"
+        self.assertEqual(expected, result)
+
+    def test_abscission_branch(self):
+        axiom = "A[BXC[D]E]F"
+        rule = ProductionRule("X", "G%")
+        result = run_test(axiom, [rule], 1)
+        expected = "A[BG]F"
+        self.assertEqual(expected, result)
+
+    def test_replacements(self):
+        axiom = ProductionRule("", "A")
+        rule = ProductionRule("A", "AB")
+        replacement = ProductionRule("B", "F")
+        lsystem = LSystem(axiom, [rule], [replacement])
+        result = lsystem.iterate(0, 2)
+        expected = "AFF"
+        self.assertEqual(expected, result)
+
+    def test_threads(self):
+        axiom = ProductionRule("", "X(1)")
+        rules = [ProductionRule("X(x)", "F(x)[+X(mul(x,0.5))]X(rand(0,x))"),
+                 ProductionRule("X(x)", "F(x)[-X(x)]X(get(i))"),
+                 ProductionRule("F", "FF")]
+        lsystem = LSystem(axiom, rules, None)
+        expected = [lsystem.iterate(instance, 6, random.Random(instance)) for instance in range(0, 8)]
+        results = [None] * len(expected)
+
+        def derive(instance):
+            results[instance] = lsystem.iterate(instance, 6, random.Random(instance))
+        threads = [threading.Thread(target=derive, args=(i,)) for i in range(0, len(expected))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(expected, results)
+
+        with self.assertRaises(AttributeError):
+            rules[0].values = (1.0,)
+
+    def test_chunks(self):
+        axiom = ProductionRule("", "A[BXC[D]E]F[X[X]]X")
+        rules = [ProductionRule("X", "G%"), ProductionRule("F", "F[X]F"), ProductionRule("B", "BX")]
+        expected = [run_test(axiom.result, rules, i) for i in range(0, 5)]
+        lsystem = LSystem(axiom, rules, None)
+        for chunk_size in (1, 2, 3, 5, 100000):
+            lsystem.chunk_size = chunk_size
+            for workers in (1, 2):
+                lsystem.chunk_workers = workers
+                self.assertEqual(expected, [modules_to_string(m) for m in lsystem.generations(0, 4)])
+
+        axiom = ProductionRule("", "X(1)")
+        rules = [ProductionRule("X(x)", "F(x)[+X(mul(x,0.5))]X(rand(0,x))"),
+                 ProductionRule("X(x)", "F(x)[-X(x)%]X(get(iter))")]
+        lsystem = LSystem(axiom, rules, None)
+        lsystem.chunk_workers = 1
+        expected = lsystem.iterate(3, 6, random.Random(1))
+        for chunk_size in (1, 4, 7):
+            lsystem.chunk_size = chunk_size
+            for workers in (1, 3):
+                lsystem.chunk_workers = workers
+                self.assertEqual(expected, lsystem.iterate(3, 6, random.Random(1)))
+        # the processes are started once for all the generations and derivations
+        pool = lsystem.get_chunk_pool()
+        lsystem.iterate(4, 6, random.Random(2))
+        self.assertIs(pool, lsystem.get_chunk_pool())
+        lsystem.close()
+        self.assertIsNone(lsystem.chunk_pool)
+
+    @unittest.skipIf(numpy is None, "requires numpy")
+    def test_save_generations(self):
+        import tempfile
+        axiom = ProductionRule("", "X(1)")
+        rules = [ProductionRule("X(x)", "F(x)[+X(mul(x,0.5))]X(rand(0,x))A(get(iter))p(line)"),
+                 ProductionRule("X(x)", "F(x)[-X(x)%]X(x)")]
+        lsystem = LSystem(axiom, rules, None)
+        expected = list(lsystem.generations(2, 5, random.Random(4)))
+        with tempfile.TemporaryDirectory() as path:
+            generations = lsystem.save_generations(path, 2, 5, random.Random(4))
+            self.assertEqual(expected, [list(generation) for generation in generations])
+            self.assertEqual(expected[-1][-1], generations[-1][-1])
+            self.assertEqual(expected, [list(MappedGeneration(os.path.join(path, str(i)))) for i in range(0, 6)])
+
+            # float32 parameters take half the space and keep about 7 digits
+            generations = lsystem.save_generations(os.path.join(path, "f"), 2, 5, random.Random(4), float_type="f")
+            self.assertEqual(numpy.float32, generations[-1].params.dtype)
+            self.assertEqual(len(expected[-1]), len(generations[-1]))
+            for (name, params), (saved_name, saved_params) in zip(expected[-1], generations[-1]):
+                self.assertEqual(name, saved_name)
+                for param, saved_param in zip(params, saved_params):
+                    if isinstance(param, float):
+                        self.assertAlmostEqual(param, saved_param, delta=abs(param) * 1e-6)
+                    else:
+                        self.assertEqual(param, saved_param)
+
+            with GenerationWriter(os.path.join(path, "empty")) as writer:
+                writer.write([])
+            self.assertEqual([], list(MappedGeneration(os.path.join(path, "empty"))))
+
+            # a failed write doesn't leave a generation behind, not even the one written before
+            with self.assertRaises(ValueError):
+                with GenerationWriter(os.path.join(path, "5")) as writer:
+                    writer.write([("F", (1.0,)), ("F", (None,))])
+            with self.assertRaises(FileNotFoundError):
+                MappedGeneration(os.path.join(path, "5"))
+
+    def test_import(self):
+        # the engine doesn't import what only some of its parts use
+        import subprocess
+        import sys
+        code = ("import sys, lsystem.lsystem\n"
+                "print(sorted(set(sys.modules) & {'numpy', 'json', 'concurrent.futures', 'unittest'}))")
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+        self.assertEqual("[]", result.stdout.strip())
+
+    def test_packed_modules(self):
+        modules = [("F", (1.0, 2)), ("[", ()), ("p", ("line",)), ("]", ()), ("Fa", (float("inf"), True))]
+        packed = PackedModules(modules)
+        self.assertEqual(len(modules), len(packed))
+        self.assertEqual(modules, packed.unpack())
+        self.assertEqual([type(v) for m in modules for v in m[1]], [type(v) for m in packed.unpack() for v in m[1]])
+
+    def test_workers(self):
+        axiom = ProductionRule("", "X(1)")
+        rules = [ProductionRule("X(x)", "F(x)[+X(mul(x,0.5))]X(rand(0,x))"),
+                 ProductionRule("X(x)", "F(x)[-X(x)]X(get(i))")]
+        lsystem = LSystem(axiom, rules, [ProductionRule("F(x)", "F(x)G(rand(0,1))")])
+        seeds = [5, 6, 7, 8, 9]
+        expected = [[(i, list(modules)) for i, modules in derivation]
+                    for derivation in derive_instances(lsystem, seeds, 2, 5)]
+        result = [[(i, list(modules)) for i, modules in derivation]
+                  for derivation in derive_instances(lsystem, seeds, 2, 5, workers=2)]
+        self.assertEqual(expected, result)
+        self.assertEqual([2, 3, 4, 5], [iterations for iterations, modules in result[0]])
+        self.assertEqual(lsystem.derive(4, 3, random.Random(9)), result[4][1][1])
+
+    def test_fused_replacements(self):
+        systems = [
+            ("X(1)", [ProductionRule("X(x)", "F(x)[+X(mul(x,0.5))]X(rand(0,x))"),
+                      ProductionRule("X(x)", "F(x)[-X(x)%]X(x)")], [ProductionRule("F(x)", "F(x)G(rand(0,1))%")]),
+            ("X", [ProductionRule("X", "F-[[X]+X]+F[+FX]-X"), ProductionRule("F", "FF")], [ProductionRule("X", "A")]),
+            ("Fr", [ProductionRule("Fa", "Fr+Fa+Fr"), ProductionRule("Fr", "Fa-Fr-Fa")],
+             [ProductionRule("Fa", "F"), ProductionRule("Fr", "F")]),
+        ]
+        for axiom, rules, replacements in systems:
+            lsystem = LSystem(ProductionRule("", axiom), rules, replacements)
+            for iterations in range(0, 6):
+                rng = random.Random(iterations)
+                seed = rng.getrandbits(64)
+                generation = list(lsystem.generations(0, iterations, rng))[-1]
+                expected = lsystem.replace(0, generation, random.Random(seed + iterations))
+                self.assertEqual(expected, lsystem.derive(0, iterations, random.Random(iterations)))
+        self.assertIsNotNone(lsystem.replacement_successors)
+
+    def test_report(self):
+        axiom = ProductionRule("", "X(1)")
+        rules = [ProductionRule("X(x)", "F(x)[+X(mul(x,0.5))]X(x)", "lt(x,2)"), ProductionRule("F(x)", "F(x)F(x)")]
+        lsystem = LSystem(axiom, rules, [ProductionRule("F(x)", "G(x)")])
+        events = []
+        report = Report(lambda event, data: events.append(event))
+        replaced = 0
+        for iterations, modules in lsystem.derive_range(0, 1, 3, random.Random(1), report=report):
+            replaced += len([module for module in modules if module[0] == "G"])
+        self.assertEqual([1, 2, 3], [generation["iteration"] for generation in report.generations])
+        self.assertEqual(["generation"] * 3, events)
+        # the generations are lazy because of the replacements, their time is
+        # spent while they're used
+        self.assertTrue(all(generation["seconds"] > 0.0 for generation in report.generations))
+        hits = report.as_dict()["rule_hits"]
+        self.assertEqual(1 + 2 + 4, hits[str(rules[0])])
+        self.assertEqual(0 + 1 + 4, hits[str(rules[1])])
+        self.assertEqual(replaced, hits["'F(x)' -> 'G(x)'"])
+        with report.timer("test"):
+            pass
+        self.assertEqual(1, report.calls["test"])
+        self.assertIn("test", str(report))
+
+    def test_report_nested_timers(self):
+        import unittest.mock
+        report = Report()
+        clock = iter([0.0, 1.0, 5.0, 10.0])
+        with unittest.mock.patch("time.perf_counter", lambda: next(clock)):
+            with report.timer("outer"):
+                with report.timer("middle"):
+                    report.add_time("pen_end", 2.0)
+        # each phase gets the time not spent in the phases nested in it
+        self.assertEqual({"outer": 6.0, "middle": 2.0, "pen_end": 2.0}, dict(report.timings))
+        clock = iter([0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 10.0])
+        with unittest.mock.patch("time.perf_counter", lambda: next(clock)):
+            with report.timer("interpret"):
+                # each module and the end take a second to derive
+                modules = list(counted(["F", "X"], report, 0, 1))
+        self.assertEqual(["F", "X"], modules)
+        self.assertEqual({"instance": 0, "iteration": 1, "modules": 2, "seconds": 3.0}, report.generations[-1])
+        self.assertEqual(7.0, report.timings["interpret"])
+
+    def test_preview(self):
+        self.assertEqual("F(1.0)[+X]", str(Preview([("F", (1.0,)), ("[", ()), ("+", ()), ("X", ()), ("]", ())], 10)))
+        self.assertEqual("AAAAA... (10 modules)", str(Preview([("A", ())] * 10, 5)))
+        self.assertEqual("", str(Preview([])))
+
+    def test_stream(self):
+        systems = [
+            ("X(1)", [ProductionRule("X(x)", "F(x)[+X(mul(x,0.5))]X(rand(0,x))"),
+                      ProductionRule("X(x)", "F(x)[-X(x)%]X(x)")], [ProductionRule("F(x)", "F(x)G(rand(0,1))")]),
+            ("X", [ProductionRule("X", "F-[[X]+X]+F[+FX]-X"), ProductionRule("F", "FF")], [ProductionRule("X", "A")]),
+            ("A", [ProductionRule("A", "AB"), ProductionRule("B", "A")], None),
+        ]
+        for axiom, rules, replacements in systems:
+            lsystem = LSystem(ProductionRule("", axiom), rules, replacements)
+            for iterations in range(0, 6):
+                expected = lsystem.derive(0, iterations, random.Random(iterations))
+                stream = lsystem.stream(0, iterations, random.Random(iterations))
+                if iterations > 0:
+                    self.assertFalse(isinstance(stream, list))
+                self.assertEqual(expected, list(stream))
+
+        # the global random state is used and reseeded while the modules are used
+        lsystem = LSystem(ProductionRule("", systems[0][0]), systems[0][1], systems[0][2])
+        expected = lsystem.derive(0, 5, random.Random(3))
+        streamed = []
+        for module in lsystem.stream(0, 5, random.Random(3)):
+            random.seed(0)
+            random.random()
+            streamed.append(module)
+        self.assertEqual(expected, streamed)
+        with self.assertRaises(TypeError):
+            lsystem.stream(0, 5)
+
+    @unittest.skipIf(numpy is None, "requires numpy")
+    def test_numpy_generator(self):
+        axiom = ProductionRule("", "X(1)")
+        rules = [ProductionRule("X(x)", "F(x)[+X(rand(0,x))]X(x)"), ProductionRule("X(x)", "F(x)X(x)")]
+        lsystem = LSystem(axiom, rules, None)
+        for batch in (False, True):
+            lsystem.batch = batch
+            expected = lsystem.iterate(0, 5, numpy.random.default_rng(7))
+            self.assertEqual(expected, lsystem.iterate(0, 5, numpy.random.default_rng(7)))
+
+
+if __name__ == "__main__":
+    unittest.main()
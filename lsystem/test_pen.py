@@ -0,0 +1,99 @@
+# The tests of pen.py, they need Blender and are skipped without it
+import unittest
+
+try:
+    import bpy
+    import mathutils
+except ImportError:
+    bpy = None
+
+if bpy is not None:
+    from . import pen
+
+
+def draw(drawing_pen, commands):
+    """Draw with the pen like the turtle does: F draws and f moves one unit
+    along the axis after it, [ and ] start and end a branch. Return the
+    Geometry of all the parts"""
+    position = mathutils.Vector((0, 0, 0))
+    stack = []
+    geometry = pen.Geometry()
+    drawing_pen.start(mathutils.Matrix.Translation(position))
+    for command, axis in zip(commands[::2], commands[1::2]):
+        if command == "[":
+            stack.append(position.copy())
+            drawing_pen.start_branch()
+        elif command == "]":
+            position = stack.pop()
+            part = drawing_pen.end_branch()
+            if part is not None:
+                geometry.extend(part)
+        else:
+            position[axis] += 1
+            if command == "F":
+                drawing_pen.move_and_draw(mathutils.Matrix.Translation(position))
+            else:
+                drawing_pen.move(mathutils.Matrix.Translation(position))
+    part = drawing_pen.end()
+    if part is not None:
+        geometry.extend(part)
+    return geometry
+
+
+# F along z, a branch that only moves along x, then F along z again
+BRANCH_ENDS_WITH_MOVE = ["F", 2, "[", 0, "f", 0, "]", 0, "F", 2]
+
+
+@unittest.skipIf(bpy is None, "needs Blender (bpy)")
+class TestPen(unittest.TestCase):
+    def tearDown(self):
+        for mesh in [mesh for mesh in bpy.data.meshes if mesh.name.startswith("test_pen")]:
+            bpy.data.meshes.remove(mesh)
+
+    def write(self, geometry):
+        mesh = bpy.data.meshes.new("test_pen")
+        geometry.write(mesh)
+        return mesh
+
+    def test_edge_pen_branch_ends_with_move(self):
+        # the vertex the branch moved to is the last one but an edge ends at the
+        # vertex after it, only a vertex no edge ends at may be dropped
+        vertices, loops, face_sizes, edges = draw(pen.EdgePen(False, 0), BRANCH_ENDS_WITH_MOVE).arrays()[:4]
+        self.assertEqual(len(vertices), 4)
+        self.assertEqual(edges.tolist(), [[0, 1], [1, 3]])
+
+    def test_edge_pen_ends_with_move(self):
+        vertices, loops, face_sizes, edges = draw(pen.EdgePen(False, 0), ["F", 2, "f", 0]).arrays()[:4]
+        self.assertEqual(len(vertices), 2)
+        self.assertEqual(edges.tolist(), [[0, 1]])
+
+    def test_write_without_validation(self):
+        # Geometry.write doesn't validate by default, the meshes must be valid
+        # as they are, validate() returns True if it had to fix something
+        commands = ["F", 2, "[", 0, "F", 0, "[", 1, "F", 1, "]", 0, "f", 0, "]", 0, "F", 2, "F", 1]
+        pens = {"edge": lambda: pen.EdgePen(False, 0),
+                "skin": lambda: pen.EdgePen(True, 0),
+                "cyl5": lambda: pen.CylPen(5),
+                "quad": lambda: pen.BCylPen(4),
+                "line": pen.BLinePen}
+        for name, make_pen in pens.items():
+            for drawn in (commands, BRANCH_ENDS_WITH_MOVE):
+                with self.subTest(pen=name, commands=drawn):
+                    mesh = self.write(draw(make_pen(), drawn))
+                    self.assertGreater(len(mesh.vertices), 0)
+                    self.assertFalse(mesh.validate())
+
+    def test_write_parts(self):
+        # the indices of the later parts are offset by the vertices before them
+        geometry = draw(pen.CylPen(4), ["F", 2])
+        geometry.extend(draw(pen.EdgePen(False, 0), ["F", 0, "F", 1]))
+        mesh = self.write(geometry)
+        self.assertEqual((len(mesh.vertices), len(mesh.polygons)), (11, 4))
+        edges = {tuple(sorted(edge.vertices)) for edge in mesh.edges}
+        self.assertLessEqual({(8, 9), (9, 10)}, edges)
+        self.assertEqual(len(edges), 12 + 2)
+        self.assertFalse(mesh.validate())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,23 +1,29 @@
 from typing import Union
+import logging
+import time
 
 import mathutils
+from . import core
+from . import lsystem
 from . import pen
 from . import util
-from math import radians
-from math import pi
+from .util import matmul
 from math import acos
-import random
 import bpy
-import bmesh
+
+logger = logging.getLogger(__name__)
 
 
 class BlObject:
-    def __init__(self, radius, name="lsystem"):
+    def __init__(self, radius, name="lsystem", report=lsystem.NULL_REPORT, validate=False):
+        self.report = report
         self.stack = []
         self.radius = radius
         self.pen = pen.CylPen(4)
         self.materials = []
-        self.bmesh = bmesh.new()
+        self.validate = validate
+        self.geometry = pen.Geometry()
+        self.pen_seconds = 0.0  # reported once in finish, a ] is too common to report each one
         self.mesh = bpy.data.meshes.new(name)
         self.object = bpy.data.objects.new(self.mesh.name, self.mesh)
         self.last_indices = []
@@ -38,10 +44,10 @@ class BlObject:
         elif name.startswith("subsurf"):
             try:
                 subdiv = int(name[7:])
-                print("subdiv "+str(subdiv))
+                logger.debug("subdiv %d", subdiv)
                 self.pen = pen.EdgePen(True, subdiv)
             except Exception:
-                print("Invalid subsurf '"+name+"'")
+                logger.warning("Invalid subsurf '%s'", name)
         elif name == "curve":
             self.pen = pen.CurvePen()
         elif name == "line":
@@ -58,9 +64,9 @@ class BlObject:
                 vertices = int(name[3:])
                 self.pen = pen.CylPen(vertices)
             except Exception:
-                print("Invalid cyl '"+name+"'")
+                logger.warning("Invalid cyl '%s'", name)
         else:
-            print("No pen with name '"+name+"' found")
+            logger.warning("No pen with name '%s' found", name)
             return
         self.start_new_mesh_part(transform)
 
@@ -81,22 +87,20 @@ class BlObject:
     def get_radius(self):
         return self.pen.get_radius()
 
-    def push(self, transform):
-        t = (transform, self.pen)
+    def push(self, state):
+        t = (state, self.pen)
         self.pen.start_branch()
         self.stack.append(t)
 
     def pop(self):
         if not self.stack:
             return None
-        transform, pen = self.stack.pop()
+        state, pen = self.stack.pop()
         if self.pen is not pen:
             self.end_mesh_part()
         self.pen = pen
-        mesh = self.pen.end_branch()
-        if mesh is not None:
-            self.bmesh.from_mesh(mesh)
-        return transform
+        self.end_pen(self.pen.end_branch)
+        return state
 
     def is_new_mesh_part(self):
         return self.last_indices is None
@@ -107,9 +111,18 @@ class BlObject:
         self.pen.start(transform)
 
     def end_mesh_part(self):
-        new_mesh = self.pen.end()  # pen.end() will return a mesh if it's really the end and not just a branch closing
-        if new_mesh is not None:
-            self.bmesh.from_mesh(new_mesh)
+        # pen.end() returns a Geometry if it's really the end and not just a branch closing
+        self.end_pen(self.pen.end)
+
+    def end_pen(self, end):
+        """Call end or end_branch of the pen and add the Geometry it returns"""
+        start = time.perf_counter()
+        self.add_geometry(end())
+        self.pen_seconds += time.perf_counter() - start
+
+    def add_geometry(self, geometry):
+        if geometry is not None:
+            self.geometry.extend(geometry)
 
     def get_last_indices(self):
         return self.last_indices
@@ -120,13 +133,20 @@ class BlObject:
     def finish(self, context):
         # print("turtle.finish")
         # print(str(self.pen))
-        new_mesh = self.pen.end()
-        if new_mesh is not None:
-            self.bmesh.from_mesh(new_mesh)
-
-        # me = bpy.data.meshes.new("lsystem")
-        self.bmesh.to_mesh(self.mesh)
-        base = util.link(context, self.object)
+        self.end_pen(self.pen.end)
+        self.report.add_time("pen_end", self.pen_seconds)
+
+        # the parts of all the pens are written into the mesh at once
+        with self.report.timer("to_mesh"):
+            self.geometry.write(self.mesh, self.validate)
+        self.report.count("vertices", len(self.mesh.vertices))
+        self.report.count("faces", len(self.mesh.polygons))
+        self.report.count("geometry_bytes", self.geometry.nbytes())
+        self.report.count("temporary_datablocks", self.geometry.datablocks)
+        self.geometry = pen.Geometry()  # the arrays aren't needed anymore
+        self.report.count("objects")
+        with self.report.timer("link"):
+            base = util.link(context, self.object)
 
         return self.object, base
 
@@ -137,132 +157,88 @@ class BlObject:
         self.pen.move(transform)
 
 
-# A turtle has three attributes: location, orientation, a pen
-class Turtle:
+# The interpretation of the symbols is in core.Turtle, this turtle keeps its
+# position and frame as a mathutils.Vector and Matrix and draws with the pens of
+# a BlObject
+class Turtle(core.Turtle):
     def __init__(self, seed):
-        self.radius = 0.1
-        self.angle = radians(25.7)
-        self.length = 1.0
-        self.expansion = 1.1
-        self.shrinkage = 0.9
-        self.fat = 1.2
-        self.slinkage = 0.8
+        core.Turtle.__init__(self, seed)
         self.transform = mathutils.Matrix.Identity(4)
-        self.direction = (0.0, 0.0, 1.0)
-        self.object_stack = []
-        self.seed = seed
-        self.tropism_vector = (0.0, 0.0, 0.0)
-        self.tropism_force = 0
         self.next_copied_object_warping = mathutils.Vector((1.0, 1.0, 1.0))
+        self.validate = False  # validate the meshes of the objects
 
-        self.sym_func_map = {}
-        self.set_interpretation('F', move_forward)
-        self.set_interpretation('f', move_forward_without_draw)
-        self.set_interpretation('+', rot_y)
-        self.set_interpretation('-', rot_y_neg)
-        self.set_interpretation('^', rot_x)
-        self.set_interpretation('&', rot_x_neg)
-        self.set_interpretation('\\', rot_z_neg)
-        self.set_interpretation('/', rot_z)
-        # todo: self.set_interpretation('|', turn_around)
-        self.set_interpretation('$', rotate_upright)
-        self.set_interpretation('[', start_branch)
-        self.set_interpretation(']', end_branch)
         self.set_interpretation('{', start_face)
         self.set_interpretation('}', end_face)
-        self.set_interpretation('¤', set_current_radius)
-        self.set_interpretation('!', slink)
         self.set_interpretation('~', copy_object)
-        self.set_interpretation(':', start_object)
-        self.set_interpretation(';', end_object)
-        self.set_interpretation('#', fatten)
-        # self.set_interpretation('%', slink)  # handled in lsystem
-        self.set_interpretation('s', scale)
-        self.set_interpretation('w', warp_next_copied_object)
-        self.set_interpretation('p', set_pen)
-        self.set_interpretation('m', set_material)
-        self.set_interpretation('£', random_angle)
-
-    def set_radius(self, radius):
-        self.radius = radius
 
-    def set_angle(self, angle):
-        self.angle = angle
-
-    def set_length(self, length):
-        self.length = length
-
-    def set_expansion(self, expansion):
-        self.expansion = expansion
-
-    def set_shrinkage(self, shrinkage):
-        self.shrinkage = shrinkage
-
-    def set_fat(self, fat):
-        self.fat = fat
+    @property
+    def transform(self):
+        transform = self.frame.to_4x4()
+        transform.translation = self.position
+        return transform
 
-    def set_slinkage(self, slinkage):
-        self.slinkage = slinkage
+    @transform.setter
+    def transform(self, transform):
+        self.position = transform.to_translation()
+        self.frame = transform.to_3x3()
+
+    def rotation(self, angle, axis):
+        """Return Matrix.Rotation(angle, 3, axis), where axis is 'X', 'Y' or 'Z'"""
+        key = (angle, axis)
+        try:
+            return self.rotations[key]
+        except KeyError:
+            if len(self.rotations) >= core.MAX_ROTATIONS:
+                self.rotations.clear()
+            rotation = self.rotations[key] = mathutils.Matrix.Rotation(angle, 3, axis)
+            return rotation
 
     def set_direction(self, direction):
         self.direction = direction
         up = mathutils.Vector((0.0, 0.0, 1.0))
-        old_direction = util.matmul(self.transform, up)
+        old_direction = matmul(self.transform, up)
         quat = old_direction.rotation_difference(direction)
-        rot_matrix = quat.to_matrix().to_4x4()
-        self.transform = util.matmul(self.transform, rot_matrix)
+        self.frame = matmul(self.frame, quat.to_matrix())
 
     def rotate(self, angle, vector):
-        # print("turtle rotate")
-        # print(str(angle))
-        # print(str(vector))
-        self.transform = util.matmul(self.transform, mathutils.Matrix.Rotation(angle, 4, vector))
+        self.frame = matmul(self.frame, mathutils.Matrix.Rotation(angle, 3, vector))
 
     def rotate_y(self, angle):
-        self.rotate(angle, mathutils.Vector((0.0, 1.0, 0.0)))
+        self.frame = matmul(self.frame, self.rotation(angle, 'Y'))
 
     def rotate_x(self, angle):
-        self.rotate(angle, mathutils.Vector((1.0, 0.0, 0.0)))
+        self.frame = matmul(self.frame, self.rotation(angle, 'X'))
 
     def rotate_z(self, angle):
-        self.rotate(angle, mathutils.Vector((0.0, 0.0, 1.0)))
+        self.frame = matmul(self.frame, self.rotation(angle, 'Z'))
 
     def rotate_upright(self):
-        loc, rot, sca = self.transform.decompose()
+        # the scale is uniform so the normalized frame is the rotation
+        rot = self.frame.normalized()
         up = mathutils.Vector((0.0, 0.0, 1.0))
-        direction = util.matmul(rot, mathutils.Vector((0.0, 0.0, 1.0)))
-        old_left = util.matmul(rot, mathutils.Vector((-1.0, 0.0, 0.0)))
+        direction = rot.col[2]
+        old_left = -rot.col[0]
         new_left = direction.cross(up)
         new_left.normalize()
 
-        scalar = util.matmul(old_left, new_left)
-        print("direction {} old_left {} new_left {} scalar {}".format(direction, old_left, new_left, scalar))
+        scalar = matmul(old_left, new_left)
+        logger.debug("direction %s old_left %s new_left %s scalar %s", direction, old_left, new_left, scalar)
         if scalar >= 1.0:
             return  # lines are parallel
 
         angle = acos(scalar)  # angle is between 0 and pi
-        new_rot = util.matmul(rot.to_matrix(), mathutils.Matrix.Rotation(angle, 3, mathutils.Vector((0.0, 0.0, 1.0))))
-        test_up = util.matmul(new_rot, mathutils.Vector((0.0, 1.0, 0.0)))
+        new_rot = matmul(rot, mathutils.Matrix.Rotation(angle, 3, 'Z'))
+        test_up = new_rot.col[1]
         new_up = direction.cross(new_left)
-        print("angle {}".format(angle))
+        logger.debug("angle %s", angle)
 
-        if util.matmul(test_up, new_up) > 0:
+        if matmul(test_up, new_up) > 0:
             angle = -angle
-        print("test up {} new_up {} angle {}".format(test_up, new_up, angle))
+        logger.debug("test up %s new_up %s angle %s", test_up, new_up, angle)
         self.rotate_z(angle)
 
-    def scale_radius(self, scale, bl_obj):
-        bl_obj.set_radius(bl_obj.get_radius()*scale)
-
-    def set_current_radius(self, radius, bl_obj):
-        bl_obj.set_radius(radius)
-
-    def set_tropism(self, tropism_vector, tropism_force):
-        self.tropism_vector = tropism_vector
-        self.tropism_force = tropism_force
-
     def scale(self, scaling, bl_obj):
-        self.transform = util.matmul(self.transform, mathutils.Matrix.Scale(scaling, 4))
+        self.frame = self.frame * scaling
         self.scale_radius(scaling, bl_obj)
 
     def warp_copied_object(self, scaling: Union[float, list], bl_obj):
@@ -273,257 +249,38 @@ class Turtle:
         self.next_copied_object_warping = warping
 
     def forward(self, length):
-        vec = (0.0, 0.0, length)
-        # print("forward")
-        # print(str(vec))
-        # print(str(self.tropism_force))
-        self.transform = util.matmul(self.transform, mathutils.Matrix.Translation(vec))
+        heading = self.frame.col[2]
+        self.position = self.position + heading * length
         if self.tropism_force > 0.0:
-            loc, rot, sca = self.transform.decompose()
-            heading = util.matmul(rot, mathutils.Vector((0.0, 0.0, 1.0)))
-            tvec = heading.cross(self.tropism_vector)
+            tvec = heading.normalized().cross(self.tropism_vector)
             tforce = tvec.length * self.tropism_force
-            # print("heading {} tropism {} force {} tvec {}".format(heading, self.tropism_vector, self.tropism_force, tvec))
             self.rotate(tforce, tvec)
 
     def copy_object(self, object_name, bl_obj, obj_base_pairs):
         if object_name not in bpy.data.objects:
-            print("Invalid object name '"+object_name+"'")
+            logger.warning("Invalid object name '%s'", object_name)
             return
         obj = bpy.data.objects[object_name]
         copy = obj.copy()
-        copy.location = util.matmul(self.transform, mathutils.Vector((0.0, 0.0, 0.0)))
+        copy.location = self.position
         copy.rotation_euler = self.transform.to_euler()
         copy.scale = self.next_copied_object_warping
         self.next_copied_object_warping = mathutils.Vector((1.0, 1.0, 1.0))
-        base = util.link(bpy.context, copy)
+        with bl_obj.report.timer("link"):
+            base = util.link(bpy.context, copy)
+        bl_obj.report.count("copies")
         copy.parent = bl_obj.object
         obj_base_pairs.append((copy, base))
 
-    def set_interpretation(self, symbol, function):
-        self.sym_func_map[symbol] = function
-
-    def interpret(self, input, context):
-        # print("seed: {}".format(self.seed))
-        random.seed(self.seed)
-        obj_base_pairs = []
-        bl_obj = BlObject(self.radius)
-        bl_obj.start_new_mesh_part(self.transform)
-        self.object_stack.append(bl_obj)
-
-        pos = 0
-        tot_len = len(input)
-        while pos < tot_len:
-            parameters = []
-            c = input[pos]
-            # print("c["+str(i)+"] = "+c)
-            if pos+2 < tot_len and input[pos+1] == '(':
-                parameters, pos = self.scan_parameters(input, pos)
-            else:
-                pos += 1
-
-            self.exec_sym(obj_base_pairs, context, c, parameters)
-
-        obj, base = bl_obj.finish(context)
-        obj_base_pairs.insert(0, (obj, base))
-        return obj_base_pairs
-
-    @staticmethod
-    def scan_parameters(string, pos):
-        start = pos + 2
-        end = start
-        tot_len = len(string)
-        while end < tot_len:
-            if string[end] == ')':
-                break
-            end += 1
-        val_str = string[start:end]
-        parameters = val_str.split(",")
-        return parameters, end+1
-
-    def exec_sym(self, obj_base_pairs, context, sym, parameters):
-        bl_obj = self.object_stack[-1]
-
-        if sym in self.sym_func_map:
-            func = self.sym_func_map[sym]
-            func(self, parameters, bl_obj, obj_base_pairs, context)
-
-
-def to_float(string, default):
-    try:
-        return float(string)
-    except:
-        # Not a float, fallback to default
-        return default
-
-
-def to_float_array(array, default):
-    if len(array) > 0:
-        return to_float(array[0], default)
-    return default
-
-
-def start_branch(turtle, parameters, bl_obj, obj_base_pairs, context):
-    bl_obj.push(turtle.transform)
-
-
-def end_branch(turtle, parameters, bl_obj, obj_base_pairs, context):
-    t = bl_obj.pop()
-    if t is not None:
-        turtle.transform = t
-
-
-def start_object(turtle, parameters, bl_obj, obj_base_pairs, context):
-    bl_obj.push(turtle.transform)
-    bl_obj = BlObject(turtle.radius)
-    turtle.object_stack.append(bl_obj)
-    # bl_obj = BlObject(self.radius)
-    bl_obj.start_new_mesh_part(turtle.transform)
-
-
-def end_object(turtle, parameters, bl_obj, obj_base_pairs, context):
-    if len(turtle.object_stack) <= 1:
-        print("call to end object on stack with one or less elements")
-        return
-    obj, base = bl_obj.finish(context)
-    obj_base_pairs.append((obj, base))
-    turtle.object_stack.pop()
-    bl_obj = turtle.object_stack[-1]
-    t = bl_obj.pop()
-    if t is not None:
-        turtle.transform = t
-    obj.parent = bl_obj.object
-
-
-def move_forward(turtle, parameters, bl_obj, obj_base_pairs, context):
-    val = to_float_array(parameters, turtle.length)
-    turtle.forward(val)
-    bl_obj.move_and_draw(turtle.transform)
-
-
-def move_forward_without_draw(turtle, parameters, bl_obj, obj_base_pairs, context):
-    val = to_float_array(parameters, turtle.length)
-    turtle.forward(val)
-    bl_obj.move(turtle.transform)
-
-
-def rot_y(turtle, parameters, bl_obj, obj_base_pairs, context):
-    val = to_float_array(parameters, None)
-    if val is None:
-        val = turtle.angle
-    else:
-        val = radians(val)
-
-    turtle.rotate_y(val)
-
-
-def rot_y_neg(turtle, parameters, bl_obj, obj_base_pairs, context):
-    val = to_float_array(parameters, None)
-    if val is None:
-        val = -turtle.angle
-    else:
-        val = radians(-val)
-
-    turtle.rotate_y(val)
-
-
-def rot_x(turtle, parameters, bl_obj, obj_base_pairs, context):
-    val = to_float_array(parameters, None)
-    if val is None:
-        val = turtle.angle
-    else:
-        val = radians(val)
-
-    turtle.rotate_x(val)
-
-
-def rot_x_neg(turtle, parameters, bl_obj, obj_base_pairs, context):
-    val = to_float_array(parameters, None)
-    if val is None:
-        val = -turtle.angle
-    else:
-        val = radians(-val)
-
-    turtle.rotate_x(val)
-
-
-def rot_z(turtle, parameters, bl_obj, obj_base_pairs, context):
-    val = to_float_array(parameters, None)
-    if val is None:
-        val = turtle.angle
-    else:
-        val = radians(val)
-
-    turtle.rotate_z(val)
-
-
-def rot_z_neg(turtle, parameters, bl_obj, obj_base_pairs, context):
-    val = to_float_array(parameters, None)
-    if val is None:
-        val = -turtle.angle
-    else:
-        val = radians(-val)
-
-    turtle.rotate_z(val)
-
-
-def rotate_upright(turtle, parameters, bl_obj, obj_base_pairs, context):
-    turtle.rotate_upright()
-
-
-def random_angle(turtle, parameters, bl_obj, obj_base_pairs, context):
-    turtle.angle = random.random() * 2 * pi
-
-
-def fatten(turtle, parameters, bl_obj, obj_base_pairs, context):
-    val = to_float_array(parameters, turtle.fat)
-    turtle.scale_radius(val, bl_obj)
-
-
-def slink(turtle, parameters, bl_obj, obj_base_pairs, context):
-    val = to_float_array(parameters, turtle.slinkage)
-    turtle.scale_radius(val, bl_obj)
-
-
-def set_current_radius(turtle, parameters, bl_obj, obj_base_pairs, context):
-    val = to_float_array(parameters, 1.0)
-    turtle.set_current_radius(val, bl_obj)
-
-
-def scale(turtle, parameters, bl_obj, obj_base_pairs, context):
-    val = to_float_array(parameters, turtle.scale)
-    turtle.scale(val, bl_obj)
-
-
-def warp_next_copied_object(turtle, parameters, bl_obj, obj_base_pairs, context):
-    try:
-        assert type(parameters) in [float, list]
-        if isinstance(parameters, list):
-            assert len(parameters) == 3
-            parameters = [to_float(p, 1.0) for p in parameters]
-        else:
-            parameters = to_float(parameters, 1.0)
-
-        turtle.warp_copied_object(parameters, bl_obj)
-    except AssertionError:
-        print('wrong parameters type')
+    def new_object(self, report):
+        return BlObject(self.radius, report=report, validate=self.validate)
 
 
 def copy_object(turtle, parameters, bl_obj, obj_base_pairs, context):
     if len(parameters) == 0:
-        print("~ operator has no value")
+        logger.warning("~ operator has no value")
         return
-    turtle.copy_object(parameters[0], bl_obj, obj_base_pairs)
-
-
-def set_pen(turtle, parameters, bl_obj, obj_base_pairs, context):
-    if parameters:
-        bl_obj.set_pen(parameters[0], turtle.transform)
-
-
-def set_material(turtle, parameters, bl_obj, obj_base_pairs, context):
-    if parameters:
-        bl_obj.set_material(parameters[0])
+    turtle.copy_object(str(parameters[0]), bl_obj, obj_base_pairs)
 
 
 def start_face(turtle, parameters, bl_obj, obj_base_pairs, context):
@@ -532,3 +289,7 @@ def start_face(turtle, parameters, bl_obj, obj_base_pairs, context):
 
 def end_face(turtle, parameters, bl_obj, obj_base_pairs, context):
     bl_obj.pen.end_face()
+
+
+# faces and copies don't change the segments, see core.Turtle.interpret_arrays
+core.ARRAY_STEPS.update({start_face: None, end_face: None, copy_object: None})
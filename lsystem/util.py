@@ -1,55 +1,195 @@
-
 import bpy
+import bpy_extras.mesh_utils
+import contextlib
+import itertools
+import mathutils
+import numpy
 import operator
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The functions that differ between blender 2.7 and 2.8 are chosen once here,
+# the turtle and the pens call matmul for every vertex
+BLENDER_2_80 = hasattr(bpy.app, "version") and bpy.app.version >= (2, 80)
+BLENDER_4_0 = hasattr(bpy.app, "version") and bpy.app.version >= (4, 0)
+BLENDER_4_1 = hasattr(bpy.app, "version") and bpy.app.version >= (4, 1)
+
 
+def print_verts(mesh):
+    for v in mesh.vertices:
+        logger.debug("%s", v.co)
 
-def matmul(a, b):
-    """Perform matrix multiplication in a blender 2.7 and 2.8 safe way"""
-    if hasattr(bpy.app, "version") and bpy.app.version >= (2, 80):
-        return operator.matmul(a, b)  # the same as writing a @ b
-    else:
-        return a * b
 
+if BLENDER_2_80:
+    matmul = operator.matmul  # the same as writing a @ b
 
-def link(context, obj):
-    if hasattr(bpy.app, "version") and bpy.app.version >= (2, 80):
+    def link(context, obj):
         return context.scene.collection.objects.link(obj)
-    else:
-        return context.scene.objects.link(obj)
 
+    def select(obj, state):
+        obj.select_set(state)
+
+    def cursor_location(context):
+        return context.scene.cursor.location
 
-def to_mesh(obj, context=None):
-    print("util.to_mesh()\n{}\n{}".format(obj, obj.modifiers))
-    if hasattr(bpy.app, "version") and bpy.app.version >= (2, 80):
-        print("version >= 2.80")
+    random_face_points = bpy_extras.mesh_utils.triangle_random_points
+
+    @contextlib.contextmanager
+    def evaluated_mesh(obj, context=None):
+        """Use the mesh of obj with the modifiers applied, the mesh belongs to
+        the evaluated object and is freed afterwards"""
+        logger.debug("util.evaluated_mesh()\n%s\n%s", obj, obj.modifiers)
         if not context:
             context = bpy.context
         context.scene.collection.objects.link(obj)
-        depsgraph = context.evaluated_depsgraph_get()
-        obj_eval = obj.evaluated_get(depsgraph)
-        #new_mesh = obj_eval.to_mesh()
-        new_mesh = bpy.data.meshes.new_from_object(obj_eval, preserve_all_data_layers=True, depsgraph=depsgraph)
-        context.scene.collection.objects.unlink(obj)
-        return new_mesh
-    else:
-        new_mesh = obj.to_mesh(scene=bpy.context.scene, apply_modifiers=True, settings='PREVIEW')
-        bpy.data.objects.remove(obj)
-        return new_mesh
-
-
-def print_verts(mesh):
-    for v in mesh.vertices:
-        print(v.co)
-
+        try:
+            depsgraph = context.evaluated_depsgraph_get()
+            obj_eval = obj.evaluated_get(depsgraph)
+            try:
+                yield obj_eval.to_mesh()
+            finally:
+                obj_eval.to_mesh_clear()
+        finally:
+            context.scene.collection.objects.unlink(obj)
 
-def hide_render(obj, hide, frame):
-    if hasattr(bpy.app, "version") and bpy.app.version >= (2, 80):
+    def hide_render(obj, hide, frame):
         obj.hide_viewport = hide
         res = obj.keyframe_insert(data_path="hide_viewport", index=-1, frame=frame)
         if not res:
-            print("Failed to insert keyframe")
-    else:
+            logger.warning("Failed to insert keyframe")
+        obj.hide_render = hide
+        obj.keyframe_insert(data_path="hide_render", index=-1, frame=frame)
+else:
+    matmul = operator.mul
+
+    def link(context, obj):
+        return context.scene.objects.link(obj)
+
+    def select(obj, state):
+        obj.select = state
+
+    def cursor_location(context):
+        return context.scene.cursor_location
+
+    random_face_points = bpy_extras.mesh_utils.face_random_points
+
+    @contextlib.contextmanager
+    def evaluated_mesh(obj, context=None):
+        """Use the mesh of obj with the modifiers applied, the mesh is a
+        temporary datablock that is removed afterwards"""
+        logger.debug("util.evaluated_mesh()\n%s\n%s", obj, obj.modifiers)
+        if not context:
+            context = bpy.context
+        mesh = obj.to_mesh(scene=context.scene, apply_modifiers=True, settings='PREVIEW')
+        try:
+            yield mesh
+        finally:
+            bpy.data.meshes.remove(mesh)
+
+    def hide_render(obj, hide, frame):
         obj.hide = hide
         obj.keyframe_insert(data_path="hide", index=-1, frame=frame)
-    obj.hide_render = hide
-    obj.keyframe_insert(data_path="hide_render", index=-1, frame=frame)
+        obj.hide_render = hide
+        obj.keyframe_insert(data_path="hide_render", index=-1, frame=frame)
+
+
+
+def remove_object(obj):
+    """Remove obj and its mesh or curve if nothing else uses them, removing
+    only the object leaves the data in bpy.data until the file is reloaded"""
+    data = obj.data
+    bpy.data.objects.remove(obj, do_unlink=True)
+    if data is None or data.users > 0:
+        return
+    if isinstance(data, bpy.types.Mesh):
+        bpy.data.meshes.remove(data)
+    elif isinstance(data, bpy.types.Curve):
+        bpy.data.curves.remove(data)
+
+
+# since blender 4.1 the mesh data are attributes, reading and writing them is
+# much faster than going through the vertices, edges, loops and polygons
+if BLENDER_4_1:
+    def get_mesh_arrays(mesh):
+        """Return the vertices, edges, loops, loop starts, materials and smooth
+        flags of a mesh as flat numpy arrays"""
+        vertices = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+        if vertices.size:
+            mesh.attributes["position"].data.foreach_get("vector", vertices)
+        edges = numpy.empty(len(mesh.edges) * 2, dtype=numpy.int32)
+        if edges.size:
+            mesh.attributes[".edge_verts"].data.foreach_get("value", edges)
+        loops = numpy.empty(len(mesh.loops), dtype=numpy.int32)
+        if loops.size:
+            mesh.attributes[".corner_vert"].data.foreach_get("value", loops)
+        loop_starts = numpy.empty(len(mesh.polygons), dtype=numpy.int32)
+        mesh.polygons.foreach_get("loop_start", loop_starts)
+        materials = numpy.zeros(len(mesh.polygons), dtype=numpy.int32)
+        if "material_index" in mesh.attributes:
+            mesh.attributes["material_index"].data.foreach_get("value", materials)
+        sharp = numpy.zeros(len(mesh.polygons), dtype=numpy.bool_)
+        if "sharp_face" in mesh.attributes:
+            mesh.attributes["sharp_face"].data.foreach_get("value", sharp)
+        return vertices, edges, loops, loop_starts, materials, ~sharp
+
+    def set_mesh_arrays(mesh, vertices, edges, loops, loop_starts, materials, smooth):
+        """Write the arrays into a mesh that has room for them"""
+        if vertices.size:
+            mesh.attributes["position"].data.foreach_set("vector", vertices)
+        if edges.size:
+            mesh.attributes[".edge_verts"].data.foreach_set("value", edges)
+        if loops.size:
+            mesh.attributes[".corner_vert"].data.foreach_set("value", loops)
+        mesh.polygons.foreach_set("loop_start", loop_starts)
+        if materials.any():
+            mesh.attributes.new("material_index", 'INT', 'FACE').data.foreach_set("value", materials)
+        if not smooth.all():
+            mesh.attributes.new("sharp_face", 'BOOLEAN', 'FACE').data.foreach_set("value", ~smooth)
+else:
+    def get_mesh_arrays(mesh):
+        """Return the vertices, edges, loops, loop starts, materials and smooth
+        flags of a mesh as flat numpy arrays"""
+        vertices = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+        mesh.vertices.foreach_get("co", vertices)
+        edges = numpy.empty(len(mesh.edges) * 2, dtype=numpy.int32)
+        mesh.edges.foreach_get("vertices", edges)
+        loops = numpy.empty(len(mesh.loops), dtype=numpy.int32)
+        mesh.loops.foreach_get("vertex_index", loops)
+        loop_starts = numpy.empty(len(mesh.polygons), dtype=numpy.int32)
+        mesh.polygons.foreach_get("loop_start", loop_starts)
+        materials = numpy.empty(len(mesh.polygons), dtype=numpy.int32)
+        mesh.polygons.foreach_get("material_index", materials)
+        smooth = numpy.empty(len(mesh.polygons), dtype=numpy.bool_)
+        mesh.polygons.foreach_get("use_smooth", smooth)
+        return vertices, edges, loops, loop_starts, materials, smooth
+
+    def set_mesh_arrays(mesh, vertices, edges, loops, loop_starts, materials, smooth):
+        """Write the arrays into a mesh that has room for them"""
+        mesh.vertices.foreach_set("co", vertices)
+        mesh.edges.foreach_set("vertices", edges)
+        mesh.loops.foreach_set("vertex_index", loops)
+        mesh.polygons.foreach_set("loop_start", loop_starts)
+        if not BLENDER_4_0:  # the loop totals follow from the loop starts since 4.0
+            loop_totals = numpy.diff(numpy.append(loop_starts, len(loops)))
+            mesh.polygons.foreach_set("loop_total", loop_totals)
+        if materials.any():
+            mesh.polygons.foreach_set("material_index", materials)
+        if smooth.any():
+            mesh.polygons.foreach_set("use_smooth", smooth)
+
+
+# mathutils matrices have the buffer protocol in newer blenders, joining their
+# memory is much faster than reading them row by row
+try:
+    memoryview(mathutils.Matrix.Identity(4))
+except TypeError:
+    def matrices_array(matrices):
+        """Return the 4x4 matrices as a (n, 4, 4) array"""
+        rows = itertools.chain.from_iterable(matrices)
+        return numpy.fromiter(itertools.chain.from_iterable(rows), dtype=numpy.float32).reshape(-1, 4, 4)
+else:
+    def matrices_array(matrices):
+        """Return the 4x4 matrices as a (n, 4, 4) array"""
+        columns = numpy.frombuffer(b"".join(matrices), dtype=numpy.float32).reshape(-1, 4, 4)
+        return columns.transpose(0, 2, 1)  # the memory of a matrix is column major